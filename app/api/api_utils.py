@@ -11,6 +11,9 @@
 
 from flask import jsonify
 from flask_restful import fields
+from bson import ObjectId
+from bson.errors import InvalidId
+import base64
 import json
 
 ##
@@ -106,6 +109,12 @@ neighbors_fields = {
     'model_id': fields.String
 }
 
+batch_neighbors_fields = {
+    'results': fields.List(fields.Nested(neighbors_fields)),
+    'number_of_queries': fields.Integer,
+    'model_id': fields.String
+}
+
 errors = {
     'ModelAlreadyExists': {
         'message': "A model with the specified model_id already exists.",
@@ -206,8 +215,10 @@ def get_uri(endpoint_name, api_method='GET', uri_parameters=None, get_parameters
     topics_api_endpoint = '/topics'
     documents_api_endpoint = '/documents'
     neighbors_api_endpoint = '/neighbors'
+    stats_api_endpoint = '/stats'
 
     base_uri_by_endpoint_name = {
+        'stats': stats_api_endpoint,
         'models': models_api_endpoint,
         'model': models_api_endpoint + '/<model_id>',
         'topics': models_api_endpoint + '/<model_id>' + topics_api_endpoint,
@@ -233,4 +244,30 @@ def json_dictionary(json_dictionary_string):
         data = json.loads(json_dictionary_string)
         return data
     except:
-        raise ValueError('Data field is not valid. Should be a json encoded string.')
\ No newline at end of file
+        raise ValueError('Data field is not valid. Should be a json encoded string.')
+
+
+def encode_cursor(last_id):
+    """
+    Return the opaque next-cursor token of a page of documents, None if there is no next page.
+
+    :param last_id: ObjectId, the _id of the last assignment of the page
+    :return:
+    """
+    if last_id is None:
+        return None
+
+    return base64.urlsafe_b64encode(str(last_id).encode('ascii')).decode('ascii')
+
+
+def cursor_token(cursor_token_string):
+    """
+    Checks if the string is a valid next-cursor token (see encode_cursor) and returns the _id it points to.
+
+    :param cursor_token_string:
+    :return:
+    """
+    try:
+        return ObjectId(base64.urlsafe_b64decode(cursor_token_string.encode('ascii')).decode('ascii'))
+    except (InvalidId, ValueError, UnicodeError, TypeError):
+        raise ValueError('Cursor token is not valid. Should be the next token of the previous page.')
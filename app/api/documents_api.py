@@ -1,4 +1,7 @@
-from flask_restful import Resource, reqparse, marshal
+import json
+
+from flask import Response, stream_with_context
+from flask_restful import Resource, inputs, reqparse, marshal
 
 import config
 from api import api_utils
@@ -10,13 +13,13 @@ class Documents(Resource):
 
     def get(self, model_id, topic_id=None):
         """
-        Get all documents that have a topic assignment in model model_id
+        Get all documents that have a topic assignment in model model_id, or the documents of topic topic_id.
+        The documents of the model can be read by pages (after and limit, more_info.next is the after of the next
+        page) or streamed as newline delimited json.
 
         :param model_id:
         :return:
         """
-        topic_weight = 0.0
-
         if topic_id is not None:
             topic_id = int(topic_id)
 
@@ -24,17 +27,67 @@ class Documents(Resource):
             parser.add_argument('threshold', default=0.0, required=False,
                                 type=float, help='The minimum probability that the specified topic should '
                                      'have to consider that document as related.')
+            parser.add_argument('limit', default=None, required=False, type=int,
+                                help='The max number of documents to return, highest topic weights first.')
+            parser.add_argument('topics', default=None, required=False, type=int, action='append',
+                                help='Other topic ids that the documents should have, combined with operator.')
+            parser.add_argument('operator', default='and', required=False, type=str, choices=('and', 'or'),
+                                help='"and" for the documents that have all the topics, "or" for those that have any.')
 
             args = parser.parse_args()
-            topic_weight = args['threshold']
 
-        data = {'documents': db_utils.get_all_documents(model_id, topic_id, topic_weight)}
+            documents = lda_utils.get_topic_documents(model_id, [topic_id] + (args['topics'] or []),
+                                                      args['threshold'], args['limit'], args['operator'])
+            if documents is None:
+                return api_utils.prepare_error_response(404, 'Model id not found.',
+                                                        more_info={'model_id': model_id}), 404
+
+            data = {'documents': documents}
+        else:
+            parser = reqparse.RequestParser(bundle_errors=True)
+            parser.add_argument('after', default=None, required=False, type=api_utils.cursor_token,
+                                help='The next cursor token of the previous page.')
+            parser.add_argument('limit', default=None, required=False, type=int,
+                                help='The max number of documents of the page.')
+            parser.add_argument('stream', required=False, type=inputs.boolean, default=False,
+                                help='True to stream the documents as newline delimited json, one line per document.')
+
+            args = parser.parse_args()
+
+            if args['stream']:
+                return self.stream_documents(model_id, args['after'])
+
+            if args['limit'] is not None or args['after'] is not None:
+                limit = args['limit'] if args['limit'] is not None else config.documents_page_size
+                documents, last_id = db_utils.get_documents_page(model_id, args['after'], max(limit, 1))
+                data = {'documents': documents}
+
+                return api_utils.prepare_success_response(200, 'Documents retrieved.',
+                                                          marshal(data, api_utils.documents_fields)['documents'],
+                                                          more_info={'next': api_utils.encode_cursor(last_id)})
+
+            data = {'documents': db_utils.get_all_documents(model_id)}
 
         # data = api_utils.filter_only_exposed(data, config.exposed_fields['documents'])
         response = 'Documents retrieved.'
 
         return api_utils.prepare_success_response(200, response, marshal(data, api_utils.documents_fields)['documents'])
 
+    def stream_documents(self, model_id, after=None):
+        """
+        Stream the documents of the model as newline delimited json, one line per document, reading the db cursor
+        config.documents_stream_batch_size documents at a time.
+
+        :param model_id:
+        :param after: ObjectId, start after the assignment with this _id
+        :return:
+        """
+        def generate():
+            for d in db_utils.iter_documents(model_id, after, config.documents_stream_batch_size):
+                yield json.dumps(marshal(d, api_utils.document_fields_restricted)) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
     def put(self, model_id):
         """
         Extracts topics from a specified document and save the document in the db
@@ -51,10 +104,16 @@ class Documents(Resource):
                             help='The documents to assign topics to.')
         parser.add_argument('save_on_db', required=False, type=bool, default=True,
                             help='True to save new assignments to db, False otherwise.')
+        parser.add_argument('stream', required=False, type=inputs.boolean, default=False,
+                            help='True to stream the assignments of the documents as newline delimited json, '
+                                 'one line per document as soon as it is computed (only with documents).')
 
         args = parser.parse_args()
         save_on_db = args['save_on_db']
 
+        if args['documents'] is not None and args['stream']:
+            return self.stream_assignments(model_id, args['documents'], save_on_db)
+
         if args['doc_content'] is not None:
 
             data = {'model_id': model_id, 'document_id': args['doc_id'], 'document_content': args['doc_content']}
@@ -114,6 +173,34 @@ class Documents(Resource):
         else:
             return api_utils.prepare_error_response(response_code, response, marshalled)
 
+    def stream_assignments(self, model_id, documents, save_on_db):
+        """
+        Stream the topics assignment of the documents as newline delimited json, one line per document.
+
+        :param model_id:
+        :param documents: dictionary, keys are document ids and values are document contents
+        :param save_on_db:
+        :return:
+        """
+        model_info = db_utils.get_model_info(model_id)
+        if model_info is None:
+            return api_utils.prepare_error_response(404, 'Model id not found.', more_info={'model_id': model_id}), 404
+
+        docs = ({'doc_id': key, 'doc_content': value} for key, value in documents.items())
+
+        def generate():
+            for d, topics_assignment in lda_utils.iter_topics_for_new_docs(model_info, docs, save_on_db):
+                data = {
+                    'model_id': model_id,
+                    'document_id': d['doc_id'],
+                    'assigned_topics': sorted(
+                        lda_utils.convert_topic_assignment_to_dictionary([topics_assignment])[0]['assigned_topics'],
+                        reverse=True, key=lambda t: t['topic_weight'])
+                }
+                yield json.dumps(marshal(data, api_utils.document_fields_restricted)) + '\n'
+
+        return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
 
 class Document(Resource):
 
@@ -18,13 +18,27 @@ class Models(Resource):
 
     def get(self):
         """
-        Retrieve all available models from db.
+        Retrieve all available models from db, without their topics, all at once or by pages (after and limit,
+        more_info.next is the after of the next page).
         :return:
         """
+        parser = reqparse.RequestParser(bundle_errors=True)
+        parser.add_argument('after', default=None, required=False, type=str,
+                            help='The model id of the last model of the previous page.')
+        parser.add_argument('limit', default=None, required=False, type=int,
+                            help='The max number of models of the page.')
+
+        args = parser.parse_args()
+
+        limit = args['limit']
+        if limit is None and args['after'] is not None:
+            limit = config.models_page_size
 
-        models = {'models': db_utils.get_all_models()}
+        models, last_model_id = db_utils.get_models_summary(args['after'], None if limit is None else max(limit, 1))
+        models = {'models': models}
         # models = api_utils.filter_only_exposed(models, config.exposed_fields['models'])
-        return api_utils.prepare_success_response(200, 'Models retrieved.', marshal(models, api_utils.models_fields)), 200
+        return api_utils.prepare_success_response(200, 'Models retrieved.', marshal(models, api_utils.models_fields),
+                                                  more_info={'next': last_model_id}), 200
 
     def put(self):
         """
@@ -124,7 +138,7 @@ class Model(Resource):
         :param model_id:
         :return:
         """
-        model = db_utils.get_model(model_id)
+        model = db_utils.get_model_info(model_id)
         if model is None:
             return jsonify(api_utils.prepare_error_response(404,
                                                     'Model id not found.',
@@ -14,6 +14,12 @@ class Neighbors(Resource):
         :return:
         """
         parser = reqparse.RequestParser(bundle_errors=True)
+        parser.add_argument('method', default=None, required=False, type=str, choices=('exact', 'lsh'),
+                            help='The search method: "exact" to score all the documents, "lsh" for an approximate '
+                                 'search (only with limit).')
+        parser.add_argument('metric', default=None, required=False, type=str,
+                            choices=('cosine', 'hellinger', 'jensen_shannon'),
+                            help='The similarity metric: "cosine", "hellinger" or "jensen_shannon".')
         data = {}
 
         if document_id is None:
@@ -33,9 +39,9 @@ class Neighbors(Resource):
             args = parser.parse_args()
 
             # list of dictionaries with keys 'document_id', 'similarity_score'
-            ranked_similar_documents = lda_utils.get_similar_documents_for_query(model_id, args['text'])
-            if args['limit'] is not None:
-                ranked_similar_documents = ranked_similar_documents[:args['limit']]
+            ranked_similar_documents, similarity_method = \
+                lda_utils.get_similar_documents_for_query(model_id, args['text'], args['limit'], args['method'],
+                                                          args['metric'])
 
             data['query_text'] = args['text']
 
@@ -47,10 +53,8 @@ class Neighbors(Resource):
             args = parser.parse_args()
 
             # list of dictionaries with keys 'document_id', 'similarity_score'
-            ranked_similar_documents = lda_utils.get_similar_documents(model_id, document_id)
-
-            if args['limit'] is not None:
-                ranked_similar_documents = ranked_similar_documents[:args['limit']]
+            ranked_similar_documents, similarity_method = \
+                lda_utils.get_similar_documents(model_id, document_id, args['limit'], args['method'], args['metric'])
 
             data['source_document_id'] = document_id
 
@@ -58,6 +62,52 @@ class Neighbors(Resource):
 
         data['neighbors'] = ranked_similar_documents
         data['number_of_similar_documents'] = len(ranked_similar_documents)
+        data['similarity_method'] = similarity_method
         data['model_id'] = model_id
 
         return api_utils.prepare_success_response(200, response, marshal(data, api_utils.neighbors_fields))
+
+    def post(self, model_id, document_id=None):
+        """
+        Get documents similar to several known documents and/or textual strings w.r.t. the specified model, with a
+        single batched inference for the texts and a single scoring pass for all the queries
+        :param model_id: the model_id
+        :param document_id: string, optional, the id of a document to retrieve neighbors of, before the documents
+        :return:
+        """
+        parser = reqparse.RequestParser(bundle_errors=True)
+        parser.add_argument('documents', default=None, required=False, type=str, action='append',
+                            help='The ids of the documents to retrieve neighbors of.')
+        parser.add_argument('texts', default=None, required=False, type=str, action='append',
+                            help='The texts to retrieve neighbors of.')
+        parser.add_argument('limit', default=None, required=False, type=int,
+                            help='The max number of documents to return for each document or text.')
+        parser.add_argument('method', default=None, required=False, type=str, choices=('exact', 'lsh'),
+                            help='The search method: "exact" to score all the documents, "lsh" for an approximate '
+                                 'search (only with limit).')
+        parser.add_argument('metric', default=None, required=False, type=str,
+                            choices=('cosine', 'hellinger', 'jensen_shannon'),
+                            help='The similarity metric: "cosine", "hellinger" or "jensen_shannon".')
+
+        args = parser.parse_args()
+
+        document_ids = ([document_id] if document_id is not None else []) + (args['documents'] or [])
+        texts = args['texts'] or []
+
+        if len(document_ids) == 0 and len(texts) == 0:
+            return api_utils.prepare_error_response(400, 'Documents or texts are missing.',
+                                                    more_info={'model_id': model_id}), 400
+
+        results = lda_utils.get_similar_documents_batch(model_id, document_ids, texts, args['limit'], args['method'],
+                                                        args['metric'])
+        if results is None:
+            return api_utils.prepare_error_response(404, 'Model id not found.', more_info={'model_id': model_id}), 404
+
+        for r in results:
+            r['number_of_similar_documents'] = len(r['neighbors'])
+            r['model_id'] = model_id
+
+        data = {'results': results, 'number_of_queries': len(results), 'model_id': model_id}
+        response = 'Similar documents retrieved.'
+
+        return api_utils.prepare_success_response(200, response, marshal(data, api_utils.batch_neighbors_fields))
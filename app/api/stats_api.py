@@ -0,0 +1,21 @@
+from flask_restful import Resource
+
+from api import api_utils
+from db import db_utils
+from model import model_registry, similarity_index
+
+
+class Stats(Resource):
+
+    def get(self):
+        """
+        Retrieve runtime statistics of the api process (e.g. model cache counters, loaded similarity indexes, model
+        information cache counters, db connection pool metrics).
+
+        :return:
+        """
+        data = {'model_cache': model_registry.get_stats(), 'similarity_indexes': similarity_index.get_stats(),
+                'model_info_cache': db_utils.get_model_info_cache_stats(),
+                'db_connection_pool': db_utils.get_pool_stats()}
+
+        return api_utils.prepare_success_response(200, 'Statistics retrieved.', data), 200
@@ -20,9 +20,14 @@ class Topics(Resource):
                             help='The minimum probability that a topic should have to be returned as related to the query string.')
         parser.add_argument('text', default=None, required=False, type=str,
                             help='The query to assign topics to.')
+        parser.add_argument('top_n', default=None, required=False, type=int,
+                            help='The number of words of each topic, highest weights first, all if not specified.')
 
         args = parser.parse_args()
 
+        if args['top_n'] is not None and args['top_n'] < 1:
+            return api_utils.prepare_error_response(400, 'top_n should be a positive number of words.'), 400
+
         if args['text'] is not None:
             data = {'model_id': model_id, 'threshold': args['threshold'], 'textual_query': args['text']}
 
@@ -41,7 +46,7 @@ class Topics(Resource):
             marshalled = marshal(data, api_utils.textual_query_fields)
         else:
             # else restituisci la lista di topics
-            data = {'topics': db_utils.get_all_topics(model_id), 'model_id': model_id}
+            data = {'topics': db_utils.get_all_topics(model_id, args['top_n']), 'model_id': model_id}
 
             # data = api_utils.filter_only_exposed(data, config.exposed_fields['topics'])
             response = "Topics retrieved."
@@ -101,7 +106,19 @@ class Topic(Resource):
         :param topic_id:
         :return:
         """
-        data = db_utils.get_topic(model_id, int(topic_id))
+        parser = reqparse.RequestParser(bundle_errors=True)
+        parser.add_argument('top_n', default=None, required=False, type=int,
+                            help='The number of words of the topic, highest weights first, all if not specified.')
+        args = parser.parse_args()
+
+        if args['top_n'] is not None and args['top_n'] < 1:
+            return api_utils.prepare_error_response(400, 'top_n should be a positive number of words.'), 400
+
+        data = db_utils.get_topic(model_id, int(topic_id), args['top_n'])
+        if data is None:
+            return api_utils.prepare_error_response(404, 'Topic not found.',
+                                                    more_info={'model_id': model_id, 'topic_id': topic_id}), 404
+
         marshalled = marshal(data, api_utils.topic_fields)
         response = "Topic retrieved."
 
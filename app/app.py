@@ -11,7 +11,9 @@ from api import api_utils
 from api.documents_api import Documents, Document
 from api.models_api import Models, Model
 from api.neighbors_api import Neighbors
+from api.stats_api import Stats
 from api.topics_api import Topics, Topic
+from db import db_schema
 
 sys.path.append(os.path.abspath('.'))
 
@@ -48,6 +50,7 @@ if __name__ == "__main__":
     documents_api_endpoint = '/documents'
     neighbors_api_endpoint = '/neighbors'
 
+    api.add_resource(Stats, api_utils.get_uri('stats'), methods=['GET'], strict_slashes=False)
     api.add_resource(Models, api_utils.get_uri('models'), methods=['GET', 'PUT'],
                      strict_slashes=False)
     api.add_resource(Model, api_utils.get_uri('model'), methods=['GET', 'PATCH', 'DELETE'],
@@ -65,10 +68,13 @@ if __name__ == "__main__":
                      endpoint="doc_neighbors",
                      strict_slashes=False)
     api.add_resource(Neighbors, api_utils.get_uri('text_neighbors'),
-                     methods=['GET', 'PATCH', 'DELETE'], endpoint="text_neighbors",
+                     methods=['GET', 'POST', 'PATCH', 'DELETE'], endpoint="text_neighbors",
                      strict_slashes=False)
     api.add_resource(Documents, api_utils.get_uri('docs_topic'),
                      methods=['GET'], endpoint="docs_topic",
                      strict_slashes=False)
 
+    # create the indexes of the hot queries, see db.db_schema
+    db_schema.bootstrap()
+
     app.run(host='0.0.0.0', debug=True)
@@ -7,6 +7,18 @@ db_name                     = 'om_lda'
 documents_collection_name   = 'documents'
 models_collection_name      = 'models'
 topics_collection_name      = 'topics'
+neighbors_collection_name   = 'neighbors'
+schema_collection_name      = 'schema'  # the applied version of db.db_schema
+db_write_chunk_size         = 1000  # ids per $in lookup and writes per bulk batch (saving and reading assignments)
+
+# DATABASE CONNECTION POOL (one client per process, rebuilt after fork, metrics in /stats)
+db_max_pool_size            = 50  # max connections per server, the api threads beyond it wait for a free one
+db_min_pool_size            = 0
+db_max_idle_time_ms         = 60000  # idle connections are closed after it, None to keep them
+db_wait_queue_timeout_ms    = 5000  # max wait for a free connection, None to wait forever
+db_connect_timeout_ms       = 5000
+db_server_selection_timeout_ms = 10000
+db_socket_timeout_ms        = None  # no timeout, the writes of a training can take long
 
 # FOLDERS
 data_path                   = '/data'
@@ -56,5 +68,54 @@ exposed_fields = {
 
 # LDA
 max_number_of_words_per_topic = 30
+inference_fixed_vocabulary    = True  # vectorize new documents and queries with the model vocabulary, no refit
+# 'numpy' for the batched E-step of model.inference: scripts/benchmark_inference.py (100 topics) measures it at ~1x
+# gensim up to batches of 100 documents and ~1.35x from 1000, so it only pays off for bulk assignments
+inference_engine              = 'gensim'  # 'numpy' or 'gensim'
+inference_max_chunk_elements  = 2 ** 20  # bounds the (non zero values x topics) intermediate arrays of the E-step
+
+# INFERENCE BATCHING (requires inference_fixed_vocabulary)
+inference_batching_enabled  = False  # coalesce concurrent single-text inferences on the same model
+inference_batch_max_wait_ms = 5
+inference_batch_max_size    = 64
+inference_batch_idle_seconds = 60
+
+# INFERENCE PROCESS POOL (requires inference_fixed_vocabulary)
+inference_pool_enabled      = True
+inference_pool_size         = None  # number of worker processes, None for the number of cpus
+inference_pool_shard_size   = 1000  # number of documents assigned by a worker at a time
+inference_pool_min_documents = 2000  # smaller batches are assigned in the request process
+inference_pool_start_method = 'spawn'  # workers do not inherit threads and db connections of the api process
+
+# STREAMING AND PAGINATION
+documents_stream_chunk_size = 500  # documents assigned (and saved) at a time when streaming assignments
+models_page_size            = 100  # models per page of the models listing, when after is given without limit
+documents_page_size         = 1000  # documents per page of the documents listing, when after is given without limit
+documents_stream_batch_size = 1000  # documents read from db per round trip when streaming the documents listing
+
+# SIMILARITY SEARCH
+similarity_default_method   = 'exact'  # 'exact' to score all the documents, 'lsh' to score only the LSH candidates
+similarity_default_metric   = 'cosine'  # 'cosine', 'hellinger' or 'jensen_shannon'
+lsh_tables                  = 16  # more tables: higher recall, slower queries and build
+lsh_bits                    = 12  # bits per table, more bits: smaller buckets, faster queries, lower recall
+lsh_probes                  = 6  # neighbouring buckets probed per table, more probes: higher recall, slower queries
+similarity_index_format     = 'sparse'  # 'sparse' (csr, only the stored topic weights) or 'dense', used on build
+similarity_prune_threshold  = 0.01  # topic weights under this value are dropped from the index, rows are renormalized
+similarity_delta_max_documents = 10000  # new assignments kept aside the main index array before a compaction
+similarity_compaction_interval = 300  # seconds, new assignments are compacted in the main array at least this often
+
+# PRECOMPUTED NEIGHBORS (cosine top-k lists of every document, read by the document neighbors endpoint)
+precompute_neighbors        = False  # compute the lists after the topics assignment of the training documents
+precomputed_neighbors_k     = 50
+neighbors_max_block_elements = 2 ** 25  # bounds the block of the similarity matrix computed at a time
+
+# MODEL CACHE
+model_cache_max_bytes       = 2 * 1024 ** 3  # memory budget for the models loaded by the api process
+model_cache_max_entries     = 16
+model_mmap_loading          = True  # share the model arrays between processes through read-only memory maps
+
+# MODEL INFO CACHE (model documents without topics, read through by db_utils.get_model_info)
+model_info_cache_ttl        = 2  # seconds a cached model is used before checking its metadata version, 0 to disable
+model_info_cache_max_entries = 1024
 
 
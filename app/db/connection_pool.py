@@ -0,0 +1,125 @@
+"""
+Options and metrics of the mongo connection pools.
+
+A MongoClient is not fork safe: its pooled sockets and monitor threads would be shared with the parent by a process
+forked from the api (scripts.compute_model.ComputeModelProcess). db_utils.get_mongo_client keeps one client per process
+and builds a new one when the process id changes, with the pool sizing and timeouts of config.
+
+The pool events of the client of the current process are counted by a PoolMetrics listener: the connections checked
+out right now and at most, the check out waits and the check outs that failed (e.g. 'timeout' when the pool is full for
+longer than config.db_wait_queue_timeout_ms). The api exposes them in /stats to size the pool for the concurrency of the
+api threads.
+
+"""
+import threading
+from time import time
+
+from pymongo import monitoring
+
+import config
+
+
+def client_options():
+    """
+    Return the MongoClient keyword arguments of the pool sizing and timeouts of config
+    """
+    options = {'maxPoolSize': config.db_max_pool_size, 'minPoolSize': config.db_min_pool_size,
+               'maxIdleTimeMS': config.db_max_idle_time_ms, 'waitQueueTimeoutMS': config.db_wait_queue_timeout_ms,
+               'connectTimeoutMS': config.db_connect_timeout_ms,
+               'serverSelectionTimeoutMS': config.db_server_selection_timeout_ms,
+               'socketTimeoutMS': config.db_socket_timeout_ms}
+
+    return {k: v for k, v in options.items() if v is not None}
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Counters of the connection pool events of a client, one set of counters per server address
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.created = time()
+        self._pools = {}
+        self._lock = threading.Lock()
+        # the check out events are published by the thread that checks out the connection
+        self._waits = threading.local()
+
+    def _pool(self, address):
+        address = '{0}:{1}'.format(*address)
+        if address not in self._pools:
+            self._pools[address] = {'connections': 0, 'checked_out': 0, 'max_checked_out': 0, 'check_outs': 0,
+                                    'check_out_failures': {}, 'total_wait_seconds': 0.0, 'max_wait_seconds': 0.0,
+                                    'cleared': 0}
+        return self._pools[address]
+
+    def pool_created(self, event):
+        with self._lock:
+            self._pool(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self._pool(event.address)['cleared'] += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self._pool(event.address)['connections'] += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._pool(event.address)['connections'] -= 1
+
+    def connection_check_out_started(self, event):
+        self._waits.started = time()
+
+    def _waited(self, pool):
+        started = getattr(self._waits, 'started', None)
+        self._waits.started = None
+        if started is not None:
+            wait = time() - started
+            pool['total_wait_seconds'] += wait
+            pool['max_wait_seconds'] = max(pool['max_wait_seconds'], wait)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            self._waited(pool)
+            pool['check_out_failures'][event.reason] = pool['check_out_failures'].get(event.reason, 0) + 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            pool = self._pool(event.address)
+            self._waited(pool)
+            pool['check_outs'] += 1
+            pool['checked_out'] += 1
+            pool['max_checked_out'] = max(pool['max_checked_out'], pool['checked_out'])
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._pool(event.address)['checked_out'] -= 1
+
+    def get_stats(self):
+        """
+        Return the pool counters of each server address, with the mean check out wait.
+
+        :rtype: dict
+        :return:
+        """
+        with self._lock:
+            pools = {}
+            for address, pool in self._pools.items():
+                pools[address] = dict(pool, check_out_failures=dict(pool['check_out_failures']))
+                waits = pool['check_outs'] + sum(pool['check_out_failures'].values())
+                pools[address]['mean_wait_seconds'] = pool['total_wait_seconds'] / waits if waits > 0 else 0.0
+
+        return {'pid': self.pid, 'client_age_seconds': time() - self.created,
+                'max_pool_size': config.db_max_pool_size, 'pools': pools}
@@ -0,0 +1,189 @@
+"""
+Versioned schema of the mongo collections: the indexes of the hot queries.
+
+Each migration brings the schema from the previous version to its own. ensure_schema applies the migrations newer
+than the version recorded in the schema collection, in order, and records every version once applied. Index creation
+is idempotent (create_index does nothing when the same index exists), so the api and the worker processes starting
+together can apply the same migration.
+
+hot_queries lists the queries that the indexes are meant for, scripts/explain_queries.py checks their query plans.
+
+"""
+import logging
+import time
+
+from pymongo import ASCENDING, DESCENDING
+
+import config
+from db import db_utils
+
+schema_document_id = 'schema'
+
+
+def _create_query_indexes(database):
+    topics_collection = database[config.topics_collection_name]
+    # get_assigned_topics, get_document, get_all_documents with doc_ids
+    topics_collection.create_index([('model_id', ASCENDING), ('document_id', ASCENDING)],
+                                   name='model_id_document_id')
+    # get_documents_page, iter_documents
+    topics_collection.create_index([('model_id', ASCENDING), ('_id', ASCENDING)], name='model_id__id')
+    # get_all_documents with topic_id ($elemMatch on the assigned topics)
+    topics_collection.create_index([('model_id', ASCENDING), ('assigned_topics.topic_id', ASCENDING),
+                                    ('assigned_topics.topic_weight', DESCENDING)], name='model_id_topic_id_weight')
+
+    database[config.documents_collection_name].create_index([('document_id', ASCENDING)], name='document_id')
+
+    database[config.neighbors_collection_name].create_index([('model_id', ASCENDING), ('document_id', ASCENDING)],
+                                                            unique=True, name='model_id_document_id')
+
+    # created last: duplicate model ids must not block the other indexes nor the following migrations
+    models_collection = database[config.models_collection_name]
+    duplicates = [d['_id'] for d in models_collection.aggregate([
+        {'$group': {'_id': '$model_id', 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ], allowDiskUse=True)]
+    if len(duplicates) == 0:
+        models_collection.create_index([('model_id', ASCENDING)], unique=True, name='model_id')
+    else:
+        # the models are not merged automatically, the index stays non unique until they are removed by hand and the
+        # index is created again
+        logging.error('Duplicate model ids in the {0} collection, the model_id index is not unique: {1}.'.format(
+            config.models_collection_name, ', '.join(str(d) for d in duplicates)))
+        models_collection.create_index([('model_id', ASCENDING)], name='model_id')
+
+
+def _unique_assignments(database):
+    topics_collection = database[config.topics_collection_name]
+
+    # the assignments used to be inserted again for the same document, keep the last one of each document
+    duplicates = topics_collection.aggregate([
+        {'$group': {'_id': {'model_id': '$model_id', 'document_id': '$document_id'},
+                    'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ], allowDiskUse=True)
+    for d in duplicates:
+        topics_collection.delete_many({'_id': {'$in': sorted(d['ids'])[:-1]}})
+
+    if 'model_id_document_id' in topics_collection.index_information():
+        topics_collection.drop_index('model_id_document_id')
+    topics_collection.create_index([('model_id', ASCENDING), ('document_id', ASCENDING)], unique=True,
+                                   name='model_id_document_id')
+
+
+def _ranked_topics(database):
+    models_collection = database[config.models_collection_name]
+
+    # the words distributions used to be stored as {word: weight} dictionaries and sorted at every read
+    for model in models_collection.find({'topics.words_distribution': {'$exists': True}}, {'topics': 1}):
+        topics = []
+        for topic in sorted(model['topics'], key=lambda t: t['topic_id']):
+            if 'words_distribution' in topic:
+                topic['words'], topic['weights'] = db_utils.ranked_words(topic.pop('words_distribution'))
+            topics.append(topic)
+
+        models_collection.update_one({'_id': model['_id']}, {'$set': {'topics': topics}})
+
+
+def _unique_documents(database):
+    documents_collection = database[config.documents_collection_name]
+
+    # concurrent upserts on a non unique document_id could both insert, keep the last document of each id
+    duplicates = documents_collection.aggregate([
+        {'$group': {'_id': '$document_id', 'ids': {'$push': '$_id'}, 'count': {'$sum': 1}}},
+        {'$match': {'count': {'$gt': 1}}}
+    ], allowDiskUse=True)
+    for d in duplicates:
+        documents_collection.delete_many({'_id': {'$in': sorted(d['ids'])[:-1]}})
+
+    if 'document_id' in documents_collection.index_information():
+        documents_collection.drop_index('document_id')
+    documents_collection.create_index([('document_id', ASCENDING)], unique=True, name='document_id')
+
+
+# (version, description, function of the pymongo database)
+migrations = [
+    (1, 'indexes of the hot queries', _create_query_indexes),
+    (2, 'unique assignment of each document of a model', _unique_assignments),
+    (3, 'ranked words and weights lists of the topics', _ranked_topics),
+    (4, 'unique document of each document id', _unique_documents),
+]
+
+schema_version = migrations[-1][0]
+
+
+def get_database(custom_mongo_client=None):
+    if custom_mongo_client is None:
+        custom_mongo_client = db_utils.get_mongo_client()
+
+    return custom_mongo_client[config.db_name]
+
+
+def get_schema_version(custom_mongo_client=None):
+    """
+    Return the schema version recorded in db, 0 if no migration has been applied
+    """
+    schema = get_database(custom_mongo_client)[config.schema_collection_name].find_one({'_id': schema_document_id})
+
+    return 0 if schema is None else schema['version']
+
+
+def ensure_schema(custom_mongo_client=None):
+    """
+    Apply the migrations newer than the schema version recorded in db and record the new version.
+
+    :type custom_mongo_client: MongoClient
+    :param custom_mongo_client:
+    :return: the schema version
+    """
+    database = get_database(custom_mongo_client)
+    version = get_schema_version(custom_mongo_client)
+
+    for migration_version, description, migrate in migrations:
+        if migration_version <= version:
+            continue
+
+        migrate(database)
+        # $max: a process that applied an older migration later does not bring the version back
+        database[config.schema_collection_name].update_one(
+            {'_id': schema_document_id},
+            {'$max': {'version': migration_version}, '$set': {'applied': time.time()}}, upsert=True)
+        version = migration_version
+        logging.info('Db schema migrated to version {0}: {1}.'.format(migration_version, description))
+
+    return version
+
+
+def bootstrap():
+    """
+    Apply the pending migrations at the start of a process, errors are logged and do not stop the process
+
+    :return: the schema version, None if the migrations failed
+    """
+    try:
+        return ensure_schema()
+    except Exception:
+        logging.exception('Error during the migration of the db schema.')
+        return None
+
+
+def hot_queries(model_id, document_id, topic_id):
+    """
+    Return the hot queries of db_utils with some sample values
+
+    :return: list of tuples (name, collection name, filter, sort)
+    """
+    return [
+        ('get_model', config.models_collection_name, {'model_id': model_id}, None),
+        ('get_assigned_topics', config.topics_collection_name, {'model_id': model_id, 'document_id': document_id},
+         None),
+        ('get_all_documents', config.topics_collection_name, {'model_id': model_id}, None),
+        ('get_all_documents (topic)', config.topics_collection_name,
+         {'model_id': model_id,
+          'assigned_topics': {'$elemMatch': {'topic_id': topic_id, 'topic_weight': {'$gte': 0.1}}}}, None),
+        ('get_all_documents (doc_ids)', config.topics_collection_name,
+         {'model_id': model_id, 'document_id': {'$in': [document_id]}}, None),
+        ('get_documents_page', config.topics_collection_name, {'model_id': model_id}, [('_id', ASCENDING)]),
+        ('get_document', config.documents_collection_name, {'document_id': document_id}, None),
+        ('get_neighbors', config.neighbors_collection_name, {'model_id': model_id, 'document_id': document_id},
+         None),
+    ]
@@ -1,20 +1,58 @@
+import os
+import threading
 import time
 
 import config
-from pymongo import MongoClient
+from db import connection_pool
+from db.model_info_cache import ModelInfoCache
+from pymongo import MongoClient, ReplaceOne, UpdateOne
 from pymongo.collection import Collection
 
 mongo_client = None
+# the process that built mongo_client, a forked process builds its own client (see db.connection_pool)
+mongo_client_pid = None
+pool_metrics = None
+_mongo_client_lock = threading.Lock()
+model_info_cache = ModelInfoCache(config.model_info_cache_ttl, config.model_info_cache_max_entries)
 
 
 def get_mongo_client():
-    global mongo_client
-    if mongo_client is None:
-        mongo_client = MongoClient(config.db_host, config.db_port)
+    global mongo_client, mongo_client_pid, pool_metrics
+    pid = os.getpid()
+    if mongo_client is None or mongo_client_pid != pid:
+        with _mongo_client_lock:
+            if mongo_client is None or mongo_client_pid != pid:
+                # the client inherited from the parent is left alone: closing it would close the parent connections
+                metrics = connection_pool.PoolMetrics(pid)
+                mongo_client = MongoClient(config.db_host, config.db_port, event_listeners=[metrics],
+                                           **connection_pool.client_options())
+                mongo_client_pid, pool_metrics = pid, metrics
 
     return mongo_client
 
 
+def set_mongo_client(custom_mongo_client):
+    """
+    Use custom_mongo_client as the client of the current process (e.g. an in-process stand-in), no pool metrics
+
+    :type custom_mongo_client: MongoClient
+    :param custom_mongo_client:
+    """
+    global mongo_client, mongo_client_pid, pool_metrics
+    with _mongo_client_lock:
+        mongo_client, mongo_client_pid, pool_metrics = custom_mongo_client, os.getpid(), None
+
+
+def get_pool_stats():
+    """
+    Return the connection pool metrics of the client of the current process, None if it has not been built yet
+    """
+    if pool_metrics is None or mongo_client_pid != os.getpid():
+        return None
+
+    return pool_metrics.get_stats()
+
+
 def get_collection(collection_name, custom_mongo_client=None):
     """
     Return the collection
@@ -33,17 +71,6 @@ def get_collection(collection_name, custom_mongo_client=None):
     return db[collection_name]
 
 
-def get_all_models(collection=None):
-    if collection is None:
-        collection = get_collection(config.models_collection_name)
-
-    result = collection.find()
-    if result is None:
-        return []
-
-    return list(result)
-
-
 def get_model(model_id):
     collection = get_collection(config.models_collection_name)
 
@@ -54,13 +81,93 @@ def get_model(model_id):
         return {k: v for k, v in result.items()}
 
 
+def get_model_info(model_id):
+    """
+    Get the information of a model without its topics (words distributions, labels and descriptions), the fields
+    needed by inference, similarity search and model listing. Read through the model information cache of the process
+    (see db.model_info_cache).
+
+    :param model_id:
+    :return: dictionary, None if the model does not exist
+    """
+    return model_info_cache.get(model_id, _read_model_metadata_version, _read_model_info)
+
+
+def _read_model_info(model_id):
+    collection = get_collection(config.models_collection_name)
+
+    return collection.find_one({'model_id': model_id}, {'_id': 0, 'topics': 0})
+
+
+def _read_model_metadata_version(model_id):
+    collection = get_collection(config.models_collection_name)
+
+    result = collection.find_one({'model_id': model_id}, {'_id': 0, 'metadata_version': 1})
+    if result is None:
+        raise KeyError(model_id)
+
+    # None for a model not written since the metadata versions, until the $inc of _update_model_document
+    return result.get('metadata_version')
+
+
+def _update_model_document(model_id, values, query=None):
+    """
+    Set some values of a model document, bumping its modified time and metadata version, and drop it from the model
+    information cache
+
+    :param values: dictionary of the values to $set
+    :param query: additional filter of the model document
+    :return: the pymongo UpdateResult
+    """
+    models_collection = get_collection(config.models_collection_name)
+
+    model_query = {'model_id': model_id}
+    if query is not None:
+        model_query.update(query)
+
+    result = models_collection.update_one(model_query, {'$set': dict(values, modified=time.time()),
+                                                        '$inc': {'metadata_version': 1}})
+    model_info_cache.invalidate(model_id)
+
+    return result
+
+
+def get_model_info_cache_stats():
+    return model_info_cache.get_stats()
+
+
+def get_models_summary(after=None, limit=None):
+    """
+    Get the information of the models without their topics, in model_id order (keyset pagination on model_id)
+
+    :param after: the model_id of the last model of the previous page, None for the first page
+    :param limit: the max number of models of the page, all if None
+    :return: a pair (models, last model_id), last model_id is None on the last page
+    """
+    collection = get_collection(config.models_collection_name)
+
+    query = {} if after is None else {'model_id': {'$gt': after}}
+    cursor = collection.find(query, {'_id': 0, 'topics': 0}).sort('model_id', 1)
+    if limit is None:
+        return list(cursor), None
+
+    # one more model than the page tells if there is a next page
+    results = list(cursor.limit(limit + 1))
+    last_model_id = results[limit - 1]['model_id'] if len(results) > limit else None
+
+    return results[:limit], last_model_id
+
+
 def delete_model(model_id):
     models_collection = get_collection(config.models_collection_name)
     models_collection.delete_one({'model_id': model_id})
+    model_info_cache.invalidate(model_id)
 
     topics_collection = get_collection(config.topics_collection_name)
     topics_collection.delete_many({'model_id': model_id})
 
+    delete_all_neighbors(model_id)
+
 
 def upsert_model(model_id, model_values):
     models_collection = get_collection(config.models_collection_name)
@@ -76,70 +183,126 @@ def upsert_model(model_id, model_values):
         model_values['model_id'] = model_id
         if 'created' in model_values: del model_values['created']
 
-    model_values['modified'] = time.time()
-
     if update:
-        models_collection.update_one({'model_id': model_id}, {'$set': model_values})
+        _update_model_document(model_id, model_values)
     else:
+        model_values['modified'] = time.time()
+        model_values['metadata_version'] = 1
         models_collection.insert_one(model_values)
+        model_info_cache.invalidate(model_id)
+
+
+def ranked_words(words_distribution):
+    """
+    Return the stored form of a words distribution: the words and their weights in two parallel lists, sorted by
+    descending weight
+
+    :param words_distribution: dictionary, keys are words and values are words weights within the topic
+    :return: a pair (words, weights)
+    """
+    ranking = sorted(words_distribution.items(), key=lambda w: w[1], reverse=True)
+
+    return [w for w, _ in ranking], [float(weight) for _, weight in ranking]
 
 
-def get_all_topics(model_id):
+def _topic_projection(topic, top_n):
+    """
+    Aggregation expression of a stored topic with the first top_n words of its distribution, all if top_n is None.
+    The words distribution of a topic stored before db_schema migration 3 is read as it is, see _words_distribution.
+    """
+    projection = {'topic_id': topic + '.topic_id', 'topic_label': topic + '.topic_label',
+                  'topic_description': topic + '.topic_description',
+                  'words': {'$ifNull': [topic + '.words', []]}, 'weights': {'$ifNull': [topic + '.weights', []]},
+                  'words_distribution': topic + '.words_distribution'}
+    if top_n is not None:
+        projection['words'] = {'$slice': [projection['words'], top_n]}
+        projection['weights'] = {'$slice': [projection['weights'], top_n]}
+
+    return projection
+
+
+def _words_distribution(topic, top_n=None):
+    """
+    Turn the parallel words and weights lists of a stored topic into the words distribution of the api, a list of
+    {'w', 'w_weight'} already sorted by descending weight. A topic not migrated yet has its {word: weight} dictionary
+    instead, ranked here.
+    """
+    words, weights = topic.pop('words', None) or [], topic.pop('weights', None) or []
+    legacy_distribution = topic.pop('words_distribution', None)
+    if isinstance(legacy_distribution, dict):
+        words, weights = ranked_words(legacy_distribution)
+        words, weights = words[:top_n], weights[:top_n]
+
+    topic['words_distribution'] = [{'w': w, 'w_weight': weight} for w, weight in zip(words, weights)]
+
+    return topic
+
+
+def get_all_topics(model_id, top_n=None):
+    """
+    Get the topics of a model, the words distributions are stored ranked so only the first top_n words are read
+
+    :param model_id:
+    :param top_n: the number of words of each topic, all if None
+    :return: list of topics, None if the model does not exist
+    """
     collection = get_collection(config.models_collection_name)
 
-    result = collection.find_one({'model_id': model_id})
+    result = next(collection.aggregate([
+        {'$match': {'model_id': model_id}},
+        {'$project': {'_id': 0, 'topics': {'$map': {'input': '$topics', 'as': 't',
+                                                    'in': _topic_projection('$$t', top_n)}}}}
+    ]), None)
 
     if result is None:
         return None
 
-    topics = []
-    for i, t in enumerate(result['topics']):
-        t['words_distribution'] = sorted([{'w': k, 'w_weight': v} for k, v in t['words_distribution'].items()],
-                                         key=lambda t: t['w_weight'], reverse=True)
-        topics.append(t)
+    return [_words_distribution(t, top_n) for t in result['topics'] or []]
 
-    return topics
 
-
-def get_topic(model_id, topic_id):
+def get_topic(model_id, topic_id, top_n=None):
     """
+    Get a topic of a model, the topics are stored in topic id order so the topic is read by position
 
     :param model_id: string
     :param topic_id: int
-    :param collection:
-    :return:
+    :param top_n: the number of words of the topic, all if None
+    :return: the topic, None if the model or the topic do not exist
     """
+    if topic_id < 0:
+        return None
+
     collection = get_collection(config.models_collection_name)
 
-    result = collection.find_one({'model_id': model_id})
-    if result['topics'] is not None and len(result['topics']) != 0:
-        topic = list(filter(lambda t: t['topic_id'] == topic_id, result['topics']))[0]
-        topic['words_distribution'] = sorted([{'w': k, 'w_weight': v} for k, v in topic['words_distribution'].items()],
-                                             key=lambda t: t['w_weight'], reverse=True)
-        return topic
+    result = next(collection.aggregate([
+        {'$match': {'model_id': model_id, 'topics.{0}'.format(topic_id): {'$exists': True}}},
+        {'$project': {'_id': 0, 'topic': {'$arrayElemAt': ['$topics', topic_id]}}},
+        {'$project': _topic_projection('$topic', top_n)}
+    ]), None)
+
+    if result is None:
+        return None
 
-    return None;
+    return _words_distribution(result, top_n)
 
 
 def update_topic(model_id, topic_id, topic_label=None, topic_description=None):
-    if topic_label.strip() != "" or topic_description.strip() != "":
-        models_collection = get_collection(config.models_collection_name)
-        model = models_collection.find_one({'model_id': model_id})
-
-        if 'topics' in model and len(model['topics']) != 0:
-            if len(model['topics']) > topic_id:
-                if topic_label is not None:
-                    model['topics'][topic_id]['topic_label'] = topic_label
-                if topic_description is not None:
-                    model['topics'][topic_id]['topic_description'] = topic_description
-
-                models_collection.update_one({'model_id': model_id}, {'$set': {'topics': model['topics']}})
-                return model['topics'][topic_id]
-            else:
-                return None
-    else:
+    # an empty string clears the label or the description
+    values = {}
+    if topic_label is not None:
+        values['topics.{0}.topic_label'.format(topic_id)] = topic_label
+    if topic_description is not None:
+        values['topics.{0}.topic_description'.format(topic_id)] = topic_description
+
+    if len(values) == 0 or topic_id < 0:
         return None
 
+    result = _update_model_document(model_id, values, {'topics.{0}'.format(topic_id): {'$exists': True}})
+    if result.matched_count == 0:
+        return None
+
+    return get_topic(model_id, topic_id)
+
 
 def get_all_documents(model_id=None, topic_id=None, topic_weight=0.0, doc_ids=None):
     """
@@ -176,11 +339,71 @@ def get_all_documents(model_id=None, topic_id=None, topic_weight=0.0, doc_ids=No
     return results
 
 
-def get_all_documents_ids():
-    collection = get_collection(config.documents_collection_name)
-    results = collection.find()
-    results = [r['document_id'] for r in results]
-    return results
+def iter_assigned_topics(model_id, batch_size=10000):
+    """
+    Iterate over the topics assignments of a model with a single cursor, reading only the fields needed to build
+    the topic vectors of the documents
+
+    :param model_id:
+    :param batch_size: the number of assignments fetched per round trip
+    :return: cursor of dictionaries with keys 'document_id' and 'assigned_topics'
+    """
+    collection = get_collection(config.topics_collection_name)
+
+    return collection.find({'model_id': model_id}, {'_id': 0, 'document_id': 1, 'assigned_topics': 1},
+                           batch_size=batch_size)
+
+
+def get_documents_page(model_id, after=None, limit=1000):
+    """
+    Get a page of the documents that have an assignment w.r.t the specified model, in _id order (keyset pagination,
+    each page is a range scan that starts after the last assignment of the previous page)
+
+    :param model_id:
+    :param after: ObjectId, the _id of the last assignment of the previous page, None for the first page
+    :param limit: the max number of documents of the page
+    :return: a pair (documents, last _id), last _id is None on the last page
+    """
+    collection = get_collection(config.topics_collection_name)
+
+    query = {'model_id': model_id}
+    if after is not None:
+        query['_id'] = {'$gt': after}
+
+    # one more assignment than the page tells if there is a next page
+    results = list(collection.find(query, {'document_id': 1, 'assigned_topics': 1}).sort('_id', 1).limit(limit + 1))
+    last_id = results[limit - 1]['_id'] if len(results) > limit else None
+
+    return [{
+        'document_id': r['document_id'],
+        'model_id': model_id,
+        'assigned_topics': r['assigned_topics']
+    } for r in results[:limit]], last_id
+
+
+def iter_documents(model_id, after=None, batch_size=1000):
+    """
+    Iterate over the documents that have an assignment w.r.t the specified model with a single cursor, in _id order,
+    holding at most batch_size assignments in memory
+
+    :param model_id:
+    :param after: ObjectId, start after the assignment with this _id, None to start from the first one
+    :param batch_size: the number of assignments fetched per round trip
+    :return: generator of dictionaries with keys 'document_id', 'model_id' and 'assigned_topics'
+    """
+    collection = get_collection(config.topics_collection_name)
+
+    query = {'model_id': model_id}
+    if after is not None:
+        query['_id'] = {'$gt': after}
+
+    for r in collection.find(query, {'_id': 0, 'document_id': 1, 'assigned_topics': 1},
+                             batch_size=batch_size).sort('_id', 1):
+        yield {
+            'document_id': r['document_id'],
+            'model_id': model_id,
+            'assigned_topics': r['assigned_topics']
+        }
 
 
 def get_document(model_id, document_id, topics_threshold):
@@ -217,26 +440,86 @@ def get_texts(document_ids):
 
 
 def update_model(model_id, model_description):
-    models_collection = get_collection(config.models_collection_name)
-    models_collection.update_one({'model_id': model_id}, {'$set': {'model_description': model_description}})
+    _update_model_document(model_id, {'model_description': model_description})
 
 
 def update_model_status(model_id, model_status, model_values):
-    models_collection = get_collection(config.models_collection_name)
-    models_collection.update_one({'model_id': model_id}, {'$set': {'status': model_status,
-                                                                   'updating_process_id': model_values['process_id']}})
+    _update_model_document(model_id, {'status': model_status, 'updating_process_id': model_values['process_id']})
+
+
+def upsert_documents(docs, chunk_size=1000):
+    """
+    Insert new documents and update the text of the existing ones, keyed on document_id. Only the incoming ids are
+    looked up, with $in queries of chunk_size ids, and the writes are sent in unordered bulk batches of chunk_size.
+
+    :param docs: list of dictionaries with keys 'document_id' and 'text', the last one wins for repeated ids
+    :param chunk_size: the number of ids per lookup and of writes per batch
+    :return: dictionary with the counts of 'inserted', 'updated' and 'skipped' (same text) documents
+    """
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    docs = list({str(d['document_id']): d for d in docs}.values())
+    if len(docs) == 0:
+        return counts
+
+    docs_collection = get_collection(config.documents_collection_name)
+
+    for start in range(0, len(docs), chunk_size):
+        chunk = docs[start:start + chunk_size]
+        existing = {r['document_id']: r.get('text') for r in
+                    docs_collection.find({'document_id': {'$in': [str(d['document_id']) for d in chunk]}},
+                                         {'_id': 0, 'document_id': 1, 'text': 1})}
+
+        requests = []
+        for d in chunk:
+            document_id = str(d['document_id'])
+            if document_id not in existing:
+                counts['inserted'] += 1
+            elif existing[document_id] != d['text']:
+                counts['updated'] += 1
+            else:
+                counts['skipped'] += 1
+                continue
+
+            # an upsert on the unique document_id index (db_schema migration 4): a document written meanwhile by
+            # another process is updated, not duplicated
+            requests.append(UpdateOne({'document_id': document_id},
+                                      {'$set': {'text': d['text'], 'modified': time.time()},
+                                       '$setOnInsert': {'created': time.time()}}, upsert=True))
+
+        if len(requests) != 0:
+            docs_collection.bulk_write(requests, ordered=False)
 
+    return counts
 
-def insert_all_documents(docs):
-    if docs is not None and len(docs) != 0:
-        docs_collection = get_collection(config.documents_collection_name)
-        docs_collection.insert_many(docs)
 
+def upsert_assignments(topics_ass, chunk_size=1000):
+    """
+    Insert or replace topics assignments, keyed on (model_id, document_id), in unordered bulk batches of chunk_size
 
-def insert_all_assignments(topics_ass):
-    if topics_ass is not None and len(topics_ass) != 0:
-        topics_collection = get_collection(config.topics_collection_name)
-        topics_collection.insert_many(topics_ass)
+    :param topics_ass: list of dictionaries with keys 'model_id', 'document_id' and 'assigned_topics', the last one
+    wins for repeated keys
+    :param chunk_size: the number of writes per batch
+    :return: dictionary with the counts of 'inserted', 'updated' and 'skipped' (same topics) assignments
+    """
+    counts = {'inserted': 0, 'updated': 0, 'skipped': 0}
+    topics_ass = list({(t['model_id'], str(t['document_id'])): t for t in topics_ass}.values())
+    if len(topics_ass) == 0:
+        return counts
+
+    topics_collection = get_collection(config.topics_collection_name)
+
+    for start in range(0, len(topics_ass), chunk_size):
+        result = topics_collection.bulk_write([
+            ReplaceOne({'model_id': t['model_id'], 'document_id': str(t['document_id'])},
+                       {'model_id': t['model_id'], 'document_id': str(t['document_id']),
+                        'assigned_topics': t['assigned_topics']}, upsert=True)
+            for t in topics_ass[start:start + chunk_size]], ordered=False)
+
+        counts['inserted'] += result.upserted_count
+        counts['updated'] += result.modified_count
+        counts['skipped'] += result.matched_count - result.modified_count
+
+    return counts
 
 
 def get_assigned_topics(model_id, document_id, topics_threshold=0.0):
@@ -257,3 +540,78 @@ def get_assigned_topics(model_id, document_id, topics_threshold=0.0):
                   if a['topic_weight'] >= topics_threshold], reverse=True, key=lambda t:t['topic_weight'])
 
     return result
+
+
+def set_model_precomputed_neighbors(model_id, precomputed_neighbors):
+    _update_model_document(model_id, {'precomputed_neighbors': precomputed_neighbors})
+
+
+def get_neighbors(model_id, document_id, limit):
+    """
+    Get the precomputed neighbors of a document in a model
+
+    :param model_id:
+    :param document_id:
+    :param limit: the max number of neighbors to read
+    :return: list of dictionaries with keys 'document_id' and 'similarity_score', most similar first, None if the
+    neighbors of the document have not been computed
+    """
+    neighbors_collection = get_collection(config.neighbors_collection_name)
+
+    result = neighbors_collection.find_one({'model_id': model_id, 'document_id': str(document_id)},
+                                           {'_id': 0, 'neighbors': {'$slice': limit}})
+    if result is None:
+        return None
+
+    return result['neighbors']
+
+
+def insert_all_neighbors(neighbors):
+    """
+
+    :param neighbors: list of dictionaries with keys 'model_id', 'document_id' and 'neighbors'
+    """
+    if neighbors is not None and len(neighbors) != 0:
+        neighbors_collection = get_collection(config.neighbors_collection_name)
+        neighbors_collection.insert_many(neighbors)
+
+
+def replace_neighbors(neighbors):
+    """
+    Insert or replace the neighbors lists of some documents
+
+    :param neighbors: list of dictionaries with keys 'model_id', 'document_id' and 'neighbors'
+    """
+    if neighbors is not None and len(neighbors) != 0:
+        neighbors_collection = get_collection(config.neighbors_collection_name)
+        neighbors_collection.bulk_write([ReplaceOne({'model_id': n['model_id'], 'document_id': n['document_id']}, n,
+                                                    upsert=True) for n in neighbors], ordered=False)
+
+
+def merge_neighbors(model_id, new_neighbors, max_neighbors):
+    """
+    Merge new neighbors in the existing neighbors lists, keeping the max_neighbors most similar of each list. The
+    previous entries of the merged documents are replaced.
+
+    :param model_id:
+    :param new_neighbors: dictionary document_id -> list of dictionaries with keys 'document_id' and
+    'similarity_score'
+    :param max_neighbors:
+    """
+    if len(new_neighbors) != 0:
+        neighbors_collection = get_collection(config.neighbors_collection_name)
+
+        requests = []
+        for document_id, neighbors in new_neighbors.items():
+            query = {'model_id': model_id, 'document_id': document_id}
+            requests.append(UpdateOne(query, {'$pull': {'neighbors': {'document_id': {
+                '$in': [n['document_id'] for n in neighbors]}}}}))
+            requests.append(UpdateOne(query, {'$push': {'neighbors': {
+                '$each': neighbors, '$sort': {'similarity_score': -1}, '$slice': max_neighbors}}}))
+
+        neighbors_collection.bulk_write(requests, ordered=True)
+
+
+def delete_all_neighbors(model_id):
+    neighbors_collection = get_collection(config.neighbors_collection_name)
+    neighbors_collection.delete_many({'model_id': model_id})
@@ -32,24 +32,18 @@ def load_models_data():
         'use_lemmer': True,
         'topics': [
             {
-                'topic_id': 1,
+                'topic_id': 0,
                 'topic_label': 'data mining',
                 'topic_description': 'prova di description del topic data mining',
-                'words_distribution': {
-                    'w5': 0.3,
-                    'w1': 0.2,
-                    'w2': 0.03,
-                }
+                'words': ['w5', 'w1', 'w2'],
+                'weights': [0.3, 0.2, 0.03]
             },
             {
-                'topic_id': 2,
+                'topic_id': 1,
                 'topic_label': 'artificial intelligence',
                 'topic_description': 'prova di description del topic art int',
-                'words_distribution': {
-                    'w5': 0.35,
-                    'w4': 0.22,
-                    'w1': 0.03,
-                }
+                'words': ['w5', 'w4', 'w1'],
+                'weights': [0.35, 0.22, 0.03]
             }
         ]
     }
@@ -60,14 +54,11 @@ def load_models_data():
     model['model_id'] = 'tmp'
     model['files_prefix'] = 'prova_modello'
     model['topics'].append({
-                'topic_id': 3,
+                'topic_id': 2,
                 'topic_label': 'cognitive science',
                 'topic_description': 'prova di dsf del topic art int',
-                'words_distribution': {
-                    'w5': 0.2,
-                    'w3': 0.22,
-                    'w1': 0.22,
-                }
+                'words': ['w3', 'w1', 'w5'],
+                'weights': [0.22, 0.22, 0.2]
             })
 
     models_collection.insert(model)
@@ -104,25 +95,25 @@ def load_topics_data():
             'model_id': '1.0',
             'document_id': '1',
             'assigned_topics': [
-                {'topic_id': 1, 'topic_weight': 0.324},
-                {'topic_id': 2, 'topic_weight': 0.22},
+                {'topic_id': 0, 'topic_weight': 0.324},
+                {'topic_id': 1, 'topic_weight': 0.22},
             ]
         },
         {
             'model_id': '1.0',
             'document_id': '21',
             'assigned_topics': [
-                {'topic_id': 1, 'topic_weight': 0.5232},
-                {'topic_id': 2, 'topic_weight': 0.123},
+                {'topic_id': 0, 'topic_weight': 0.5232},
+                {'topic_id': 1, 'topic_weight': 0.123},
             ]
         },
         {
             'model_id': 'tmp',
             'document_id': '1',
             'assigned_topics': [
-                {'topic_id': 1, 'topic_weight': 0.7},
-                {'topic_id': 2, 'topic_weight': 0.2},
-                {'topic_id': 3, 'topic_weight': 0.1},
+                {'topic_id': 0, 'topic_weight': 0.7},
+                {'topic_id': 1, 'topic_weight': 0.2},
+                {'topic_id': 2, 'topic_weight': 0.1},
 
             ]
         },
@@ -130,9 +121,9 @@ def load_topics_data():
             'model_id': 'tmp',
             'document_id': '21',
             'assigned_topics': [
-                {'topic_id': 1, 'topic_weight': 0.6},
-                {'topic_id': 2, 'topic_weight': 0.11},
-                {'topic_id': 3, 'topic_weight': 0.22},
+                {'topic_id': 0, 'topic_weight': 0.6},
+                {'topic_id': 1, 'topic_weight': 0.11},
+                {'topic_id': 2, 'topic_weight': 0.22},
 
             ]
         }
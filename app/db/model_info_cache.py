@@ -0,0 +1,115 @@
+"""
+In-process read-through cache of the model information (db_utils.get_model_info), keyed by model id.
+
+Every write of a model document in db_utils (upsert_model, update_model_status, update_topic, ...) increments its
+metadata_version field. A cached model information is used as it is for config.model_info_cache_ttl seconds, then
+the next read checks the metadata version in db with a projected query: the model is read again only when the version
+has changed. The writes of the current process also drop the cached model right away, the writes of other processes
+(e.g. the status updates of scripts.compute_model.ComputeModelProcess) are seen within the ttl.
+
+A model stored before the metadata versions has none (read as None): it is revalidated as unchanged until its first
+write through db_utils._update_model_document, whose $inc sets the version to 1 and so invalidates the cached copies of
+all the processes.
+
+"""
+import copy
+import threading
+from collections import OrderedDict
+from time import time
+
+
+class ModelInfoCache:
+
+    def __init__(self, ttl, max_entries):
+        """
+
+        :param ttl: seconds a cached model information is used without checking its version in db, 0 to disable
+        :param max_entries: the max number of cached models, the least recently used are dropped
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.revalidations = 0
+        self.misses = 0
+        # model_id -> (model information, metadata version, time of the last check)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, model_id, read_version, read_model_info):
+        """
+        Return the information of a model, from the cache when fresh.
+
+        :param model_id:
+        :param read_version: function of the model id, the metadata version in db, raises KeyError if the model does
+        not exist
+        :param read_model_info: function of the model id, the model information in db, None if the model does not
+        exist
+        :return: a copy of the model information, None if the model does not exist
+        """
+        if not self.enabled:
+            return read_model_info(model_id)
+
+        with self._lock:
+            entry = self._entries.get(model_id)
+            if entry is not None:
+                self._entries.move_to_end(model_id)
+
+        if entry is not None:
+            model_info, version, checked = entry
+            if time() - checked < self.ttl:
+                with self._lock:
+                    self.hits += 1
+                return copy.deepcopy(model_info)
+
+            try:
+                unchanged = read_version(model_id) == version
+            except KeyError:
+                unchanged = False
+            if unchanged:
+                self._put(model_id, model_info, version)
+                with self._lock:
+                    self.revalidations += 1
+                return copy.deepcopy(model_info)
+
+        with self._lock:
+            self.misses += 1
+
+        model_info = read_model_info(model_id)
+        if model_info is None:
+            self.invalidate(model_id)
+            return None
+
+        self._put(model_id, model_info, model_info.get('metadata_version'))
+        return copy.deepcopy(model_info)
+
+    def _put(self, model_id, model_info, version):
+        with self._lock:
+            self._entries[model_id] = (model_info, version, time())
+            self._entries.move_to_end(model_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, model_id=None):
+        """
+        Drop a model from the cache, all the models if model_id is None
+        """
+        with self._lock:
+            if model_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(model_id, None)
+
+    def get_stats(self):
+        """
+        Return the cache counters: hits (fresh), revalidations (same version after the ttl) and misses (read from db).
+
+        :rtype: dict
+        :return:
+        """
+        with self._lock:
+            return {'hits': self.hits, 'revalidations': self.revalidations, 'misses': self.misses,
+                    'entries': len(self._entries), 'ttl': self.ttl, 'max_entries': self.max_entries}
@@ -0,0 +1,160 @@
+"""
+Batched variational inference for new documents.
+
+The E-step of gensim LdaModel.inference is run on a whole document-term matrix at once with matrix operations,
+instead of looping over the documents. Documents that have converged are masked out of the following iterations.
+
+"""
+import numpy as np
+from scipy import sparse
+from scipy.special import psi
+
+# chunks with less documents are processed one document at a time
+small_batch_size = 8
+
+
+def dirichlet_expectation(alpha):
+    """
+    Expected value of log(theta) where theta is drawn from a Dirichlet distribution, for each row of alpha
+    """
+    return psi(alpha) - psi(np.sum(alpha, axis=1))[:, np.newaxis]
+
+
+def infer_topics(tf_matrix, exp_elogbeta, alpha, iterations=50, gamma_threshold=0.001, random_state=None,
+                 max_chunk_elements=2 ** 20):
+    """
+    Compute the variational parameters gamma of the topic distributions of the documents.
+
+    :param tf_matrix: scipy sparse matrix, documents x model words, containing word counts
+    :param exp_elogbeta: numpy array, topics x model words, the expElogbeta of the model
+    :param alpha: numpy array, the alpha prior of the model (one value per topic)
+    :param iterations: the maximum number of iterations for each document
+    :param gamma_threshold: the mean change of gamma under which a document is considered converged
+    :param random_state: numpy RandomState used to initialize gamma
+    :param max_chunk_elements: the documents are processed in chunks of (non zero values x topics) elements at most,
+    to bound the memory used by the intermediate arrays
+    :rtype: numpy.ndarray
+    :return: gamma, documents x topics
+    """
+    if random_state is None:
+        random_state = np.random.RandomState()
+
+    tf_matrix = sparse.csr_matrix(tf_matrix)
+    n_topics = exp_elogbeta.shape[0]
+    dtype = exp_elogbeta.dtype
+
+    gamma = np.empty((tf_matrix.shape[0], n_topics), dtype=dtype)
+
+    for start, end in _chunks(tf_matrix.indptr, max(1, max_chunk_elements // n_topics)):
+        gamma[start:end] = _infer_chunk(tf_matrix[start:end], exp_elogbeta, alpha, iterations, gamma_threshold,
+                                        random_state)
+
+    return gamma
+
+
+def _chunks(indptr, max_nnz):
+    """
+    Split the rows of a csr matrix in contiguous chunks with at most max_nnz non zero values (or a single row)
+    """
+    n_rows = len(indptr) - 1
+    start = 0
+    while start < n_rows:
+        end = int(np.searchsorted(indptr, indptr[start] + max_nnz, side='right')) - 1
+        end = min(max(end, start + 1), n_rows)
+        yield start, end
+        start = end
+
+
+def _infer_chunk(tf_matrix, exp_elogbeta, alpha, iterations, gamma_threshold, random_state):
+    dtype = exp_elogbeta.dtype
+    epsilon = np.finfo(dtype).eps
+
+    gamma = random_state.gamma(100., 1. / 100., (tf_matrix.shape[0], exp_elogbeta.shape[0])).astype(dtype)
+
+    # documents without words get the prior, as after a gensim iteration
+    words_per_document = np.diff(tf_matrix.indptr)
+    gamma[words_per_document == 0] = alpha
+    active = np.flatnonzero(words_per_document)
+    if len(active) == 0:
+        return gamma
+
+    if len(active) < small_batch_size:
+        # the fixed cost of the sparse operations exceeds the per-document work
+        for d in active:
+            gamma[d] = _infer_document(tf_matrix.indices[tf_matrix.indptr[d]:tf_matrix.indptr[d + 1]],
+                                       tf_matrix.data[tf_matrix.indptr[d]:tf_matrix.indptr[d + 1]].astype(dtype),
+                                       gamma[d], exp_elogbeta, alpha, iterations, gamma_threshold, epsilon)
+        return gamma
+
+    # restrict the topic-word matrix to the words of the chunk, transposed to have contiguous rows per word
+    words, columns = np.unique(tf_matrix.indices, return_inverse=True)
+    exp_elogbeta_t = np.ascontiguousarray(exp_elogbeta[:, words].T)
+    documents = sparse.csr_matrix((tf_matrix.data.astype(dtype), columns.ravel(), tf_matrix.indptr),
+                                  shape=(tf_matrix.shape[0], len(words)))[active]
+    # topic weights of each (document, word) non zero value, gathered once as gensim does with expElogbetad
+    documents_exp_elogbeta = exp_elogbeta_t[documents.indices]
+    words_per_document = words_per_document[active]
+
+    exp_elogtheta = np.exp(dirichlet_expectation(gamma[active]))
+
+    for _ in range(iterations):
+        # for each non zero (document, word): phinorm = sum_k theta[document, k] * beta[k, word]
+        phinorm = np.einsum('ij,ij->i', np.repeat(exp_elogtheta, words_per_document, axis=0),
+                            documents_exp_elogbeta) + epsilon
+
+        # gamma = alpha + theta * sum over the document words of counts / phinorm * beta
+        normalized_counts = sparse.csr_matrix((documents.data / phinorm, documents.indices, documents.indptr),
+                                              shape=documents.shape)
+        new_gamma = alpha + exp_elogtheta * (normalized_counts @ exp_elogbeta_t)
+
+        mean_change = np.mean(np.abs(new_gamma - gamma[active]), axis=1)
+        gamma[active] = new_gamma
+        exp_elogtheta = np.exp(dirichlet_expectation(new_gamma))
+
+        # converged documents are masked out of the following iterations
+        not_converged = mean_change >= gamma_threshold
+        if not np.any(not_converged):
+            break
+
+        if not np.all(not_converged):
+            documents_exp_elogbeta = documents_exp_elogbeta[np.repeat(not_converged, words_per_document)]
+            documents = documents[not_converged]
+            active = active[not_converged]
+            exp_elogtheta = exp_elogtheta[not_converged]
+            words_per_document = words_per_document[not_converged]
+
+    return gamma
+
+
+def _infer_document(ids, counts, gamma, exp_elogbeta, alpha, iterations, gamma_threshold, epsilon):
+    exp_elogtheta = np.exp(psi(gamma) - psi(np.sum(gamma)))
+    document_exp_elogbeta = exp_elogbeta[:, ids]
+    phinorm = np.dot(exp_elogtheta, document_exp_elogbeta) + epsilon
+
+    for _ in range(iterations):
+        last_gamma = gamma
+        gamma = alpha + exp_elogtheta * np.dot(counts / phinorm, document_exp_elogbeta.T)
+        exp_elogtheta = np.exp(psi(gamma) - psi(np.sum(gamma)))
+        phinorm = np.dot(exp_elogtheta, document_exp_elogbeta) + epsilon
+
+        if np.mean(np.abs(gamma - last_gamma)) < gamma_threshold:
+            break
+
+    return gamma
+
+
+def gamma_to_topic_assignment(gamma, minimum_probability=0.01):
+    """
+    Normalize gamma to topic distributions and keep, for each document, the topics with a weight of at least
+    minimum_probability.
+
+    :param gamma: numpy array, documents x topics
+    :param minimum_probability:
+    :return: list of lists of pairs (topic_id, topic_weight), one list for each document
+    """
+    topics_distributions = gamma / gamma.sum(axis=1)[:, np.newaxis]
+    minimum_probability = max(minimum_probability, 1e-8)
+
+    return [[(int(topic_id), float(distribution[topic_id]))
+             for topic_id in np.flatnonzero(distribution >= minimum_probability)]
+            for distribution in topics_distributions]
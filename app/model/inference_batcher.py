@@ -0,0 +1,133 @@
+"""
+Micro-batching of single-text inferences.
+
+Concurrent queries on the same model are collected for up to max_wait_ms milliseconds or max_batch_size documents and
+their topics are computed with a single batched E-step, then each caller gets back its own row.
+
+"""
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+from time import time
+
+from scipy import sparse
+
+
+class Histogram:
+
+    def __init__(self, bounds):
+        """
+
+        :param bounds: sorted list of the buckets upper bounds (inclusive), values above the last bound are counted
+        in an additional overflow bucket
+        """
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            i = 0
+            while i < len(self.bounds) and value > self.bounds[i]:
+                i += 1
+            self.counts[i] += 1
+            self.count += 1
+            self.total += value
+
+    def to_dict(self):
+        with self._lock:
+            buckets = {'le_{0}'.format(b): c for b, c in zip(self.bounds, self.counts)}
+            buckets['overflow'] = self.counts[-1]
+            return {'count': self.count, 'mean': self.total / self.count if self.count != 0 else 0.0,
+                    'buckets': buckets}
+
+
+class InferenceBatcher:
+
+    size_buckets = [1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024]
+
+    def __init__(self, infer_function, max_wait_ms=5, max_batch_size=64, idle_seconds=60):
+        """
+
+        :param infer_function: function that takes a tf matrix (documents x model words) and returns the list of
+        topics assignments, one for each row
+        :param max_wait_ms: the maximum time to wait for other requests before running a batch
+        :param max_batch_size: the maximum number of documents in a batch
+        :param idle_seconds: the worker thread stops after this time without requests and restarts on demand
+        """
+        self.infer_function = infer_function
+        self.max_wait_ms = max_wait_ms
+        self.max_batch_size = max_batch_size
+        self.idle_seconds = idle_seconds
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._running = False
+
+        self.queue_depth = Histogram(self.size_buckets)
+        self.batch_size = Histogram(self.size_buckets)
+
+    def infer(self, tf_row):
+        """
+        Compute the topics assignment for a single document, waiting for the batch that contains it.
+
+        :param tf_row: scipy sparse matrix with a single row
+        :return: list of pairs (topic_id, topic_weight)
+        """
+        future = Future()
+
+        with self._lock:
+            self.queue_depth.observe(self._queue.qsize())
+            self._queue.put((tf_row, future))
+            if not self._running:
+                self._running = True
+                threading.Thread(target=self._run, daemon=True).start()
+
+        return future.result()
+
+    def get_stats(self):
+        return {
+            'max_wait_ms': self.max_wait_ms,
+            'max_batch_size': self.max_batch_size,
+            'queue_depth': self.queue_depth.to_dict(),
+            'batch_size': self.batch_size.to_dict()
+        }
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.idle_seconds)]
+            except queue.Empty:
+                with self._lock:
+                    if self._queue.empty():
+                        self._running = False
+                        return
+                continue
+
+            deadline = time() + self.max_wait_ms / 1000.0
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            self.batch_size.observe(len(batch))
+            self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        try:
+            assignments = self.infer_function(sparse.vstack([row for row, _ in batch], format='csr'))
+        except Exception as e:
+            logging.exception('Error during a batched inference.')
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), assignment in zip(batch, assignments):
+            future.set_result(assignment)
@@ -0,0 +1,87 @@
+"""
+Persistent process pool for the topics assignment of large batches of new documents.
+
+The batch is split in shards that are processed in parallel by the pool workers. Each worker loads the model once in
+its own model registry (read-only, memory mapped if config.model_mmap_loading is set) and keeps it for the following
+shards. Results are merged in input order.
+
+"""
+import atexit
+import multiprocessing
+import threading
+
+import config
+
+# model information sent to the workers, enough to load the model from file
+worker_model_info_keys = ['model_id', 'files_prefix', 'number_of_topics', 'language', 'use_lemmer']
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            context = multiprocessing.get_context(config.inference_pool_start_method)
+            _pool = context.Pool(processes=config.inference_pool_size)
+
+        return _pool
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.terminate()
+            _pool = None
+
+
+atexit.register(shutdown)
+
+
+def split_in_shards(items, shard_size):
+    return [items[i:i + shard_size] for i in range(0, len(items), shard_size)]
+
+
+def assign_topics(model_info, texts, shard_size=None):
+    """
+    Compute the topics assignment of new documents in the process pool.
+
+    :param model_info: the model information as stored in db
+    :param texts: list of strings
+    :param shard_size: the number of documents processed by a worker at a time, config.inference_pool_shard_size
+    if None
+    :return: list of topic assignments, one for each text, in input order
+    :raise EmptyCorpusError: if no text has a model word
+    """
+    if shard_size is None:
+        shard_size = config.inference_pool_shard_size
+
+    worker_model_info = {k: model_info[k] for k in worker_model_info_keys if k in model_info}
+    shards = [(worker_model_info, shard) for shard in split_in_shards(texts, shard_size)]
+
+    results = get_pool().map(_assign_topics_to_shard, shards, chunksize=1)
+
+    if sum(words_count for _, words_count in results) == 0:
+        # imported here as in the workers, lda_model imports lda_utils that imports this module
+        from model.lda_model import EmptyCorpusError
+        raise EmptyCorpusError('The corpus is empty. Tune analysis parameters and check stopwords.')
+
+    return [assignment for shard_assignments, _ in results for assignment in shard_assignments]
+
+
+def _assign_topics_to_shard(args):
+    """
+    Worker function: return the topics assignment of a shard and the number of model words found in it
+    """
+    model_info, texts = args
+
+    # lda_utils is imported first to preserve the import order of the model modules
+    from model import lda_utils
+    from model import model_registry
+
+    model = model_registry.get_model_helper(model_info)
+    tf_matrix = model.compute_inference_tf_matrix(texts)
+
+    return model.compute_topic_assignment_for_tf_matrix(tf_matrix), int(tf_matrix.nnz)
@@ -8,6 +8,7 @@ The LDA algorithm is LdaModel in gensim library.
 """
 import logging
 import os
+import threading
 import time
 
 import wikipedia
@@ -15,7 +16,16 @@ from gensim import matutils
 from gensim.models import LdaModel
 
 import config
-from model import lda_utils
+from model import inference, lda_utils
+from model.inference_batcher import InferenceBatcher
+from model.vocabulary import VocabularyIndex
+
+
+class EmptyCorpusError(Exception):
+    """
+    Raised when no text of a topics assignment has a word of the model after preprocessing
+    """
+    pass
 
 
 class LdaModelHelper:
@@ -64,6 +74,11 @@ class LdaModelHelper:
         self.training_documents = None
 
         self.lda_model = None
+        self.model_file_path = None
+        self.vocabulary = None
+        self.inference_vectorizer = None
+        self.inference_batcher = None
+        self._inference_batcher_lock = threading.Lock()
         self.model_computation_time = None
 
         self.topic_labels = None
@@ -88,6 +103,8 @@ class LdaModelHelper:
 
     def set_lda_model(self, lda_model):
         self.lda_model = lda_model
+        self.vocabulary = None
+        self.inference_vectorizer = None
 
     #####################
     # Model computation
@@ -131,22 +148,51 @@ class LdaModelHelper:
             logging.error('The model has not been computed yet.')
             return False
         else:
-            self.lda_model.save(file_path)
+            # sep_limit=0 stores all the state arrays in separate .npy files, so that they can be memory mapped on load
+            self.lda_model.save(file_path, sep_limit=0)
+            self.get_vocabulary().save(file_path + VocabularyIndex.file_suffix)
+            self.model_file_path = file_path
 
-    def load_model_from_file(self, input_filepath):
+    def load_model_from_file(self, input_filepath, mmap=None):
         """
 
         :param input_folder:
+        :param mmap: None to load all arrays in memory, 'r' to open the large arrays (e.g. expElogbeta and sstats)
+        as read-only memory maps shared through the page cache by all processes that load the same model
         :return:
         """
-        self.lda_model = LdaModel.load(input_filepath)
+        self.lda_model = LdaModel.load(input_filepath, mmap=mmap)
+        self.model_file_path = input_filepath
+        self.vocabulary = None
+        self.inference_vectorizer = None
 
+    def get_vocabulary(self):
+        """
+        Return the word -> id index of the model vocabulary. The index is loaded lazily from the file saved next to
+        the model files or built from the model id2word (e.g. for models saved before the index was introduced).
 
-    def compute_corpus(self, texts, parameters='training'):
+        :rtype: VocabularyIndex
+        :return:
+        """
+        if self.vocabulary is None:
+            vocabulary_file_path = None
+            if self.model_file_path is not None:
+                vocabulary_file_path = self.model_file_path + VocabularyIndex.file_suffix
+
+            if vocabulary_file_path is not None and os.path.exists(vocabulary_file_path):
+                self.vocabulary = VocabularyIndex.load(vocabulary_file_path)
+            else:
+                self.vocabulary = VocabularyIndex.from_id2word(self.lda_model.id2word)
+
+        return self.vocabulary
+
+
+    def compute_corpus(self, texts, parameters='training', save_results=True):
         """
         Compute the corpus in gensim format considering the specified set of parameters 'training' or 'analysis'.
         :param parameters:
         :param texts:
+        :param save_results: False to avoid keeping the analysis corpus in the helper (e.g. for shared helpers)
         :return:
         """
         if parameters == 'training':
@@ -170,29 +216,15 @@ class LdaModelHelper:
                 if len(tf_matrix_features_names) == 0:
                     return []
 
-                corpus = [None] * tf_matrix.shape[0]
-
-                if len(tf_matrix_features_names) != 0:
-                    word2id = {self.lda_model.id2word[id]: id for id in self.lda_model.id2word.keys()}
-
-                    for i in range(tf_matrix.shape[0]):
-                        doc = tf_matrix.getrow(i)
-                        _, cols = doc.nonzero()
-
-                        corpus[i] = [None] * len(cols)
-                        count = 0
-                        for col in cols:
-                            if tf_matrix_features_names[col] in word2id.keys():
-                                corpus[i][count] = (int(word2id[tf_matrix_features_names[col]]), int(tf_matrix[i, col]))
-                                count += 1
+                features_ids = self.get_vocabulary().lookup(tf_matrix_features_names)
+                corpus = lda_utils.tf_matrix_to_corpus(tf_matrix, features_ids)
 
-                        corpus[i] = corpus[i][:count]
+                if save_results:
+                    self.analysis_corpus = corpus
+                    self.analysis_features_names = tf_matrix_features_names
+                    self.analysis_documents = tf_matrix_docs_ids
 
-                self.analysis_corpus = corpus
-                self.analysis_features_names = tf_matrix_features_names
-                self.analysis_documents = tf_matrix_docs_ids
-
-                return self.analysis_corpus
+                return corpus
         else:
             logging.error("Value not allowed for argument parameters. Allowed values are 'training' or 'analysis'.")
             return None
@@ -216,26 +248,41 @@ class LdaModelHelper:
             if len(tf_matrix_features_names) == 0:
                 return [], tf_matrix_features_names
 
-            corpus = [None] * tf_matrix.shape[0]
+            features_ids = self.get_vocabulary().lookup(tf_matrix_features_names)
+            corpus = lda_utils.tf_matrix_to_corpus(tf_matrix, features_ids)
 
-            if len(tf_matrix_features_names) != 0:
-                word2id = {self.lda_model.id2word[id]: id for id in self.lda_model.id2word.keys()}
+            return corpus, tf_matrix_features_names
 
-                for i in range(tf_matrix.shape[0]):
-                    doc = tf_matrix.getrow(i)
-                    _, cols = doc.nonzero()
 
-                    corpus[i] = [None] * len(cols)
-                    count = 0
-                    for col in cols:
-                        if tf_matrix_features_names[col] in word2id.keys():
-                            corpus[i][count] = (int(word2id[tf_matrix_features_names[col]]), int(tf_matrix[i, col]))
-                            count += 1
+    def get_inference_vectorizer(self):
+        """
+        Return the transform-only vectorizer built from the model vocabulary, the stopwords and the lemmer used
+        during training.
 
-                    corpus[i] = corpus[i][:count]
+        :rtype: CountVectorizer
+        :return:
+        """
+        if self.inference_vectorizer is None:
+            vocabulary = self.get_vocabulary()
+            self.inference_vectorizer = lda_utils.build_inference_vectorizer(
+                dict(zip(vocabulary.words.tolist(), vocabulary.ids.tolist())),
+                lda_utils.get_stopwords(self.language), self.language, self.training_use_lemmer)
 
-            return corpus, tf_matrix_features_names
+        return self.inference_vectorizer
+
+    def compute_inference_tf_matrix(self, texts):
+        """
+        Compute the tf matrix of new documents with the fixed vocabulary of the model: matrix columns are model word
+        ids and words not included in the model are ignored.
+
+        :param texts: list of strings
+        :return: scipy sparse matrix, documents x model words
+        """
+        if self.lda_model is None:
+            logging.error('The model has not been computed or loaded yet.')
+            return None
 
+        return self.get_inference_vectorizer().transform(texts)
 
     def compute_tf_matrix(self, texts, parameters='training'):
         """
@@ -270,7 +317,7 @@ class LdaModelHelper:
         return tf_matrix, tf_matrix_features_names, tf_matrix_docs_id
 
 
-    def compute_topic_assignment(self, texts):
+    def compute_topic_assignment(self, texts, save_results=True):
         """
         Computes the topics assignment for each document w.r.t the specified topic_model
 
@@ -278,25 +325,108 @@ class LdaModelHelper:
                             [(6, 0.29928250617927882), (49, 0.59405082715405444)]]
 
         :param texts:
+        :param save_results: False to avoid keeping corpus and assignment in the helper (e.g. for shared helpers)
         :return:
         """
-        corpus = self.compute_corpus(texts, parameters='analysis')
+        corpus = self.compute_corpus(texts, parameters='analysis', save_results=save_results)
 
         if len(corpus) == 0:
-            raise Exception('The corpus is empty. Tune analysis parameters and check stopwords.')
+            raise EmptyCorpusError('The corpus is empty. Tune analysis parameters and check stopwords.')
 
         computed_assignment = self.lda_model[corpus]
-        if texts is not None:
+        if texts is not None and save_results:
             # is the corpus related to analysis parameters
             self.topic_assignment = computed_assignment
 
         return computed_assignment
 
+    def compute_topic_assignment_for_new_documents(self, texts):
+        """
+        Computes the topics assignment for documents that are not part of the training set.
+        With config.inference_fixed_vocabulary the tf matrix is computed with the fixed vocabulary of the model,
+        otherwise with the analysis parameters. Results are not kept in the helper, which can be shared.
+        With the fixed vocabulary the texts without model words get an empty assignment.
+
+        :param texts: list of strings
+        :raise EmptyCorpusError: if no text has a model word
+        :return:
+        """
+        if not config.inference_fixed_vocabulary:
+            return self.compute_topic_assignment(texts, save_results=False)
+
+        tf_matrix = self.compute_inference_tf_matrix(texts)
+
+        if tf_matrix is None or tf_matrix.nnz == 0:
+            raise EmptyCorpusError('The corpus is empty. Tune analysis parameters and check stopwords.')
+
+        return self.compute_topic_assignment_for_tf_matrix(tf_matrix)
+
+    def compute_topic_assignment_for_tf_matrix(self, tf_matrix):
+        """
+        Computes the topics assignment for all the rows of a tf matrix computed with the fixed model vocabulary,
+        running a single E-step on the whole batch. With config.inference_engine 'numpy' the E-step of batches of
+        at least inference.small_batch_size documents is computed with matrix operations (see model.inference),
+        otherwise by LdaModel.inference.
+
+        :param tf_matrix: scipy sparse matrix, documents x model words
+        :return: list of topic assignments, one for each row, in the same format of compute_topic_assignment. The
+        rows without words get an empty assignment.
+        """
+        tf_matrix = tf_matrix.tocsr()
+        # the E-step gives the prior (a uniform distribution) to a row without words, it has no topics instead
+        rows = [i for i, nnz in enumerate(tf_matrix.getnnz(axis=1)) if nnz > 0]
+        if len(rows) < tf_matrix.shape[0]:
+            topic_assignments = [[] for _ in range(tf_matrix.shape[0])]
+            if len(rows) > 0:
+                for i, topic_assignment in zip(rows, self.compute_topic_assignment_for_tf_matrix(tf_matrix[rows])):
+                    topic_assignments[i] = topic_assignment
+            return topic_assignments
+
+        if config.inference_engine == 'numpy' and tf_matrix.shape[0] >= inference.small_batch_size:
+            gamma = inference.infer_topics(tf_matrix, self.lda_model.expElogbeta, self.lda_model.alpha,
+                                           iterations=self.lda_model.iterations,
+                                           gamma_threshold=self.lda_model.gamma_threshold,
+                                           random_state=self.lda_model.random_state,
+                                           max_chunk_elements=config.inference_max_chunk_elements)
+        else:
+            gamma, _ = self.lda_model.inference(list(matutils.Sparse2Corpus(tf_matrix, documents_columns=False)))
+
+        return inference.gamma_to_topic_assignment(gamma, self.lda_model.minimum_probability)
+
+    def get_inference_batcher(self):
+        """
+        Return the micro-batching queue that collects the concurrent queries on this model.
+
+        :rtype: InferenceBatcher
+        :return:
+        """
+        if self.inference_batcher is None:
+            # the concurrent first queries would start a batcher (and its worker thread) each
+            with self._inference_batcher_lock:
+                if self.inference_batcher is None:
+                    self.inference_batcher = InferenceBatcher(self.compute_topic_assignment_for_tf_matrix,
+                                                              max_wait_ms=config.inference_batch_max_wait_ms,
+                                                              max_batch_size=config.inference_batch_max_size,
+                                                              idle_seconds=config.inference_batch_idle_seconds)
+
+        return self.inference_batcher
+
     def compute_topic_assignment_for_query(self, text):
+        if config.inference_fixed_vocabulary and config.inference_batching_enabled:
+            tf_matrix = self.compute_inference_tf_matrix([text])
+
+            if tf_matrix is None or tf_matrix.nnz == 0:
+                raise EmptyCorpusError('The corpus is empty. Tune analysis parameters and check stopwords.')
+
+            return [self.get_inference_batcher().infer(tf_matrix)]
+
+        if config.inference_fixed_vocabulary:
+            return self.compute_topic_assignment_for_new_documents([text])
+
         corpus, _ = self.compute_corpus_single_query(text)
 
         if corpus is None or len(corpus) == 0:
-            raise Exception('The corpus is empty. Tune analysis parameters and check stopwords.')
+            raise EmptyCorpusError('The corpus is empty. Tune analysis parameters and check stopwords.')
 
         computed_assignment = self.lda_model[corpus]
 
@@ -442,15 +572,12 @@ class LdaModelHelper:
         :return: 200 if all files have been removed, 404 if files does not exist
         """
         if os.path.exists(os.path.join(folder_path, files_prefix)):
-            files_to_remove = [
-                files_prefix,
-                files_prefix + ".state",
-                files_prefix + ".expElogbeta.npy",
-                files_prefix + ".id2word",
-            ]
+            # the model file, plus all the related files (.state, .id2word, separately stored arrays .npy, ...)
+            files_to_remove = [files_prefix] + [f for f in os.listdir(folder_path)
+                                                if f.startswith(files_prefix + '.')]
 
             for f in files_to_remove:
-                os.remove(os.path.join(folder_path, f));
+                os.remove(os.path.join(folder_path, f))
 
             return 200
         else:
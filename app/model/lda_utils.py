@@ -1,19 +1,21 @@
+import itertools
 import logging
 import os
 import re
 
 from time import time
+import numpy as np
 from gensim.models import LdaModel
 from nltk.corpus import stopwords
 from sklearn.feature_extraction.text import CountVectorizer
 
 import config
 from db import db_utils
-from model.lda_model import LdaModelHelper
+from model.lda_model import EmptyCorpusError, LdaModelHelper
 from model.lemmatiser import LemNormalize, LemNormalizeIt
+from model import inference_pool, model_registry, precomputed_neighbors, similarity_index
 from scripts import scheduler
 import json
-from scipy import spatial
 
 
 def load_lda_model(file_prefix):
@@ -97,7 +99,7 @@ def compute_model(model_id, n_topics, language='en', use_lemmer=True, min_df=2,
     """
 
     # get model informations
-    model = db_utils.get_model(model_id)
+    model = db_utils.get_model_info(model_id)
 
     if model is not None:
         # model id already existing
@@ -137,7 +139,7 @@ def delete_model(model_id):
     """
 
     # get model informations
-    model = db_utils.get_model(model_id)
+    model = db_utils.get_model_info(model_id)
 
     if model is not None:
         pid = None
@@ -155,6 +157,9 @@ def delete_model(model_id):
 
         # delete model from db
         db_utils.delete_model(model_id)
+        model_registry.invalidate_model(model_id)
+        # also deletes the index files saved by a build still running
+        similarity_index.invalidate_index(model_id, model.get('files_prefix'))
 
         return 200, model
     else:
@@ -180,6 +185,45 @@ def get_stopwords(language):
 
 
 
+def get_lemmer_tokenizer(language, use_lemmer=True):
+    """
+    Return the tokenizer to use for the specified language, None to use the default CountVectorizer tokenizer
+    :param language: 'en' or 'it'
+    :param use_lemmer:
+    :return:
+    """
+    if not use_lemmer:
+        return None
+
+    if language == 'it':
+        return LemNormalizeIt
+
+    return LemNormalize
+
+
+def build_inference_vectorizer(vocabulary, stopwords_list, language, use_lemmer=True):
+    """
+    Build a transform-only vectorizer for new documents: the vocabulary is fixed to the one of the model, so no fit
+    (and no document frequency heuristic) is needed and the tf matrix columns are already the model word ids.
+
+    :param vocabulary: dict, keys are words and values are model word ids
+    :param stopwords_list:
+    :param language: 'en' or 'it'
+    :param use_lemmer: should be the same value used to train the model
+    :rtype: CountVectorizer
+    :return:
+    """
+    tf_vectorizer = CountVectorizer(tokenizer=get_lemmer_tokenizer(language, use_lemmer),
+                                    vocabulary=vocabulary,
+                                    stop_words=stopwords_list,
+                                    token_pattern="[a-zA-Z]{3,}")
+
+    # validate the fixed vocabulary once, transform calls then only read it
+    tf_vectorizer.transform([])
+
+    return tf_vectorizer
+
+
 def compute_tf(data, stopwords_list, language, use_lemmer=True, min_df=2, max_df=0.8):
     """
     Compute the tf matrix for the provided data
@@ -191,13 +235,7 @@ def compute_tf(data, stopwords_list, language, use_lemmer=True, min_df=2, max_df
     :param max_df:
     :return:
     """
-    lemmer_tokenizer = None
-
-    if use_lemmer:
-        if language == 'it':
-            lemmer_tokenizer = LemNormalizeIt
-        else:
-            lemmer_tokenizer = LemNormalize
+    lemmer_tokenizer = get_lemmer_tokenizer(language, use_lemmer)
 
     min_df = min_df if len(data) > min_df else 1
     max_df = max_df if max_df * len(data) >= min_df else 1.0
@@ -220,28 +258,81 @@ def compute_tf(data, stopwords_list, language, use_lemmer=True, min_df=2, max_df
     return tf, tf_features_names
 
 
-def save_topic_assignment(new_documents, topics_assignment, model_id):
+def iter_tf_matrix_rows(tf_matrix, features_ids):
     """
-    Update the model with the given topic assignment
+    Yield the rows of a tf matrix as gensim bag of words, mapping the matrix columns to model ids.
+    The remapping works on the whole csr arrays at once: columns of words that are not in the model are dropped in
+    bulk and no per-element indexing of the matrix is performed.
 
-    :return:
+    :param tf_matrix: scipy sparse matrix, documents x features
+    :param features_ids: numpy array, the model id of each column of tf_matrix, -1 for words not in the model
+    :return: generator of lists of pairs (word_id, count)
+    """
+    tf_matrix = tf_matrix.tocsr()
+
+    ids = np.asarray(features_ids)[tf_matrix.indices]
+    known = ids >= 0
+    # row boundaries after dropping the unknown columns
+    indptr = np.concatenate(([0], np.cumsum(known)))[tf_matrix.indptr].tolist()
+
+    ids = ids[known].tolist()
+    counts = tf_matrix.data[known].astype(np.int64).tolist()
+
+    for start, end in zip(indptr[:-1], indptr[1:]):
+        yield list(zip(ids[start:end], counts[start:end]))
+
+
+def tf_matrix_to_corpus(tf_matrix, features_ids):
+    """
+    Transform a tf matrix in a gensim corpus (list of bag of words) using model ids, see iter_tf_matrix_rows.
+
+    :rtype: list
+    """
+    return list(iter_tf_matrix_rows(tf_matrix, features_ids))
+
+
+def save_topic_assignment(new_documents, topics_assignment, model_id, update_index=True, model_info=None):
     """
+    Update the model with the given topic assignment
+
+    Saving the same documents again is idempotent: documents and assignments are upserted, keyed on document_id and
+    (model_id, document_id).
 
-    temp_documents_ids = db_utils.get_all_documents_ids()
+    :param update_index: True to add the new assignments to the similarity index of the model (and refresh its
+    precomputed neighbors), False when the index is built afterwards
+    :param model_info: the model information as stored in db, read from db if None
+    :return: dictionary with keys 'documents' and 'assignments', each one with the counts of 'inserted', 'updated' and
+    'skipped' (unchanged) records
+    """
     temp_ass = convert_topic_assignment_to_dictionary(topics_assignment)
 
     for t in temp_ass:
         t['model_id'] = model_id
-        t['document_id'] = new_documents[t['document_index']]['doc_id']
+        t['document_id'] = str(new_documents[t['document_index']]['doc_id'])
         del t['document_index']
 
-    # TODO we should check also document content, not only id
-    documents_to_insert = [{'document_id': str(d['doc_id']), 'created': time(), 'text': d['doc_content']}
-                           for d in new_documents if d['doc_id'] not in temp_documents_ids]
+    documents = [{'document_id': str(d['doc_id']), 'text': d['doc_content']} for d in new_documents]
 
-    # insert new data
-    db_utils.insert_all_documents(documents_to_insert)
-    db_utils.insert_all_assignments(temp_ass)
+    counts = {
+        'documents': db_utils.upsert_documents(documents, config.db_write_chunk_size),
+        'assignments': db_utils.upsert_assignments(temp_ass, config.db_write_chunk_size)
+    }
+    logging.info('Topics assignment of model {0} saved: documents {1}, assignments {2}.'.format(
+        model_id, counts['documents'], counts['assignments']))
+
+    if not update_index:
+        return counts
+
+    model = model_info if model_info is not None else db_utils.get_model_info(model_id)
+    if model is not None and model.get('files_prefix') is not None:
+        # the new assignments are searchable at the next refresh of the similarity index, in every process
+        similarity_index.append_assignments(model['files_prefix'], temp_ass)
+
+        if precomputed_neighbors.has_neighbors(model):
+            precomputed_neighbors.refresh_neighbors(model, [d['doc_id'] for d in new_documents],
+                                                    config.neighbors_max_block_elements)
+
+    return counts
 
 
 def convert_topic_assignment_to_dictionary(topics_assignment):
@@ -269,8 +360,12 @@ def save_or_update_model(model, model_id, files_prefix, model_status, docs_count
 
     temp_topics = model.get_all_topics()
     if temp_topics is not None:
-        topics = [{'topic_id': k, 'words_distribution': v, 'topic_label': '',
-                   'topic_description': ''} for k, v in temp_topics.items()]
+        # ranked once here, in topic id order so that a topic is read by its position (see db_utils.get_topic)
+        topics = []
+        for k in sorted(temp_topics.keys()):
+            words, weights = db_utils.ranked_words(temp_topics[k])
+            topics.append({'topic_id': k, 'words': words, 'weights': weights, 'topic_label': '',
+                           'topic_description': ''})
     else:
         topics = []
 
@@ -308,31 +403,80 @@ def update_model_status(model_id, model_status, model_values=None):
     return db_utils.update_model_status(model_id, model_status, model_values)
 
 
-def get_similar_documents(model_id, doc_id):
-    model = db_utils.get_model(model_id)
-    topics_assignment_from_db = db_utils.get_assigned_topics(model_id, doc_id)
-    doc_topics_vector = transform_topics_assignment_from_db_to_vector(model['number_of_topics'],
-                                                                      topics_assignment_from_db)
+def get_similar_documents(model_id, doc_id, limit=None, method=None, metric=None):
+    """
+    Return the documents similar to a document of the model, see get_similar_documents_by_vector.
+    Exact cosine requests with a limit are answered with the precomputed neighbors of the document, when available.
+    """
+    model = db_utils.get_model_info(model_id)
+
+    if limit is not None and (method or config.similarity_default_method) == 'exact' and \
+            (metric or config.similarity_default_metric) == 'cosine' and \
+            precomputed_neighbors.has_neighbors(model) and limit <= model['precomputed_neighbors']['k']:
+        neighbors = db_utils.get_neighbors(model_id, doc_id, limit)
+        if neighbors is not None:
+            for n in neighbors:
+                n['model_id'] = model_id
+            return neighbors, 'cosine_precomputed'
+
+    doc_topics_vector = similarity_index.get_index(model).get_vector(doc_id)
 
-    return get_similar_documents_by_vector(model_id, doc_topics_vector)
+    if doc_topics_vector is None:
+        topics_assignment_from_db = db_utils.get_assigned_topics(model_id, doc_id)
+        doc_topics_vector = transform_topics_assignment_from_db_to_vector(model['number_of_topics'],
+                                                                          topics_assignment_from_db)
 
+    return get_similar_documents_by_vector(model_id, doc_topics_vector, model, limit, method, metric)
 
-def get_similar_documents_for_query(model_id, text):
+
+def get_similar_documents_for_query(model_id, text, limit=None, method=None, metric=None):
     """
     Return documents similar to the query or an empty set if an error occurs or the query has no words after preprocessing
     :param model_id:
     :param text:
-    :return:
+    :param limit: the max number of documents to return, all if None
+    :param method: the search method, see get_similar_documents_by_vector
+    :param metric: the similarity metric, see get_similar_documents_by_vector
+    :return: a pair (similar documents, similarity method), see get_similar_documents_by_vector
     """
-    model = db_utils.get_model(model_id)
-    topics_assignment = assign_topics_for_query(model_id, text)
+    model = db_utils.get_model_info(model_id)
+    topics_assignment = assign_topics_for_query(model_id, text, model_info=model)
 
     if len(topics_assignment) != 0:
         topics_vector = transform_topics_assignment_from_lda_to_vector(model['number_of_topics'], topics_assignment[0])
-        # print(topics_vector)
-        return get_similar_documents_by_vector(model_id, topics_vector)
+        return get_similar_documents_by_vector(model_id, topics_vector, model, limit, method, metric)
     else:
-        return []
+        return [], None
+
+
+def compute_precomputed_neighbors(model_id):
+    """
+    Compute and store the top-k neighbors lists of all the documents of the model (config.precomputed_neighbors_k)
+
+    :param model_id:
+    :return: the number of documents, None if the model does not exist
+    """
+    model = db_utils.get_model_info(model_id)
+    if model is None:
+        return None
+
+    return precomputed_neighbors.compute_neighbors(model, config.precomputed_neighbors_k,
+                                                   config.neighbors_max_block_elements)
+
+
+def build_similarity_index(model_id):
+    """
+    Build and save the similarity index of the model from its topics assignments
+
+    :param model_id:
+    :return: the number of indexed documents, None if the model does not exist
+    """
+    model = db_utils.get_model_info(model_id)
+    if model is None:
+        return None
+
+    similarity_index.invalidate_index(model_id)
+    return len(similarity_index.build_index(model))
 
 
 def transform_topics_assignment_from_db_to_vector(n_topics, topics_assignment):
@@ -362,40 +506,145 @@ def transform_topics_assignment_from_lda_to_vector(n_topics, topics_assignment):
     return topic_vector
 
 
-def get_similar_documents_by_vector(model_id, source_topics_vector):
-    # get all documents and trasform all to vectors
-    docs = db_utils.get_all_documents(model_id)
-    result_docs = [None] * len(docs)
-    for i,d in enumerate(docs):
-        topics_vector = transform_topics_assignment_from_db_to_vector(len(source_topics_vector),
-                                                               db_utils.get_assigned_topics(model_id, d['document_id']))
+def get_similar_documents_by_vector(model_id, source_topics_vector, model=None, limit=None, method=None,
+                                    metric=None):
+    """
+    Rank the documents assigned to the model by similarity with the source topic vector
+
+    :param model_id:
+    :param source_topics_vector: list or numpy array of n_topics values
+    :param model: the model information as stored in db, read from db if None
+    :param limit: the max number of documents to return, all if None
+    :param method: 'exact' or 'lsh' (approximate, only with limit), config.similarity_default_method if None
+    :param metric: 'cosine', 'hellinger' or 'jensen_shannon', config.similarity_default_metric if None
+    :return: a pair (similar documents, similarity method). Similar documents is a list of dictionaries with keys
+    'document_id', 'similarity_score' and 'model_id', most similar first, the similarity method tells the metric
+    and the engine that ranked them, e.g. 'cosine_exact' or 'hellinger_lsh'
+    """
+    if model is None:
+        model = db_utils.get_model_info(model_id)
+    if method is None:
+        method = config.similarity_default_method
+    if metric is None:
+        metric = config.similarity_default_metric
+
+    document_ids, scores, similarity_method = similarity_index.get_index(model).search(source_topics_vector, limit,
+                                                                                        method, metric)
+
+    return [{
+        'document_id': str(document_id),
+        'similarity_score': float(score),
+        'model_id': model_id
+    } for document_id, score in zip(document_ids, scores)], similarity_method
+
+
+def get_similar_documents_batch(model_id, document_ids=None, texts=None, limit=None, method=None, metric=None):
+    """
+    Rank the documents assigned to the model by similarity with several source documents and texts at once: the
+    texts are assigned in a single batched inference and all the queries are scored together against the similarity
+    index of the model (see similarity_index.DocumentTopicIndex.search_many).
 
-        result_docs[i] = {
-            'document_id': d['document_id'],
-            'topics_vector': topics_vector,
-            'similarity_score': 1 - spatial.distance.cosine(source_topics_vector, topics_vector),
+    :param model_id:
+    :param document_ids: list of ids of documents assigned to the model
+    :param texts: list of texts
+    :param limit: the max number of documents to return for each query, all if None
+    :param method: the search method, see get_similar_documents_by_vector
+    :param metric: the similarity metric, see get_similar_documents_by_vector
+    :return: None if the model is not found, else a list of dictionaries, one for each document id then for each
+    text, with keys 'source_document_id' or 'query_text', 'neighbors' and 'similarity_method' (see
+    get_similar_documents_by_vector). Unknown documents and texts without model words have no neighbors and a None
+    similarity method.
+    """
+    model = db_utils.get_model_info(model_id)
+    if model is None:
+        return None
+    if method is None:
+        method = config.similarity_default_method
+    if metric is None:
+        metric = config.similarity_default_metric
+
+    document_ids = document_ids or []
+    texts = texts or []
+    index = similarity_index.get_index(model)
+
+    queries = [{'source_document_id': d} for d in document_ids] + [{'query_text': t} for t in texts]
+    vectors = [index.get_vector(d) for d in document_ids]
+
+    if len(texts) > 0:
+        try:
+            # the texts without model words get an empty assignment
+            topic_assignments = model_registry.get_model_helper(model).compute_topic_assignment_for_new_documents(texts)
+        except EmptyCorpusError:
+            logging.warning('No model word found in the query texts, they have no neighbors.')
+            topic_assignments = [[] for _ in texts]
+
+        vectors += [transform_topics_assignment_from_lda_to_vector(model['number_of_topics'], a) if len(a) > 0
+                    else None for a in topic_assignments]
+
+    searched = [i for i, v in enumerate(vectors) if v is not None]
+    results = index.search_many([vectors[i] for i in searched], limit, method, metric,
+                                config.neighbors_max_block_elements)
+
+    for q in queries:
+        q['neighbors'] = []
+        q['similarity_method'] = None
+    for i, (neighbors_ids, scores, similarity_method) in zip(searched, results):
+        queries[i]['neighbors'] = [{
+            'document_id': str(document_id),
+            'similarity_score': float(score),
             'model_id': model_id
-        }
+        } for document_id, score in zip(neighbors_ids, scores)]
+        queries[i]['similarity_method'] = similarity_method
 
-    return sorted(result_docs, key=lambda x: x['similarity_score'], reverse=True)
+    return queries
 
 
-def assign_topics_for_query(model_id, text, threshold=0.0):
+def get_topic_documents(model_id, topic_ids, threshold=0.0, limit=None, operator='and'):
+    """
+    Return the documents assigned to some topics of the model, read from the topic posting lists of the similarity
+    index of the model.
+
+    :param model_id:
+    :param topic_ids: list of topic ids
+    :param threshold: float, the minimum weight of each topic
+    :param limit: the max number of documents to return, all if None
+    :param operator: 'and' for the documents that have all the topics, 'or' for those that have any
+    :return: None if the model is not found, else a list of documents in db format (document_id, model_id,
+    assigned_topics), by descending weight of the topics
+    """
+    model = db_utils.get_model_info(model_id)
+    if model is None:
+        return None
+
+    document_ids, _ = similarity_index.get_index(model).topic_documents(topic_ids, threshold, limit, operator)
+    document_ids = [str(d) for d in document_ids]
+
+    documents = {}
+    # bounded $in queries, the ids of a large topic would not fit in a single query
+    for start in range(0, len(document_ids), config.db_write_chunk_size):
+        for d in db_utils.get_all_documents(model_id, doc_ids=document_ids[start:start + config.db_write_chunk_size]):
+            documents.setdefault(d['document_id'], d)
+
+    return [documents[d] for d in document_ids if d in documents]
+
+
+def assign_topics_for_query(model_id, text, threshold=0.0, model_info=None):
     """
     Retrieve topics assignment for the specified query in the model.
     Return None if the specified model is not found.
     Return an empty topic assignment if an error occurs during computation or if the query has no relevant word after preprocessing.
     :param model_id:
     :param text:
+    :param model_info: the model information as stored in db, read from db if None
     :return:
     """
-    model_info = db_utils.get_model(model_id)
+    if model_info is None:
+        model_info = db_utils.get_model_info(model_id)
     if model_info is None:
         return None
 
-    # load model from file
-    model = LdaModelHelper(model_info['number_of_topics'], model_info['language'])
-    model.load_model_from_file(os.path.join(config.data_path, model_info['files_prefix']))
+    # get the loaded model from the registry, load from file on a cache miss
+    model = model_registry.get_model_helper(model_info)
 
     topic_assignment = model.compute_topic_assignment_for_query(text)
 
@@ -412,17 +661,17 @@ def assign_topics_for_new_doc(model_id, doc_id, doc_content, save_on_db=True):
     :return:
     """
 
-    model_info = db_utils.get_model(model_id)
+    model_info = db_utils.get_model_info(model_id)
     if model_info is None:
         return None
 
-    # load model from file
-    model = LdaModelHelper(model_info['number_of_topics'], model_info['language'])
-    model.load_model_from_file(os.path.join(config.data_path, model_info['files_prefix']))
+    # get the loaded model from the registry, load from file on a cache miss
+    model = model_registry.get_model_helper(model_info)
 
-    topic_assignment = model.compute_topic_assignment([doc_content])
+    topic_assignment = model.compute_topic_assignment_for_new_documents([doc_content])
     if save_on_db:
-        save_topic_assignment([{'doc_id': doc_id, 'doc_content': doc_content}], topic_assignment, model_id)
+        save_topic_assignment([{'doc_id': doc_id, 'doc_content': doc_content}], topic_assignment, model_id,
+                              model_info=model_info)
 
     return topic_assignment
 
@@ -435,14 +684,10 @@ def assign_topics_for_new_docs(model_id, docs, save_on_db=True):
     :param save_on_db:
     :return:
     """
-    model_info = db_utils.get_model(model_id)
+    model_info = db_utils.get_model_info(model_id)
     if model_info is None:
         return None
 
-    # load model from file
-    model = LdaModelHelper(model_info['number_of_topics'], model_info['language'])
-    model.load_model_from_file(os.path.join(config.data_path, model_info['files_prefix']))
-
     doc_contents = []
     document_ids = []
 
@@ -450,8 +695,53 @@ def assign_topics_for_new_docs(model_id, docs, save_on_db=True):
         doc_contents.append(d['doc_content'])
         document_ids.append(d['doc_id'])
 
-    topic_assignments = model.compute_topic_assignment(doc_contents)
+    if config.inference_pool_enabled and config.inference_fixed_vocabulary and \
+            len(doc_contents) >= config.inference_pool_min_documents:
+        # large batches are split in shards and assigned by the process pool
+        topic_assignments = inference_pool.assign_topics(model_info, doc_contents)
+    else:
+        # get the loaded model from the registry, load from file on a cache miss
+        model = model_registry.get_model_helper(model_info)
+        topic_assignments = model.compute_topic_assignment_for_new_documents(doc_contents)
+
     if save_on_db:
-        save_topic_assignment(docs, topic_assignments, model_id)
+        save_topic_assignment(docs, topic_assignments, model_id, model_info=model_info)
 
     return topic_assignments, document_ids
+
+
+def iter_topics_for_new_docs(model_info, docs, save_on_db=True, chunk_size=None):
+    """
+    Compute topics assignment for an iterable of new documents one chunk at a time, save each chunk on db and yield
+    every document with its assignment as soon as its chunk is done. Only one chunk is kept in memory.
+
+    :param model_info: the model information as stored in db
+    :param docs: iterable of jsons each one in format {'doc_id': 1, 'doc_content': 'c1'}
+    :param save_on_db:
+    :param chunk_size: the number of documents assigned at a time, config.documents_stream_chunk_size if None
+    :return: generator of pairs (document, topic assignment)
+    """
+    if chunk_size is None:
+        chunk_size = config.documents_stream_chunk_size
+
+    model = model_registry.get_model_helper(model_info)
+    docs = iter(docs)
+
+    while True:
+        chunk = list(itertools.islice(docs, chunk_size))
+        if len(chunk) == 0:
+            return
+
+        try:
+            topic_assignments = list(model.compute_topic_assignment_for_new_documents([d['doc_content']
+                                                                                       for d in chunk]))
+        except EmptyCorpusError:
+            # the other failures (model load, io) must not save empty assignments for the whole chunk
+            logging.warning('No model word found in a chunk of documents, their topics assignments are empty.')
+            topic_assignments = [[] for _ in chunk]
+
+        if save_on_db:
+            save_topic_assignment(chunk, topic_assignments, model_info['model_id'], model_info=model_info)
+
+        for d, topic_assignment in zip(chunk, topic_assignments):
+            yield d, topic_assignment
@@ -0,0 +1,92 @@
+"""
+Approximate nearest neighbors search over topic vectors with random-projection LSH.
+
+Each of the n_tables tables hashes a vector to the n_bits signs of its projections on random hyperplanes, so vectors
+with a small angle between them tend to share a bucket. A query collects the documents of its bucket in every table,
+plus the buckets that differ in the bits whose projections are closest to zero (multi-probe), and only these
+candidates are scored exactly.
+
+More tables and probes increase recall@k and query latency, more bits shrink the buckets (faster queries, lower
+recall). The build cost is one projection of the whole matrix and one sort per table.
+
+"""
+import numpy as np
+
+
+class LshIndex:
+
+    def __init__(self, n_tables=16, n_bits=12, n_probes=6, seed=0):
+        """
+
+        :param n_tables: the number of hash tables
+        :param n_bits: the number of hyperplanes (hash bits) of each table, at most 62
+        :param n_probes: the number of neighbouring buckets (one bit flipped) probed in each table besides the
+        bucket of the query
+        :param seed: the seed of the random hyperplanes
+        """
+        if not 0 < n_bits <= 62:
+            raise ValueError('The number of bits per table should be in [1, 62].')
+
+        self.n_tables = n_tables
+        self.n_bits = n_bits
+        self.n_probes = min(n_probes, n_bits)
+        self.seed = seed
+
+        self.hyperplanes = None
+        # for each table, the bucket codes of the documents sorted and the corresponding document positions
+        self.sorted_codes = None
+        self.positions = None
+
+    def fit(self, vectors):
+        """
+        Hash all the vectors (documents x dimensions).
+
+        :type vectors: numpy.ndarray or scipy.sparse.csr_matrix
+        :param vectors:
+        :return: self
+        """
+        random_state = np.random.RandomState(self.seed)
+        self.hyperplanes = random_state.standard_normal(
+            (self.n_tables * self.n_bits, vectors.shape[1])).astype(vectors.dtype)
+
+        codes = self._codes(vectors @ self.hyperplanes.T)
+
+        self.positions = np.argsort(codes, axis=0, kind='stable').T
+        self.sorted_codes = np.take_along_axis(codes, self.positions.T, axis=0).T
+
+        return self
+
+    def query_candidates(self, vector):
+        """
+        Return the positions of the documents that share a probed bucket with the vector.
+
+        :param vector: numpy array, a single vector
+        :rtype: numpy.ndarray
+        :return: sorted array of unique document positions
+        """
+        projections = (self.hyperplanes @ vector).reshape(self.n_tables, self.n_bits)
+        codes = self._codes(projections.reshape(1, -1))[0]
+
+        # flip the bits with the smallest margins, the most likely to differ for a close neighbor
+        flipped_bits = np.argsort(np.abs(projections), axis=1)[:, :self.n_probes]
+
+        probed_codes = np.concatenate([codes[:, np.newaxis], codes[:, np.newaxis] ^ (np.int64(1) << flipped_bits)],
+                                      axis=1)
+
+        # a mask over the documents is cheaper than sorting the (duplicated) candidates of all the tables
+        candidates = np.zeros(self.positions.shape[1], dtype=bool)
+        for t in range(self.n_tables):
+            starts = np.searchsorted(self.sorted_codes[t], probed_codes[t], side='left')
+            ends = np.searchsorted(self.sorted_codes[t], probed_codes[t], side='right')
+            for start, end in zip(starts, ends):
+                candidates[self.positions[t, start:end]] = True
+
+        return np.flatnonzero(candidates)
+
+    def _codes(self, projections):
+        """
+        Pack the signs of the projections (rows x (tables * bits)) in one integer per row and table
+        """
+        bits = (projections > 0).reshape(projections.shape[0], self.n_tables, self.n_bits).astype(np.int64)
+
+        return bits @ (np.int64(1) << np.arange(self.n_bits, dtype=np.int64))
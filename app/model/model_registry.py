@@ -0,0 +1,236 @@
+"""
+Process-wide registry of loaded LDA models.
+
+Loading a model from file means disk I/O and unpickling, which costs more than the inference performed on a single
+query. The query endpoints therefore share the loaded LdaModelHelper instances through this registry, keyed by
+(model_id, files_prefix). Entries are evicted in LRU order when the number of cached models or their estimated memory
+footprint exceed the limits set in config.
+
+When config.model_mmap_loading is set, the large model arrays are opened as read-only memory maps: all the api
+processes of a host share a single page cache copy of them and only the private part counts against the budget.
+
+"""
+import logging
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+import config
+from model import lda_model
+
+
+class ModelRegistry:
+
+    def __init__(self, max_bytes, max_entries):
+        """
+
+        :type max_bytes: int
+        :param max_bytes: the memory budget (estimated size in bytes) for all cached models
+        :type max_entries: int
+        :param max_entries: the maximum number of cached models
+        """
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+
+        # (model_id, files_prefix) -> (model helper, estimated size in bytes), least recently used first
+        self._entries = OrderedDict()
+        self._loading_locks = {}
+        self._lock = threading.Lock()
+
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, model_info):
+        """
+        Return the loaded model described by model_info, loading it from file on a cache miss.
+
+        :type model_info: dict
+        :param model_info: the model information as stored in db, should contain 'model_id', 'files_prefix',
+        'number_of_topics' and 'language'
+        :rtype: LdaModelHelper
+        :return:
+        """
+        key = (model_info['model_id'], model_info['files_prefix'])
+
+        helper = self._lookup(key)
+        if helper is not None:
+            return helper
+
+        # only one thread loads a given model, the others wait and then find it in the cache
+        with self._lock:
+            loading_lock = self._loading_locks.setdefault(key, threading.Lock())
+
+        with loading_lock:
+            helper = self._lookup(key, count=False)
+            if helper is not None:
+                return helper
+
+            with self._lock:
+                self.misses += 1
+
+            helper = lda_model.LdaModelHelper(model_info['number_of_topics'], model_info['language'],
+                                              training_use_lemmer=model_info.get('use_lemmer', True))
+            helper.load_model_from_file(os.path.join(config.data_path, model_info['files_prefix']),
+                                        mmap='r' if config.model_mmap_loading else None)
+            self._store(key, helper, estimate_model_size(helper))
+
+        with self._lock:
+            self._loading_locks.pop(key, None)
+
+        return helper
+
+    def invalidate(self, model_id):
+        """
+        Drop all the cached entries of a model, e.g. when the model is deleted or retrained.
+
+        :param model_id:
+        :return: the number of dropped entries
+        """
+        with self._lock:
+            keys = [k for k in self._entries.keys() if k[0] == model_id]
+            for k in keys:
+                self._remove(k)
+
+        return len(keys)
+
+    def clear(self):
+        with self._lock:
+            for k in list(self._entries.keys()):
+                self._remove(k)
+
+    def get_stats(self):
+        """
+        Return cache counters and the list of cached models.
+
+        :rtype: dict
+        :return:
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'current_bytes': self.current_bytes,
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries,
+                'models': [{'model_id': k[0], 'files_prefix': k[1], 'estimated_bytes': v[1],
+                            'memory': get_model_memory_usage(k[1]),
+                            'inference_batching': v[0].inference_batcher.get_stats()
+                            if v[0].inference_batcher is not None else None}
+                           for k, v in self._entries.items()]
+            }
+
+    def _lookup(self, key, count=True):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            self._entries.move_to_end(key)
+            if count:
+                self.hits += 1
+            return entry[0]
+
+    def _store(self, key, helper, size):
+        with self._lock:
+            # a new files prefix for the same model means that the model has been retrained
+            for k in [k for k in self._entries.keys() if k[0] == key[0] and k != key]:
+                self._remove(k)
+
+            self._entries[key] = (helper, size)
+            self.current_bytes += size
+
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or
+                                              self.current_bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+            if self.current_bytes > self.max_bytes:
+                logging.warning('Model {0} alone exceeds the model cache memory budget ({1} > {2} bytes).'
+                                .format(key[0], self.current_bytes, self.max_bytes))
+
+    def _remove(self, key):
+        _, size = self._entries.pop(key)
+        self.current_bytes -= size
+
+
+def estimate_model_size(helper):
+    """
+    Estimate the private memory footprint of a loaded model: the topic-word arrays that are not memory mapped
+    plus the vocabulary.
+
+    :type helper: LdaModelHelper
+    :param helper:
+    :rtype: int
+    :return: the estimated size in bytes
+    """
+    lda = helper.lda_model
+    size = _heap_bytes(lda.expElogbeta) + _heap_bytes(lda.state.sstats)
+    size += sys.getsizeof(lda.id2word) + sum(sys.getsizeof(w) for w in lda.id2word.values())
+
+    return size
+
+
+def _heap_bytes(array):
+    return 0 if isinstance(array, np.memmap) else array.nbytes
+
+
+def get_model_memory_usage(files_prefix, smaps_filepath='/proc/self/smaps'):
+    """
+    Report the memory used by the memory mapped files of a model in the current process, split in resident,
+    shared (with other processes) and private memory.
+
+    :param files_prefix: the files prefix of the model
+    :param smaps_filepath: the smaps file of the process
+    :rtype: dict
+    :return: sizes in bytes, an empty dict if the smaps file is not available (e.g. not on linux)
+    """
+    model_path = os.path.join(config.data_path, files_prefix)
+    usage = {'mapped_files': 0, 'rss_bytes': 0, 'pss_bytes': 0, 'shared_bytes': 0, 'private_bytes': 0}
+
+    try:
+        with open(smaps_filepath) as f:
+            in_model_mapping = False
+            for line in f:
+                fields = line.split()
+                if len(fields) >= 6 and '-' in fields[0]:
+                    # mapping header: address perms offset dev inode pathname
+                    in_model_mapping = fields[5].startswith(model_path)
+                    if in_model_mapping:
+                        usage['mapped_files'] += 1
+                elif in_model_mapping and len(fields) == 3 and fields[2] == 'kB':
+                    value = int(fields[1]) * 1024
+                    if fields[0] == 'Rss:':
+                        usage['rss_bytes'] += value
+                    elif fields[0] == 'Pss:':
+                        usage['pss_bytes'] += value
+                    elif fields[0] in ('Shared_Clean:', 'Shared_Dirty:'):
+                        usage['shared_bytes'] += value
+                    elif fields[0] in ('Private_Clean:', 'Private_Dirty:'):
+                        usage['private_bytes'] += value
+    except IOError:
+        return {}
+
+    return usage
+
+
+registry = ModelRegistry(config.model_cache_max_bytes, config.model_cache_max_entries)
+
+
+def get_model_helper(model_info):
+    return registry.get(model_info)
+
+
+def invalidate_model(model_id):
+    return registry.invalidate(model_id)
+
+
+def get_stats():
+    return registry.get_stats()
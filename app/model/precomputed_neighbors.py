@@ -0,0 +1,162 @@
+"""
+Precomputed top-k neighbors lists of the documents of a model.
+
+The cosine similarities between all the documents are computed one block of rows at a time: a block of the doc-topic
+matrix is multiplied by the whole matrix and only the top k of each row are kept, so the memory used is bounded by
+max_block_elements whatever the number of documents. The lists are stored in the neighbors collection, where a document
+neighbors request with limit <= k is a single read.
+
+New assignments refresh the lists incrementally: the new documents get their own list and are merged in the lists of
+their neighbors. A document whose top k would change because of a new document outside its own top k keeps its list
+until the next full computation.
+
+"""
+import logging
+from collections import defaultdict
+from time import time
+
+import numpy as np
+from scipy import sparse
+
+from db import db_utils
+from model import similarity_index
+
+insert_batch_size = 1000
+
+
+def iter_top_k_neighbors(index, k, positions=None, max_block_elements=2 ** 25):
+    """
+    Compute the k most similar documents (cosine) of some documents of the index. As in the exact search, the lists
+    include the documents themselves.
+
+    :type index: similarity_index.DocumentTopicIndex
+    :param index:
+    :param k: the number of neighbors of each document
+    :param positions: numpy array, the positions of the documents in the index, all documents if None
+    :param max_block_elements: the max number of similarities computed at a time
+    :return: generator of tuples (position, neighbors positions, similarity scores), most similar first
+    """
+    n_documents = len(index)
+    if positions is None:
+        positions = np.arange(n_documents)
+    k = min(k, n_documents)
+
+    norms = index.norms
+    inverse_norms = np.divide(1, norms, out=np.zeros_like(norms), where=norms != 0)
+    block_size = max(1, max_block_elements // max(n_documents, 1))
+
+    for start in range(0, len(positions), block_size):
+        block = positions[start:start + block_size]
+
+        if sparse.issparse(index.distributions):
+            # the block of scores is dense anyway, multiply the whole sparse matrix by the dense rows of the block
+            scores = np.ascontiguousarray((index.distributions @ index.distributions[block].toarray().T).T)
+        else:
+            scores = index.distributions[block] @ index.distributions.T
+        scores *= inverse_norms[np.newaxis, :]
+        scores *= inverse_norms[block][:, np.newaxis]
+
+        if k <= 0:
+            for p in block:
+                yield p, np.empty(0, dtype=np.int64), np.empty(0, dtype=scores.dtype)
+            continue
+
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind='stable')
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+        for i, p in enumerate(block):
+            yield p, top[i], top_scores[i]
+
+
+def compute_neighbors(model_info, k, max_block_elements=2 ** 25):
+    """
+    Compute and store the neighbors lists of all the documents of a model, replacing the existing ones.
+
+    :param model_info: the model information as stored in db
+    :param k: the number of neighbors of each document
+    :param max_block_elements: see iter_top_k_neighbors
+    :return: the number of documents
+    """
+    model_id = model_info['model_id']
+    index = similarity_index.get_index(model_info).compact()
+
+    db_utils.delete_all_neighbors(model_id)
+
+    batch = []
+    for position, neighbors, scores in iter_top_k_neighbors(index, k, max_block_elements=max_block_elements):
+        batch.append(_neighbors_document(model_id, index.document_ids[position], index.document_ids[neighbors],
+                                         scores))
+        if len(batch) == insert_batch_size:
+            db_utils.insert_all_neighbors(batch)
+            batch = []
+    db_utils.insert_all_neighbors(batch)
+
+    db_utils.set_model_precomputed_neighbors(model_id, {'k': k, 'files_prefix': model_info['files_prefix'],
+                                                        'computed': time()})
+    logging.info('Neighbors of model {0} computed: {1} documents, k={2}.'.format(model_id, len(index), k))
+
+    return len(index)
+
+
+def refresh_neighbors(model_info, document_ids, max_block_elements=2 ** 25):
+    """
+    Compute the neighbors lists of new documents and merge the new documents in the lists of their neighbors.
+    Nothing is done if the neighbors of the model have not been computed for its current files.
+
+    :param model_info: the model information as stored in db
+    :param document_ids: the ids of the new documents
+    :param max_block_elements: see iter_top_k_neighbors
+    :return: the number of refreshed documents
+    """
+    if not has_neighbors(model_info):
+        return 0
+
+    model_id = model_info['model_id']
+    k = model_info['precomputed_neighbors']['k']
+    # the new documents are in the delta segment of the index: search both segments, the compaction is left to the
+    # background compaction of the index
+    index = similarity_index.get_index(model_info)
+
+    new_documents = {}
+    for document_id in document_ids:
+        vector = index.get_vector(str(document_id))
+        if vector is not None:
+            new_documents[str(document_id)] = vector
+
+    results = index.search_many(list(new_documents.values()), k, 'exact', 'cosine', max_block_elements) \
+        if len(new_documents) > 0 else []
+
+    new_lists = []
+    merged_neighbors = defaultdict(list)
+    for document_id, (neighbors, scores, _) in zip(new_documents.keys(), results):
+        new_lists.append(_neighbors_document(model_id, document_id, neighbors, scores))
+        for neighbor, score in zip(neighbors, scores):
+            # the lists of the new documents are already complete
+            if str(neighbor) not in new_documents:
+                merged_neighbors[str(neighbor)].append({'document_id': document_id, 'similarity_score': float(score)})
+
+    db_utils.replace_neighbors(new_lists)
+    db_utils.merge_neighbors(model_id, merged_neighbors, k)
+
+    return len(new_lists)
+
+
+def has_neighbors(model_info):
+    """
+    Return True if the neighbors lists of the model have been computed for its current files
+    """
+    precomputed_neighbors = model_info.get('precomputed_neighbors')
+
+    return precomputed_neighbors is not None and \
+        precomputed_neighbors.get('files_prefix') == model_info.get('files_prefix')
+
+
+def _neighbors_document(model_id, document_id, neighbors, scores):
+    return {
+        'model_id': model_id,
+        'document_id': str(document_id),
+        'neighbors': [{'document_id': str(d), 'similarity_score': float(s)} for d, s in zip(neighbors, scores)]
+    }
@@ -0,0 +1,145 @@
+"""
+Vectorized similarity kernels between a topic distribution and all the rows of a doc-topic matrix.
+
+The matrix rows and the query are topic distributions (non negative, summing to 1, or all zeros for documents without
+topics). The matrix is either a dense numpy array or a scipy csr matrix, that stores only the non zero topic weights of
+each document. Every kernel returns a similarity in [0, 1], higher is more similar, and 0 for the all zeros rows:
+
+- cosine: the cosine of the angle between the distributions;
+- hellinger: 1 - Hellinger distance, where the Bhattacharyya coefficient is a dot product with the square root rows;
+- jensen_shannon: 1 - Jensen-Shannon divergence (base 2). Only the topics of the query need to be gathered from the
+  matrix, the contribution of the other topics follows from the precomputed row entropies.
+
+"""
+import numpy as np
+from scipy import sparse
+
+metrics = ('cosine', 'hellinger', 'jensen_shannon')
+
+
+def row_entropies(distributions):
+    """
+    Shannon entropy (natural log) of each row, 0 * log(0) = 0
+    """
+    if sparse.issparse(distributions):
+        distributions = sparse.csr_matrix(distributions)
+        values = distributions.data
+        terms = values * np.log(values, out=np.zeros_like(values), where=values > 0)
+        return -np.asarray(sparse.csr_matrix((terms, distributions.indices, distributions.indptr),
+                                             shape=distributions.shape).sum(axis=1)).ravel()
+
+    logs = np.log(distributions, out=np.zeros_like(distributions), where=distributions > 0)
+
+    return -np.einsum('ij,ij->i', distributions, logs)
+
+
+def row_norms(distributions):
+    """
+    L2 norm of each row
+    """
+    if sparse.issparse(distributions):
+        return np.sqrt(np.asarray(distributions.multiply(distributions).sum(axis=1)).ravel())
+
+    return np.linalg.norm(distributions, axis=1)
+
+
+def square_root(distributions):
+    """
+    Element-wise square root, a csr matrix stays sparse
+    """
+    if sparse.issparse(distributions):
+        return distributions.sqrt()
+
+    return np.sqrt(distributions)
+
+
+def cosine_similarities(distributions, norms, query):
+    """
+
+    :param distributions: numpy array, documents x topics
+    :param norms: numpy array, the L2 norm of each row of distributions
+    :param query: numpy array, a topic distribution, or queries x topics to score a batch of queries with a single
+    matrix-matrix product
+    :rtype: numpy.ndarray
+    :return: the scores of the documents, queries x documents for a batch
+    """
+    denominators = np.linalg.norm(query, axis=-1)[..., np.newaxis] * norms
+    scores = (distributions @ query.T).T
+
+    return np.divide(scores, denominators, out=np.zeros_like(scores), where=denominators != 0)
+
+
+def hellinger_similarities(sqrt_distributions, query):
+    """
+
+    :param sqrt_distributions: numpy array, documents x topics, the element-wise square root of the distributions
+    :param query: numpy array, a topic distribution, or queries x topics for a batch of queries
+    :rtype: numpy.ndarray
+    :return: the scores of the documents, queries x documents for a batch
+    """
+    bhattacharyya = (sqrt_distributions @ np.sqrt(query).T).T
+    scores = 1 - np.sqrt(np.maximum(1 - bhattacharyya, 0))
+    scores[bhattacharyya == 0] = 0
+
+    return scores
+
+
+def jensen_shannon_similarities(distributions, norms, entropies, query):
+    """
+
+    :param distributions: numpy array, documents x topics
+    :param norms: numpy array, the L2 norm of each row of distributions (0 for the rows without topics)
+    :param entropies: numpy array, the entropy of each row of distributions, see row_entropies
+    :param query: numpy array, a topic distribution
+    :rtype: numpy.ndarray
+    :return:
+    """
+    if sparse.issparse(distributions):
+        return _sparse_jensen_shannon_similarities(distributions, norms, query)
+
+    topics = np.flatnonzero(query)
+    p = distributions[:, topics]
+    q = query[topics]
+    m = (p + q) / 2
+
+    row_sums = (norms != 0).astype(distributions.dtype)
+    p_entropies = row_entropies(p)
+
+    # entropy of the mixture: on the topics missing from the query m = p / 2
+    mixture_entropies = (entropies - p_entropies) / 2 + np.log(2) / 2 * (row_sums - p.sum(axis=1)) + \
+        row_entropies(m)
+    divergences = mixture_entropies - (entropies + row_entropies(q[np.newaxis])[0]) / 2
+
+    scores = np.clip(1 - divergences / np.log(2), 0, 1).astype(distributions.dtype)
+    scores[row_sums == 0] = 0
+
+    return scores
+
+
+def _sparse_jensen_shannon_similarities(distributions, norms, query):
+    """
+    Jensen-Shannon kernel on the stored weights of a csr matrix. With m = (p + q) / 2 split on the topics of p only,
+    of q only and of both, the divergence of a row is log(2) / 2 * (sum(p) + 1) minus a correction on the shared
+    topics: m log(m) - p/2 log(p/2) - q/2 log(q/2) summed, so only the stored weights of the query topics are visited.
+    """
+    distributions = sparse.csr_matrix(distributions)
+    values = distributions.data
+    q = query[distributions.indices]
+    shared = q > 0
+
+    p_shared = values[shared] / 2
+    q_shared = q[shared] / 2
+    m = p_shared + q_shared
+    corrections = np.zeros_like(values)
+    corrections[shared] = m * np.log(m) - p_shared * np.log(p_shared) - q_shared * np.log(q_shared)
+
+    row_sums = (norms != 0).astype(values.dtype)
+    ones = np.ones(distributions.shape[1], dtype=values.dtype)
+    row_corrections = sparse.csr_matrix((corrections, distributions.indices, distributions.indptr),
+                                        shape=distributions.shape) @ ones
+    divergences = np.log(2) / 2 * (row_sums + 1) - row_corrections
+
+    scores = np.clip(1 - divergences / np.log(2), 0, 1).astype(values.dtype)
+    scores[row_sums == 0] = 0
+
+    return scores
@@ -0,0 +1,890 @@
+"""
+Document-topic matrix index for the similarity search.
+
+The topic distributions of all the documents assigned to a model are kept in a float32 matrix (documents x topics)
+with L1-normalized rows, next to the array of the document ids (sorted) and a few per-row values (norms, entropies)
+precomputed at load time. The similarity of a query with every document is then computed by the vectorized kernels of
+model.similarity: a single matrix-vector product for cosine and Hellinger.
+
+The matrix is stored in csr format by default (config.similarity_index_format): an assignment has only the few topics
+over the minimum probability of the model, the weights under config.similarity_prune_threshold are dropped as well
+(they are kept aside for the topic posting lists only), so the index takes a fraction of the memory of the dense
+documents x topics array and the sparse products are faster.
+
+The index is built from one cursor over the topics collection, saved next to the model files and loaded by the api
+processes on the first neighbors request.
+
+New assignments are appended by the writers to a write-ahead log next to the index file (one json line per document).
+Every process tails the log on each request into a small delta segment that is searched together with the main
+array, so new documents are searchable right away without blocking the writers nor rebuilding the index. The delta
+segment is merged into the main array in a background thread when it grows over config.similarity_delta_max_documents
+or at least every config.similarity_compaction_interval seconds; the compacted index is saved with the log offset it
+covers, so that new processes start tailing from there.
+
+The compaction then rotates the log: the compacted index is saved aside, then, under the lock of the writers, the
+log is replaced by a new one with a new generation in its header line, holding only the assignments that are not in the
+compacted index, so the log does not grow without bound. The writers are only blocked while the tail of the log is
+copied, not while the index is saved. The other processes see the new generation on their next refresh and load the
+compacted index.
+
+Approximate searches ('lsh' method) first restrict the scoring to the candidates of an LSH index over the same rows,
+built in memory on the first approximate query. The topic membership queries read the posting lists of
+model.topic_postings, built in the same way from the rows of each segment.
+
+"""
+import fcntl
+import json
+import logging
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from time import time
+
+import numpy as np
+from scipy import sparse
+
+import config
+from db import db_utils
+from model import similarity
+from model.lsh_index import LshIndex
+from model.topic_postings import TopicPostings
+
+
+class DocumentTopicIndex:
+
+    file_suffix = '.similarity.npz'
+    log_file_suffix = '.similarity.wal'
+
+    def __init__(self, document_ids, distributions, wal_offset=0, totals=None, wal_generation='', pruned=None):
+        """
+
+        :param document_ids: numpy array of strings, sorted
+        :param distributions: numpy array or scipy csr matrix of float32, documents x topics, distributions[i] is the
+        topic distribution of document_ids[i] (all zeros if the document has no topics)
+        :param wal_offset: the size of the write-ahead log of the model already included in the index
+        :param totals: numpy array of float32, the sum of the stored topic weights of each document before the
+        normalization, to recover the weights of the db assignments (all ones if None)
+        :param wal_generation: the generation of the write-ahead log that wal_offset refers to, '' for a log without
+        header
+        :param pruned: scipy csr matrix of float32, documents x topics, the weights of the db assignments dropped from
+        distributions by the prune threshold, kept for the topic posting lists. None if unknown (an index file saved
+        before they were stored).
+        """
+        self.document_ids = document_ids
+        self.distributions = distributions
+        self.wal_offset = wal_offset
+        self.wal_generation = wal_generation
+        self.totals = totals if totals is not None else np.ones(len(document_ids), dtype=np.float32)
+        self.pruned = pruned
+        self.norms = similarity.row_norms(distributions)
+        self.entropies = similarity.row_entropies(distributions)
+
+        # built on the first query that needs them
+        self.sqrt_distributions = None
+        self.lsh_index = None
+        self.topic_postings = None
+        self._lsh_index_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.document_ids)
+
+    @property
+    def index_format(self):
+        return 'sparse' if sparse.issparse(self.distributions) else 'dense'
+
+    @property
+    def nbytes(self):
+        return sum(_nbytes(a) for a in (self.document_ids, self.distributions, self.totals, self.pruned, self.norms,
+                                        self.entropies, self.sqrt_distributions, self.topic_postings) if a is not None)
+
+    def get_positions(self, document_ids):
+        """
+        Return the positions of some documents in the index.
+
+        :param document_ids: list of document ids
+        :rtype: numpy.ndarray
+        :return: array of positions, -1 for the documents that are not in the index
+        """
+        document_ids = np.array([str(d) for d in document_ids], dtype=str)
+        if len(self.document_ids) == 0 or len(document_ids) == 0:
+            return np.full(len(document_ids), -1, dtype=np.int64)
+
+        positions = np.searchsorted(self.document_ids, document_ids)
+        positions[positions == len(self.document_ids)] = 0
+
+        return np.where(self.document_ids[positions] == document_ids, positions, -1)
+
+    def get_vector(self, document_id):
+        """
+        Return the topic distribution of a document, None if the document is not in the index
+        """
+        position = self.get_positions([document_id])[0]
+        if position < 0:
+            return None
+
+        if sparse.issparse(self.distributions):
+            return self.distributions[position].toarray()[0]
+
+        return self.distributions[position]
+
+    def similarities(self, topics_vector, metric='cosine', positions=None):
+        """
+        Compute the similarity between a topic vector and the documents of the index.
+
+        :param topics_vector: list or numpy array of n_topics values, normalized to a distribution
+        :param metric: one of similarity.metrics
+        :param positions: numpy array, the positions of the documents to score, all documents if None
+        :rtype: numpy.ndarray
+        :return: array of similarity scores in [0, 1], aligned with document_ids (or positions), 0 for documents
+        without topics
+        """
+        query = self._normalize(topics_vector)
+        if query is None:
+            return np.zeros(len(self) if positions is None else len(positions), dtype=self.distributions.dtype)
+
+        if metric == 'cosine':
+            return similarity.cosine_similarities(self._rows(self.distributions, positions),
+                                                  self._rows(self.norms, positions), query)
+        elif metric == 'hellinger':
+            return similarity.hellinger_similarities(self._rows(self.get_sqrt_distributions(), positions), query)
+        elif metric == 'jensen_shannon':
+            return similarity.jensen_shannon_similarities(self._rows(self.distributions, positions),
+                                                          self._rows(self.norms, positions),
+                                                          self._rows(self.entropies, positions), query)
+        else:
+            raise ValueError('Unknown similarity metric {0}, allowed values: {1}.'.format(metric, similarity.metrics))
+
+    @staticmethod
+    def _rows(values, positions):
+        # indexing a csr matrix copies it, even with a full slice
+        return values if positions is None else values[positions]
+
+    def get_sqrt_distributions(self):
+        if self.sqrt_distributions is None:
+            self.sqrt_distributions = similarity.square_root(self.distributions)
+
+        return self.sqrt_distributions
+
+    def get_lsh_index(self):
+        if self.lsh_index is None:
+            # the concurrent first approximate queries wait for a single fit of the tables
+            with self._lsh_index_lock:
+                if self.lsh_index is None:
+                    self.lsh_index = LshIndex(config.lsh_tables, config.lsh_bits,
+                                              config.lsh_probes).fit(self.distributions)
+
+        return self.lsh_index
+
+    def get_topic_postings(self):
+        if self.topic_postings is None:
+            self.topic_postings = TopicPostings.from_index(self)
+
+        return self.topic_postings
+
+    def search(self, topics_vector, limit=None, method='exact', metric='cosine'):
+        """
+        Rank the documents of the index by similarity with a topic vector.
+
+        :param topics_vector: list or numpy array of n_topics values
+        :param limit: the max number of documents to return, all if None
+        :param method: 'exact' to score all the documents, 'lsh' to score only the LSH candidates (selected by cosine).
+        The exact method is used anyway when limit is None or when there are less than limit candidates.
+        :param metric: one of similarity.metrics
+        :return: a tuple (positions, scores, similarity_method), positions and scores sorted by descending score,
+        similarity_method is '<metric>_<method>', e.g. 'cosine_exact'
+        """
+        positions = None
+
+        if method == 'lsh' and limit is not None:
+            query = self._normalize(topics_vector)
+            if query is not None:
+                candidates = self.get_lsh_index().query_candidates(query)
+                if len(candidates) >= limit:
+                    positions = candidates
+
+        scores = self.similarities(topics_vector, metric, positions)
+        ranking = top_k(scores, limit)
+
+        if positions is None:
+            return ranking, scores[ranking], '{0}_exact'.format(metric)
+
+        return positions[ranking], scores[ranking], '{0}_lsh'.format(metric)
+
+    def search_many(self, topics_vectors, limit=None, method='exact', metric='cosine', max_block_elements=2 ** 25):
+        """
+        Rank the documents of the index by similarity with several topic vectors, see search. With the exact method
+        and the cosine or Hellinger metric the scores of a block of queries are computed with a single matrix-matrix
+        product, the other searches are run one query at a time.
+
+        :param topics_vectors: list of topic vectors or numpy array, queries x n_topics
+        :param limit: the max number of documents to return for each query, all if None
+        :param method: 'exact' or 'lsh'
+        :param metric: one of similarity.metrics
+        :param max_block_elements: the max number of similarities computed at a time
+        :return: list of tuples (positions, scores, similarity_method), one for each query
+        """
+        if method != 'exact' or metric not in ('cosine', 'hellinger'):
+            return [self.search(v, limit, method, metric) for v in topics_vectors]
+
+        queries = np.asarray(topics_vectors, dtype=self.distributions.dtype).reshape(-1, self.distributions.shape[1])
+        totals = queries.sum(axis=1)
+        queries = np.divide(queries, totals[:, np.newaxis], out=np.zeros_like(queries), where=totals[:, np.newaxis] > 0)
+
+        block_size = max(1, max_block_elements // max(len(self), 1))
+        results = []
+        for start in range(0, len(queries), block_size):
+            block = queries[start:start + block_size]
+            if metric == 'cosine':
+                scores = similarity.cosine_similarities(self.distributions, self.norms, block)
+            else:
+                scores = similarity.hellinger_similarities(self.get_sqrt_distributions(), block)
+
+            for row in scores:
+                ranking = top_k(row, limit)
+                results.append((ranking, row[ranking], '{0}_exact'.format(metric)))
+
+        return results
+
+    def _normalize(self, topics_vector):
+        query = np.asarray(topics_vector, dtype=self.distributions.dtype)
+        total = np.sum(query)
+
+        return None if total <= 0 else query / total
+
+    def merge(self, other):
+        """
+        Return a new index with the documents of both indexes, the rows of other replace those of the same documents.
+
+        :type other: DocumentTopicIndex
+        :param other:
+        :rtype: DocumentTopicIndex
+        :return:
+        """
+        replaced = self.get_positions(other.document_ids)
+        kept = np.ones(len(self.document_ids), dtype=bool)
+        kept[replaced[replaced >= 0]] = False
+
+        document_ids = self.document_ids[kept].astype(np.result_type(self.document_ids, other.document_ids))
+        distributions = self.distributions[np.flatnonzero(kept)]
+        totals = self.totals[kept]
+        wal_offset = max(self.wal_offset, other.wal_offset)
+        # the document ids are unique once the replaced rows are dropped, the sorted merge is a permutation
+        order = np.argsort(np.concatenate([document_ids, other.document_ids]), kind='stable')
+        pruned = sparse.vstack([self.get_pruned()[np.flatnonzero(kept)], other.get_pruned()], format='csr')[order]
+
+        if sparse.issparse(distributions):
+            document_ids = np.concatenate([document_ids, other.document_ids])
+            distributions = sparse.vstack([distributions, sparse.csr_matrix(other.distributions)], format='csr')
+
+            return DocumentTopicIndex(document_ids[order], distributions[order], wal_offset,
+                                      np.concatenate([totals, other.totals])[order], self.wal_generation, pruned)
+
+        # both id arrays are sorted, the new rows are inserted in place
+        insert_positions = np.searchsorted(document_ids, other.document_ids)
+
+        other_distributions = other.distributions
+        if sparse.issparse(other_distributions):
+            other_distributions = other_distributions.toarray()
+
+        return DocumentTopicIndex(np.insert(document_ids, insert_positions, other.document_ids),
+                                  np.insert(distributions, insert_positions, other_distributions, axis=0),
+                                  wal_offset, np.insert(totals, insert_positions, other.totals), self.wal_generation,
+                                  pruned)
+
+    def get_pruned(self):
+        """
+        Return the pruned weights, an empty matrix if they are unknown
+        """
+        if self.pruned is None:
+            return sparse.csr_matrix(self.distributions.shape, dtype=np.float32)
+
+        return self.pruned
+
+    def save(self, file_path):
+        # written aside and renamed, the processes that load the index never see a partial file
+        temp_file_path = '{0}.{1}.tmp'.format(file_path, os.getpid())
+        pruned = self.get_pruned()
+        with open(temp_file_path, 'wb') as f:
+            if sparse.issparse(self.distributions):
+                np.savez(f, document_ids=self.document_ids, data=self.distributions.data,
+                         indices=self.distributions.indices, indptr=self.distributions.indptr,
+                         shape=np.array(self.distributions.shape), wal_offset=self.wal_offset, totals=self.totals,
+                         wal_generation=self.wal_generation, pruned_data=pruned.data, pruned_indices=pruned.indices,
+                         pruned_indptr=pruned.indptr)
+            else:
+                np.savez(f, document_ids=self.document_ids, distributions=self.distributions,
+                         wal_offset=self.wal_offset, totals=self.totals, wal_generation=self.wal_generation,
+                         pruned_data=pruned.data, pruned_indices=pruned.indices, pruned_indptr=pruned.indptr)
+        os.replace(temp_file_path, file_path)
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as data:
+            if 'indptr' in data:
+                distributions = sparse.csr_matrix((data['data'], data['indices'], data['indptr']),
+                                                  shape=tuple(data['shape']))
+            else:
+                distributions = data['distributions']
+
+            pruned = None
+            if 'pruned_indptr' in data:
+                pruned = sparse.csr_matrix((data['pruned_data'], data['pruned_indices'], data['pruned_indptr']),
+                                           shape=distributions.shape)
+
+            return cls(data['document_ids'], distributions, int(data['wal_offset']) if 'wal_offset' in data else 0,
+                       data['totals'] if 'totals' in data else None,
+                       str(data['wal_generation']) if 'wal_generation' in data else '', pruned)
+
+    @classmethod
+    def from_assignments(cls, assignments, n_topics, wal_offset=0, prune_threshold=0.0, index_format='sparse',
+                         wal_generation=''):
+        """
+        Build the index from topics assignments in db format.
+
+        :param assignments: iterable of dictionaries with keys 'document_id' and 'assigned_topics', the latter a list
+        of {'topic_id': id, 'topic_weight': value}. Only the first assignment of a document is kept.
+        :param n_topics: the number of topics of the model
+        :param wal_offset: see __init__
+        :param prune_threshold: the topic weights under this value are dropped, the remaining ones are normalized (the
+        dropped ones are kept aside for the topic posting lists)
+        :param index_format: 'sparse' for a csr matrix, 'dense' for a numpy array
+        :param wal_generation: see __init__
+        :rtype: DocumentTopicIndex
+        :return:
+        """
+        document_ids = []
+        rows = []
+        topic_ids = []
+        weights = []
+
+        for i, a in enumerate(assignments):
+            document_ids.append(str(a['document_id']))
+            for t in a['assigned_topics']:
+                rows.append(i)
+                topic_ids.append(int(t['topic_id']))
+                weights.append(float(t['topic_weight']))
+
+        weights = np.asarray(weights, dtype=np.float32)
+        rows = np.asarray(rows, dtype=np.int64)
+        topic_ids = np.asarray(topic_ids, dtype=np.int64)
+        stored = weights >= np.finfo(np.float32).tiny
+        kept = stored & (weights >= prune_threshold)
+        pruned = stored & ~kept
+        distributions = sparse.csr_matrix((weights[kept], (rows[kept], topic_ids[kept])),
+                                          shape=(len(document_ids), n_topics), dtype=np.float32)
+        pruned = sparse.csr_matrix((weights[pruned], (rows[pruned], topic_ids[pruned])),
+                                   shape=(len(document_ids), n_topics), dtype=np.float32)
+
+        document_ids, first = np.unique(np.array(document_ids, dtype=str), return_index=True)
+        distributions = distributions[first]
+        pruned = pruned[first]
+
+        # the weights under the minimum probability of the model are not stored, normalize what remains
+        totals = np.asarray(distributions.sum(axis=1), dtype=np.float32).ravel()
+        totals[totals == 0] = 1.0
+        distributions.data /= np.repeat(totals, np.diff(distributions.indptr))
+
+        if index_format == 'dense':
+            distributions = distributions.toarray()
+        elif index_format != 'sparse':
+            raise ValueError('Unknown similarity index format {0}, allowed values: sparse, dense.'.format(index_format))
+
+        return cls(document_ids, distributions, wal_offset, totals, wal_generation, pruned)
+
+
+def _nbytes(values):
+    if sparse.issparse(values):
+        return values.data.nbytes + values.indices.nbytes + values.indptr.nbytes
+
+    return values.nbytes
+
+
+def top_k(scores, k=None):
+    """
+    Return the positions of the k highest scores, highest first, selecting them with a partial sort.
+
+    :param scores: numpy array of scores
+    :param k: the number of positions to return, all if None
+    :rtype: numpy.ndarray
+    :return:
+    """
+    if k is None or k >= len(scores):
+        return np.argsort(-scores, kind='stable')
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    winners = np.argpartition(-scores, k - 1)[:k]
+    return winners[np.argsort(-scores[winners], kind='stable')]
+
+
+class SegmentedIndex:
+
+    def __init__(self, main, file_path, wal_file_path):
+        """
+        An index made of a main segment, loaded from file, and of a delta segment with the assignments appended to the
+        write-ahead log after the main segment was saved.
+
+        :type main: DocumentTopicIndex
+        :param main:
+        :param file_path: the file of the main segment, rewritten on compaction
+        :param wal_file_path: the write-ahead log of the model
+        """
+        self.main = main
+        self.file_path = file_path
+        self.wal_file_path = wal_file_path
+        self.wal_offset = main.wal_offset
+        self.wal_generation = main.wal_generation
+        # (inode, size) of the log at the last refresh, the log is read again only when it changes
+        self._wal_stat = None
+
+        # document_id -> last assignment read from the log, in db format
+        self._delta_assignments = {}
+        self.delta = None
+        # main rows replaced by a delta row
+        self.superseded = None
+
+        self._lock = threading.Lock()
+        # held by a whole compaction, from the snapshot of the segments to the swap of the main segment
+        self._compaction_lock = threading.Lock()
+        self._compacting = False
+        self.last_compaction = time()
+
+    def __len__(self):
+        if self.delta is None:
+            return len(self.main)
+
+        return len(self.main) - int(self.superseded.sum()) + len(self.delta)
+
+    @property
+    def nbytes(self):
+        return self.main.nbytes + (self.delta.nbytes if self.delta is not None else 0)
+
+    def refresh(self):
+        """
+        Read the assignments appended to the write-ahead log since the last refresh into the delta segment and start
+        a background compaction when needed.
+        """
+        try:
+            stat = os.stat(self.wal_file_path)
+        except OSError:
+            return
+
+        with self._lock:
+            if (stat.st_ino, stat.st_size) != self._wal_stat:
+                with open(self.wal_file_path, 'rb') as f:
+                    generation, header_size = read_log_header(f)
+                    if generation != self.wal_generation:
+                        # the log has been rotated by the compaction of another process
+                        self._reload(generation, header_size)
+                    f.seek(self.wal_offset)
+                    data = f.read()
+                self._wal_stat = (stat.st_ino, stat.st_size)
+
+                # a line still being written is read on the next refresh
+                end = data.rfind(b'\n') + 1
+                if end != 0:
+                    for line in data[:end].splitlines():
+                        if line.strip() and not line.startswith(b'#'):
+                            assignment = json.loads(line.decode('utf-8'))
+                            self._delta_assignments[str(assignment['document_id'])] = assignment
+
+                    self.wal_offset += end
+                    self._update_delta()
+
+            compaction_needed = self.delta is not None and not self._compacting and \
+                (len(self.delta) >= config.similarity_delta_max_documents or
+                 time() - self.last_compaction >= config.similarity_compaction_interval)
+            if compaction_needed:
+                self._compacting = True
+                threading.Thread(target=self._compact_in_background, daemon=True).start()
+
+    def get_vector(self, document_id):
+        """
+        Return the topic distribution of a document, None if the document is not in the index
+        """
+        main, delta = self.main, self.delta
+
+        vector = delta.get_vector(document_id) if delta is not None else None
+        if vector is None:
+            vector = main.get_vector(document_id)
+
+        return vector
+
+    def search(self, topics_vector, limit=None, method='exact', metric='cosine'):
+        """
+        Rank the documents of both segments by similarity with a topic vector, see DocumentTopicIndex.search.
+
+        :return: a tuple (document ids, scores, similarity_method), sorted by descending score
+        """
+        return self.search_many([topics_vector], limit, method, metric, None)[0]
+
+    def search_many(self, topics_vectors, limit=None, method='exact', metric='cosine', max_block_elements=2 ** 25):
+        """
+        Rank the documents of both segments by similarity with several topic vectors, see
+        DocumentTopicIndex.search_many.
+
+        :param max_block_elements: see DocumentTopicIndex.search_many, None to search one query at a time
+        :return: list of tuples (document ids, scores, similarity_method), one for each query
+        """
+        with self._lock:
+            main, delta, superseded = self.main, self.delta, self.superseded
+
+        def search(index, index_limit, index_method):
+            if max_block_elements is None:
+                return [index.search(v, index_limit, index_method, metric) for v in topics_vectors]
+            return index.search_many(topics_vectors, index_limit, index_method, metric, max_block_elements)
+
+        if delta is None:
+            return [(main.document_ids[positions], scores, similarity_method)
+                    for positions, scores, similarity_method in search(main, limit, method)]
+
+        # enough main results to fill the limit after dropping the replaced documents
+        main_limit = None if limit is None else limit + int(superseded.sum())
+        results = []
+        for (positions, scores, similarity_method), (delta_positions, delta_scores, _) in \
+                zip(search(main, main_limit, method), search(delta, limit, 'exact')):
+            kept = ~superseded[positions]
+            document_ids = np.concatenate([main.document_ids[positions[kept]], delta.document_ids[delta_positions]])
+            scores = np.concatenate([scores[kept], delta_scores])
+            ranking = top_k(scores, limit)
+            results.append((document_ids[ranking], scores[ranking], similarity_method))
+
+        return results
+
+    def topic_documents(self, topic_ids, threshold=0.0, limit=None, operator='and'):
+        """
+        Return the documents of both segments that have some topics, see topic_postings.TopicPostings.search.
+
+        :return: a tuple (document ids, scores), sorted by descending score
+        """
+        with self._lock:
+            main, delta, superseded = self.main, self.delta, self.superseded
+
+        if delta is None:
+            positions, scores = main.get_topic_postings().search(topic_ids, threshold, limit, operator)
+            return main.document_ids[positions], scores
+
+        main_limit = None if limit is None else limit + int(superseded.sum())
+        positions, scores = main.get_topic_postings().search(topic_ids, threshold, main_limit, operator)
+        kept = ~superseded[positions]
+        delta_positions, delta_scores = delta.get_topic_postings().search(topic_ids, threshold, limit, operator)
+
+        document_ids = np.concatenate([main.document_ids[positions[kept]], delta.document_ids[delta_positions]])
+        scores = np.concatenate([scores[kept], delta_scores])
+        ranking = top_k(scores, limit)
+
+        return document_ids[ranking], scores[ranking]
+
+    def compact(self):
+        """
+        Merge the delta segment into the main segment and save it.
+
+        :rtype: DocumentTopicIndex
+        :return: the new main segment, with all the documents of the index
+        """
+        # concurrent compactions would save the index file together and the last one could swap in a stale main
+        with self._compaction_lock:
+            return self._compact()
+
+    def _compact(self):
+        with self._lock:
+            main, delta, generation = self.main, self.delta, self.wal_generation
+            assignments = dict(self._delta_assignments)
+
+        if delta is None:
+            return main
+
+        merged = main.merge(delta)
+        # the expensive structures already in use are rebuilt before the swap, not by the next request
+        if main.sqrt_distributions is not None:
+            merged.get_sqrt_distributions()
+        if main.lsh_index is not None:
+            merged.get_lsh_index()
+        if main.topic_postings is not None:
+            merged.get_topic_postings()
+
+        merged_offset = merged.wal_offset
+        header = new_log_header()
+        merged.wal_generation, merged.wal_offset = read_header_generation(header), len(header)
+        # saved aside before taking the lock of the writers, they are only blocked while the log tail is copied
+        temp_index_path = '{0}.{1}.compacted'.format(self.file_path, os.getpid())
+        temp_log_path = '{0}.{1}.tmp'.format(self.wal_file_path, os.getpid())
+        merged.save(temp_index_path)
+
+        try:
+            with _locked_log(self.wal_file_path, 'a+b') as log:
+                log_generation, _ = read_log_header(log)
+                if log_generation != generation:
+                    # another process has compacted and rotated the log, its index file is loaded by the next refresh
+                    logging.info('Similarity index compaction dropped, the log has been rotated by another process.')
+                    return main
+
+                log.seek(merged_offset)
+                tail = log.read()
+                with open(temp_log_path, 'wb') as f:
+                    f.write(header + tail)
+
+                with self._lock:
+                    # the index is replaced first: after a failure in between the old log is read again from its start
+                    os.replace(temp_index_path, self.file_path)
+                    os.replace(temp_log_path, self.wal_file_path)
+                    self.main = merged
+                    self.wal_generation = merged.wal_generation
+                    # the assignments read while merging are in the tail of the old log, now after the new header
+                    self.wal_offset = merged.wal_offset + self.wal_offset - merged_offset
+                    self._wal_stat = None
+                    # the assignments read while merging stay in the delta segment
+                    for document_id, assignment in assignments.items():
+                        if self._delta_assignments.get(document_id) is assignment:
+                            del self._delta_assignments[document_id]
+                    self._update_delta()
+                    self.last_compaction = time()
+        finally:
+            for temp_file_path in (temp_index_path, temp_log_path):
+                if os.path.exists(temp_file_path):
+                    os.remove(temp_file_path)
+
+        logging.info('Similarity index compacted: {0} documents, {1} log bytes kept.'.format(len(merged), len(tail)))
+
+        return merged
+
+    def _reload(self, generation, header_size):
+        """
+        Load the main segment saved by the compaction that rotated the log to generation and drop the delta segment,
+        the log is read again from the offset of the main segment.
+        """
+        main = DocumentTopicIndex.load(self.file_path)
+        if main.wal_generation != generation:
+            # the index file does not cover this log (e.g. the log was not replaced after the index was saved): read
+            # the whole log, its assignments replace the rows of the same documents
+            main.wal_generation, main.wal_offset = generation, header_size
+
+        self.main = main
+        self.wal_generation = generation
+        self.wal_offset = main.wal_offset
+        self._delta_assignments = {}
+        self._update_delta()
+        logging.info('Similarity index reloaded after the rotation of its log: {0} documents.'.format(len(main)))
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except Exception:
+            logging.exception('Error during the compaction of a similarity index.')
+        finally:
+            with self._lock:
+                self._compacting = False
+                self.last_compaction = time()
+
+    def _update_delta(self):
+        if len(self._delta_assignments) == 0:
+            self.delta = None
+            self.superseded = None
+            return
+
+        self.delta = DocumentTopicIndex.from_assignments(self._delta_assignments.values(),
+                                                         self.main.distributions.shape[1], self.wal_offset,
+                                                         config.similarity_prune_threshold, self.main.index_format)
+        self.superseded = np.zeros(len(self.main), dtype=bool)
+        positions = self.main.get_positions(self.delta.document_ids)
+        self.superseded[positions[positions >= 0]] = True
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+# (model_id, files_prefix) -> lock held while the index is loaded or built, the other models are not blocked
+_index_locks = {}
+# (model_id, files_prefix) of the indexes whose files have been deleted with their model
+_deleted_indexes = set()
+
+
+def get_index_file_path(files_prefix):
+    return os.path.join(config.data_path, files_prefix + DocumentTopicIndex.file_suffix)
+
+
+def get_log_file_path(files_prefix):
+    return os.path.join(config.data_path, files_prefix + DocumentTopicIndex.log_file_suffix)
+
+
+def new_log_header():
+    """
+    Return the first line of a new write-ahead log, with a new generation: a log replaced by a rotation is recognized
+    by its generation, the offsets of the old log do not apply to the new one
+    """
+    return '#{0}\n'.format(uuid.uuid4().hex).encode('ascii')
+
+
+def read_header_generation(header):
+    return header[1:-1].decode('ascii')
+
+
+def read_log_header(f):
+    """
+    Return the generation of a write-ahead log and the size of its header, ('', 0) for a log without header (a log
+    written before the rotation of the logs, or an empty one)
+    """
+    f.seek(0)
+    line = f.readline()
+    if line.startswith(b'#') and line.endswith(b'\n'):
+        return read_header_generation(line), len(line)
+
+    return '', 0
+
+
+@contextmanager
+def _locked_log(file_path, mode):
+    """
+    Open a write-ahead log with an exclusive lock. A log replaced by a rotation while waiting for the lock is opened
+    again, so that nothing is written to the old file.
+    """
+    while True:
+        f = open(file_path, mode)
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            current = os.fstat(f.fileno()).st_ino == os.stat(file_path).st_ino
+        except OSError:
+            current = False
+        if current:
+            break
+        f.close()
+
+    try:
+        yield f
+    finally:
+        # closing the file releases the lock
+        f.close()
+
+
+def append_assignments(files_prefix, assignments):
+    """
+    Append new assignments to the write-ahead log of a model, they are searchable at the next refresh of its index.
+
+    :param files_prefix: the files prefix of the model
+    :param assignments: list of dictionaries with keys 'document_id' and 'assigned_topics' (db format)
+    """
+    lines = ''.join(json.dumps({'document_id': str(a['document_id']),
+                                'assigned_topics': [{'topic_id': int(t['topic_id']),
+                                                     'topic_weight': float(t['topic_weight'])}
+                                                    for t in a['assigned_topics']]}) + '\n' for a in assignments)
+
+    data = lines.encode('utf-8')
+    # a single locked write per batch, the records of concurrent writers are not interleaved
+    with _locked_log(get_log_file_path(files_prefix), 'ab') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            data = new_log_header() + data
+        f.write(data)
+        f.flush()
+
+
+def build_index(model_info):
+    """
+    Build the index of a model from the topics collection and save it next to the model files.
+
+    :param model_info: the model information as stored in db
+    :rtype: DocumentTopicIndex
+    :return:
+    """
+    # the assignments logged while reading the collection are read again from the log, the last one wins anyway
+    with _locked_log(get_log_file_path(model_info['files_prefix']), 'a+b') as log:
+        if os.fstat(log.fileno()).st_size == 0:
+            log.write(new_log_header())
+            log.flush()
+        wal_generation, _ = read_log_header(log)
+        wal_offset = os.fstat(log.fileno()).st_size
+
+    index = DocumentTopicIndex.from_assignments(db_utils.iter_assigned_topics(model_info['model_id']),
+                                                model_info['number_of_topics'], wal_offset,
+                                                config.similarity_prune_threshold, config.similarity_index_format,
+                                                wal_generation)
+    index.save(get_index_file_path(model_info['files_prefix']))
+    logging.info('Similarity index of model {0} built: {1} documents.'.format(model_info['model_id'], len(index)))
+
+    return index
+
+
+def get_index(model_info):
+    """
+    Return the index of a model, up to date with its write-ahead log: from the process cache, else from file, else
+    built from the db.
+
+    :param model_info: the model information as stored in db
+    :rtype: SegmentedIndex
+    :return:
+    :raise KeyError: if the index files of the model have been deleted by invalidate_index (the model was deleted)
+    """
+    key = (model_info['model_id'], model_info['files_prefix'])
+
+    index = None
+    while index is None:
+        with _indexes_lock:
+            if key in _deleted_indexes:
+                raise KeyError('The similarity index of model {0} has been deleted.'.format(key[0]))
+            index = _indexes.get(key)
+            if index is None:
+                index_lock = _index_locks.setdefault(key, threading.Lock())
+
+        if index is not None:
+            break
+
+        with index_lock:
+            with _indexes_lock:
+                index = _indexes.get(key)
+                # invalidate_index drops the lock of the model: it ran while this thread was waiting for it
+                invalidated = _index_locks.get(key) is not index_lock or key in _deleted_indexes
+
+            if index is None and not invalidated:
+                file_path = get_index_file_path(model_info['files_prefix'])
+                main = DocumentTopicIndex.load(file_path) if os.path.exists(file_path) else None
+                if main is None or (main.pruned is None and config.similarity_prune_threshold > 0):
+                    # an index file without the pruned weights would miss documents in the topic posting lists
+                    main = build_index(model_info)
+                index = SegmentedIndex(main, file_path, get_log_file_path(model_info['files_prefix']))
+
+                with _indexes_lock:
+                    # a new files prefix for the same model means that the model has been retrained
+                    for k in [k for k in _indexes.keys() if k[0] == key[0]]:
+                        del _indexes[k]
+                    for k in [k for k in _index_locks.keys() if k[0] == key[0] and k != key]:
+                        del _index_locks[k]
+                    _indexes[key] = index
+
+    index.refresh()
+
+    return index
+
+
+def invalidate_index(model_id, files_prefix=None):
+    """
+    Drop the cached index of a model and, if files_prefix is given, its files (index and write-ahead log). The index
+    of a deleted model (files_prefix given) is not loaded nor built again by this process.
+    """
+    with _indexes_lock:
+        index_locks = [lock for k, lock in _index_locks.items() if k[0] == model_id]
+
+    # an index being loaded or built is published first, then dropped: no file is saved after they are deleted
+    for index_lock in index_locks:
+        with index_lock:
+            pass
+
+    with _indexes_lock:
+        for k in [k for k in _indexes.keys() if k[0] == model_id]:
+            del _indexes[k]
+        for k in [k for k in _index_locks.keys() if k[0] == model_id]:
+            del _index_locks[k]
+
+        if files_prefix is not None:
+            _deleted_indexes.add((model_id, files_prefix))
+            for file_path in (get_index_file_path(files_prefix), get_log_file_path(files_prefix)):
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+
+
+def get_stats():
+    with _indexes_lock:
+        return {
+            'entries': len(_indexes),
+            'models': [{'model_id': k[0], 'files_prefix': k[1], 'documents': len(v), 'bytes': v.nbytes,
+                        'delta_documents': len(v.delta) if v.delta is not None else 0, 'wal_offset': v.wal_offset}
+                       for k, v in _indexes.items()]
+        }
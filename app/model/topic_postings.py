@@ -0,0 +1,127 @@
+"""
+Inverted topic -> documents index over the rows of a doc-topic matrix index.
+
+Each topic has a posting list with the positions of the documents that have the topic, sorted by descending topic
+weight, so the documents of a topic over a threshold are a prefix of its list, found by binary search, and its top n
+documents are the first n entries. The lists of all the topics are stored back to back in two flat arrays (positions
+and weights) with the offsets of each topic, as the columns of a csc matrix.
+
+Multi-topic queries combine the packed bitsets (one bit per document, numpy.packbits) of the posting lists of the
+topics with a bitwise and / or, then rank the selected documents by the sum of the weights of the topics.
+
+The weights are those of the db assignments: the rows of the doc-topic index are scaled back by their totals, and the
+weights under config.similarity_prune_threshold, dropped from the rows, are added from the pruned weights of the index.
+So any threshold selects the same documents as the db assignments.
+
+"""
+import numpy as np
+from scipy import sparse
+
+operators = ('and', 'or')
+
+
+class TopicPostings:
+
+    def __init__(self, n_documents, indptr, positions, weights):
+        """
+
+        :param n_documents: the number of rows of the index
+        :param indptr: numpy array of n_topics + 1 offsets, the list of topic t is positions[indptr[t]:indptr[t + 1]]
+        :param positions: numpy array, the positions of the documents in the index
+        :param weights: numpy array of float32, the topic weights aligned with positions, descending in each list
+        """
+        self.n_documents = n_documents
+        self.indptr = indptr
+        self.positions = positions
+        self.weights = weights
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.positions.nbytes + self.weights.nbytes
+
+    @classmethod
+    def from_index(cls, index):
+        """
+        Build the posting lists of the documents of a doc-topic matrix index.
+
+        :type index: model.similarity_index.DocumentTopicIndex
+        :param index:
+        :rtype: TopicPostings
+        :return:
+        """
+        columns = sparse.csc_matrix(sparse.csr_matrix(index.distributions).multiply(index.totals[:, np.newaxis]) +
+                                    index.get_pruned(), dtype=np.float32)
+        topics = np.repeat(np.arange(columns.shape[1]), np.diff(columns.indptr))
+
+        order = np.lexsort((-columns.data, topics))
+
+        return cls(len(index), columns.indptr, columns.indices[order], columns.data[order])
+
+    def documents(self, topic_id, threshold=0.0, limit=None):
+        """
+        Return the documents of a topic with a weight >= threshold.
+
+        :param topic_id: int
+        :param threshold: float, the min weight of the topic
+        :param limit: the max number of documents to return, all if None
+        :return: a tuple (positions, weights), sorted by descending weight
+        """
+        if not 0 <= topic_id < len(self.indptr) - 1:
+            return np.empty(0, dtype=self.positions.dtype), np.empty(0, dtype=self.weights.dtype)
+
+        start, end = self.indptr[topic_id], self.indptr[topic_id + 1]
+        # the weights are descending: the documents over the threshold are a prefix of the list
+        count = np.searchsorted(-self.weights[start:end], -threshold, side='right')
+        if limit is not None:
+            count = min(count, limit)
+
+        return self.positions[start:start + count], self.weights[start:start + count]
+
+    def bitset(self, topic_id, threshold=0.0):
+        """
+        Return the packed bitset of the documents of a topic with a weight >= threshold, bit i is document i.
+        """
+        members = np.zeros(self.n_documents, dtype=bool)
+        members[self.documents(topic_id, threshold)[0]] = True
+
+        return np.packbits(members)
+
+    def search(self, topic_ids, threshold=0.0, limit=None, operator='and'):
+        """
+        Return the documents that have all ('and') or any ('or') of some topics with a weight >= threshold.
+
+        :param topic_ids: list of int
+        :param threshold: float, the min weight of each topic
+        :param limit: the max number of documents to return, all if None
+        :param operator: 'and' or 'or'
+        :return: a tuple (positions, scores), sorted by descending score, the score of a document is the sum of the
+        weights of the topics (over the threshold)
+        """
+        topic_ids = list(dict.fromkeys(topic_ids))
+        if len(topic_ids) == 1:
+            return self.documents(topic_ids[0], threshold, limit)
+
+        if operator == 'and':
+            combine = np.bitwise_and
+        elif operator == 'or':
+            combine = np.bitwise_or
+        else:
+            raise ValueError('Unknown operator {0}, allowed values: {1}.'.format(operator, operators))
+
+        selected = combine.reduce([self.bitset(t, threshold) for t in topic_ids])
+        positions = np.flatnonzero(np.unpackbits(selected, count=self.n_documents))
+
+        scores = np.zeros(len(positions), dtype=self.weights.dtype)
+        if len(positions) > 0:
+            for t in topic_ids:
+                topic_positions, topic_weights = self.documents(t, threshold)
+                matches = np.searchsorted(positions, topic_positions)
+                matches[matches == len(positions)] = 0
+                found = positions[matches] == topic_positions
+                scores[matches[found]] += topic_weights[found]
+
+        ranking = np.argsort(-scores, kind='stable')
+        if limit is not None:
+            ranking = ranking[:limit]
+
+        return positions[ranking], scores[ranking]
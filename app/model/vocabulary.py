@@ -0,0 +1,71 @@
+"""
+Word -> id index of the vocabulary of a model.
+
+The words are kept sorted in a numpy array together with their model ids, so that a lookup (single word or bulk) is a
+binary search and the index can be saved and loaded as plain arrays, without building a dictionary.
+
+"""
+import numpy as np
+
+
+class VocabularyIndex:
+
+    file_suffix = '.vocabulary.npz'
+
+    def __init__(self, words, ids):
+        """
+
+        :param words: numpy array of strings, sorted
+        :param ids: numpy array of ints, ids[i] is the model id of words[i]
+        """
+        self.words = words
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.words)
+
+    def lookup(self, words):
+        """
+        Return the model ids of the specified words.
+
+        :param words: list or numpy array of strings
+        :rtype: numpy.ndarray
+        :return: array of ids, -1 for the words that are not in the vocabulary
+        """
+        words = np.asarray(words)
+        if len(self.words) == 0 or len(words) == 0:
+            return np.full(len(words), -1, dtype=np.int64)
+
+        positions = np.searchsorted(self.words, words)
+        positions[positions == len(self.words)] = 0
+        found = self.words[positions] == words
+
+        return np.where(found, self.ids[positions], -1)
+
+    def get(self, word, default=None):
+        word_id = self.lookup([word])[0]
+        return default if word_id < 0 else int(word_id)
+
+    def save(self, file_path):
+        with open(file_path, 'wb') as f:
+            np.savez(f, words=self.words, ids=self.ids)
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path) as data:
+            return cls(data['words'], data['ids'])
+
+    @classmethod
+    def from_id2word(cls, id2word):
+        """
+        Build the index from the id -> word mapping of a gensim model.
+
+        :param id2word: dict or gensim Dictionary
+        :rtype: VocabularyIndex
+        :return:
+        """
+        ids = np.fromiter(id2word.keys(), dtype=np.int64, count=len(id2word))
+        words = np.array([id2word[i] for i in ids], dtype=str)
+        order = np.argsort(words, kind='mergesort')
+
+        return cls(words[order], ids[order])
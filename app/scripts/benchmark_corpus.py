@@ -0,0 +1,105 @@
+"""
+Benchmark of the conversion of an analysis tf matrix to a gensim corpus: per-element walk of the matrix rows
+(previous implementation of LdaModelHelper.compute_corpus) vs. csr column remapping (lda_utils.tf_matrix_to_corpus).
+
+Usage (from the app folder): python scripts/benchmark_corpus.py -d <documents> -f <features> -w <words per document>
+"""
+import getopt
+import os
+import sys
+
+sys.path.append(os.path.abspath('.'))
+
+from time import time
+
+import numpy as np
+from scipy import sparse
+
+from model import lda_utils
+
+
+def legacy_tf_matrix_to_corpus(tf_matrix, features_names, word2id):
+    corpus = [None] * tf_matrix.shape[0]
+
+    for i in range(tf_matrix.shape[0]):
+        doc = tf_matrix.getrow(i)
+        _, cols = doc.nonzero()
+
+        corpus[i] = [None] * len(cols)
+        count = 0
+        for col in cols:
+            if features_names[col] in word2id.keys():
+                corpus[i][count] = (int(word2id[features_names[col]]), int(tf_matrix[i, col]))
+                count += 1
+
+        corpus[i] = corpus[i][:count]
+
+    return corpus
+
+
+def generate_data(n_documents, n_features, words_per_document, known_ratio=0.7, seed=0):
+    """
+    Generate a random tf matrix and a model vocabulary that contains known_ratio of the matrix features
+    """
+    random_state = np.random.RandomState(seed)
+
+    rows = np.repeat(np.arange(n_documents), words_per_document)
+    cols = random_state.randint(0, n_features, size=n_documents * words_per_document)
+    data = random_state.randint(1, 5, size=n_documents * words_per_document)
+    tf_matrix = sparse.csr_matrix((data, (rows, cols)), shape=(n_documents, n_features))
+
+    features_names = ['w{0}'.format(i) for i in range(n_features)]
+    known_features = random_state.permutation(n_features)[:int(n_features * known_ratio)]
+    word2id = {features_names[f]: i for i, f in enumerate(known_features)}
+
+    return tf_matrix, features_names, word2id
+
+
+def run_benchmark(n_documents, n_features, words_per_document):
+    tf_matrix, features_names, word2id = generate_data(n_documents, n_features, words_per_document)
+    print('tf matrix: {0} documents, {1} features, {2} non zero values'.format(n_documents, n_features,
+                                                                                tf_matrix.nnz))
+
+    start = time()
+    legacy_corpus = legacy_tf_matrix_to_corpus(tf_matrix, features_names, word2id)
+    legacy_time = time() - start
+    print('per-element walk:\t{0:.3f}s'.format(legacy_time))
+
+    start = time()
+    features_ids = np.array([word2id.get(f, -1) for f in features_names])
+    corpus = lda_utils.tf_matrix_to_corpus(tf_matrix, features_ids)
+    remapping_time = time() - start
+    print('csr remapping:\t\t{0:.3f}s ({1:.1f}x)'.format(remapping_time, legacy_time / remapping_time))
+
+    if [sorted(d) for d in corpus] != [sorted(d) for d in legacy_corpus]:
+        print('[ERROR] The two corpora differ.')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+
+    argv = sys.argv[1:]
+
+    n_documents = 50000
+    n_features = 20000
+    words_per_document = 100
+
+    help_string = 'benchmark_corpus.py -d <number of documents> -f <number of features> -w <words per document>'
+
+    try:
+        opts, args = getopt.getopt(argv, "hd:f:w:", [])
+    except getopt.GetoptError:
+        print(help_string)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_string)
+            sys.exit()
+        elif opt == '-d':
+            n_documents = int(arg)
+        elif opt == '-f':
+            n_features = int(arg)
+        elif opt == '-w':
+            words_per_document = int(arg)
+
+    run_benchmark(n_documents, n_features, words_per_document)
@@ -0,0 +1,101 @@
+"""
+Benchmark of the topics inference for new documents: gensim per-document E-step (LdaModel.inference) vs. batched
+E-step on the whole document-term matrix (model.inference.infer_topics).
+
+The model is randomly initialized (no training is needed to measure the inference cost). Both paths start from the
+same initial gamma, so their results should match within the convergence tolerance.
+
+Usage (from the app folder): python scripts/benchmark_inference.py -t <topics> -v <vocabulary size>
+-w <words per document> -m <max batch size for the gensim path>
+"""
+import getopt
+import os
+import sys
+
+sys.path.append(os.path.abspath('.'))
+
+from time import time
+
+import numpy as np
+from gensim import matutils
+from gensim.models import LdaModel
+from scipy import sparse
+
+import config
+from model import inference
+
+batch_sizes = [1, 10, 100, 1000, 10000, 100000]
+
+
+def generate_documents(n_documents, vocabulary_size, words_per_document, seed=0):
+    random_state = np.random.RandomState(seed)
+
+    rows = np.repeat(np.arange(n_documents), words_per_document)
+    cols = random_state.randint(0, vocabulary_size, size=n_documents * words_per_document)
+    data = np.ones(n_documents * words_per_document)
+
+    return sparse.csr_matrix((data, (rows, cols)), shape=(n_documents, vocabulary_size))
+
+
+def run_benchmark(n_topics, vocabulary_size, words_per_document, max_gensim_batch_size):
+    lda = LdaModel(num_topics=n_topics, id2word={i: 'w{0}'.format(i) for i in range(vocabulary_size)},
+                   random_state=0)
+
+    print('{0} topics, {1} words, {2} words per document'.format(n_topics, vocabulary_size, words_per_document))
+    print('batch size\tgensim (docs/s)\tnumpy (docs/s)\tmax abs difference')
+
+    for batch_size in batch_sizes:
+        tf_matrix = generate_documents(batch_size, vocabulary_size, words_per_document)
+
+        start = time()
+        numpy_gamma = inference.infer_topics(tf_matrix, lda.expElogbeta, lda.alpha, lda.iterations,
+                                             lda.gamma_threshold, np.random.RandomState(batch_size),
+                                             max_chunk_elements=config.inference_max_chunk_elements)
+        numpy_throughput = batch_size / (time() - start)
+
+        if batch_size <= max_gensim_batch_size:
+            lda.random_state = np.random.RandomState(batch_size)
+            start = time()
+            gensim_gamma, _ = lda.inference(list(matutils.Sparse2Corpus(tf_matrix, documents_columns=False)))
+            gensim_throughput = batch_size / (time() - start)
+
+            difference = np.max(np.abs(gensim_gamma / gensim_gamma.sum(axis=1)[:, np.newaxis] -
+                                       numpy_gamma / numpy_gamma.sum(axis=1)[:, np.newaxis]))
+
+            print('{0}\t\t{1:.1f}\t\t{2:.1f}\t\t{3:.2e}'.format(batch_size, gensim_throughput, numpy_throughput,
+                                                             difference))
+        else:
+            print('{0}\t\t-\t\t{1:.1f}\t\t-'.format(batch_size, numpy_throughput))
+
+
+if __name__ == '__main__':
+
+    argv = sys.argv[1:]
+
+    n_topics = 200
+    vocabulary_size = 50000
+    words_per_document = 100
+    max_gensim_batch_size = 10000
+
+    help_string = 'benchmark_inference.py -t <number of topics> -v <vocabulary size> -w <words per document> ' \
+                  '-m <max batch size for the gensim path>'
+
+    try:
+        opts, args = getopt.getopt(argv, "ht:v:w:m:", [])
+    except getopt.GetoptError:
+        print(help_string)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_string)
+            sys.exit()
+        elif opt == '-t':
+            n_topics = int(arg)
+        elif opt == '-v':
+            vocabulary_size = int(arg)
+        elif opt == '-w':
+            words_per_document = int(arg)
+        elif opt == '-m':
+            max_gensim_batch_size = int(arg)
+
+    run_benchmark(n_topics, vocabulary_size, words_per_document, max_gensim_batch_size)
@@ -0,0 +1,107 @@
+"""
+Benchmark of the approximate similarity search: exact cosine over all documents vs. LSH candidates
+(model.similarity_index.DocumentTopicIndex.search with method 'exact' and 'lsh').
+
+Topic vectors are drawn from a sparse Dirichlet distribution, as LDA assignments. The script reports the LSH build time,
+the mean query latency of both methods, the mean number of scored candidates and the recall@k of the approximate
+search w.r.t. the exact one.
+
+Usage (from the app folder): python scripts/benchmark_lsh.py -d <documents> -t <topics> -k <neighbors> -q <queries>
+-l <tables> -b <bits per table> -p <probes per table>
+"""
+import getopt
+import os
+import sys
+
+sys.path.append(os.path.abspath('.'))
+
+from time import time
+
+import numpy as np
+
+import config
+from model.lsh_index import LshIndex
+from model.similarity_index import DocumentTopicIndex
+
+
+def generate_vectors(n_documents, n_topics, seed=0):
+    random_state = np.random.RandomState(seed)
+    vectors = random_state.dirichlet([0.05] * n_topics, size=n_documents).astype(np.float32)
+    vectors[vectors < 0.01] = 0
+
+    return vectors / vectors.sum(axis=1)[:, np.newaxis]
+
+
+def run_benchmark(n_documents, n_topics, k, n_queries, n_tables, n_bits, n_probes):
+    vectors = generate_vectors(n_documents, n_topics)
+    index = DocumentTopicIndex(np.array(['d{0}'.format(i) for i in range(n_documents)]), vectors)
+    queries = vectors[np.random.RandomState(1).randint(0, n_documents, size=n_queries)]
+
+    print('{0} documents, {1} topics, top {2}, {3} queries'.format(n_documents, n_topics, k, n_queries))
+    print('lsh: {0} tables, {1} bits, {2} probes'.format(n_tables, n_bits, n_probes))
+
+    start = time()
+    index.lsh_index = LshIndex(n_tables, n_bits, n_probes).fit(vectors)
+    print('lsh build:\t\t{0:.3f}s'.format(time() - start))
+
+    start = time()
+    exact_results = [index.search(q, k, 'exact')[0] for q in queries]
+    print('exact query:\t\t{0:.2f}ms'.format((time() - start) / n_queries * 1000))
+
+    start = time()
+    lsh_results = [index.search(q, k, 'lsh') for q in queries]
+    print('lsh query:\t\t{0:.2f}ms'.format((time() - start) / n_queries * 1000))
+
+    candidates = np.mean([len(index.lsh_index.query_candidates(q)) for q in queries])
+    fallbacks = sum(1 for _, _, method in lsh_results if method != 'cosine_lsh')
+    # the scores of the k-th neighbors are compared, not the ids, so that ties do not count as misses
+    recall = np.mean([np.mean(index.similarities(q, 'cosine', approximate) >= exact_scores[-1] - 1e-6)
+                      for q, (approximate, _, _), exact_scores in
+                      zip(queries, lsh_results, [index.similarities(q, 'cosine', e) for q, e in
+                                                 zip(queries, exact_results)])])
+
+    print('scored candidates:\t{0:.0f} ({1:.2%} of the documents)'.format(candidates, candidates / n_documents))
+    print('exact fallbacks:\t{0}'.format(fallbacks))
+    print('recall@{0}:\t\t{1:.3f}'.format(k, recall))
+
+
+if __name__ == '__main__':
+
+    argv = sys.argv[1:]
+
+    n_documents = 500000
+    n_topics = 200
+    k = 10
+    n_queries = 100
+    n_tables = config.lsh_tables
+    n_bits = config.lsh_bits
+    n_probes = config.lsh_probes
+
+    help_string = 'benchmark_lsh.py -d <number of documents> -t <number of topics> -k <number of neighbors> ' \
+                  '-q <number of queries> -l <tables> -b <bits per table> -p <probes per table>'
+
+    try:
+        opts, args = getopt.getopt(argv, "hd:t:k:q:l:b:p:", [])
+    except getopt.GetoptError:
+        print(help_string)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_string)
+            sys.exit()
+        elif opt == '-d':
+            n_documents = int(arg)
+        elif opt == '-t':
+            n_topics = int(arg)
+        elif opt == '-k':
+            k = int(arg)
+        elif opt == '-q':
+            n_queries = int(arg)
+        elif opt == '-l':
+            n_tables = int(arg)
+        elif opt == '-b':
+            n_bits = int(arg)
+        elif opt == '-p':
+            n_probes = int(arg)
+
+    run_benchmark(n_documents, n_topics, k, n_queries, n_tables, n_bits, n_probes)
@@ -0,0 +1,99 @@
+"""
+Benchmark of the similarity metrics of the neighbors search: vectorized kernels over the whole doc-topic matrix
+(model.similarity_index.DocumentTopicIndex.similarities) vs. the pair by pair scipy computation.
+
+Topic vectors are drawn from a sparse Dirichlet distribution, as LDA assignments. The scipy baseline is timed on a
+sample of documents and extrapolated to the whole matrix.
+
+Usage (from the app folder): python scripts/benchmark_similarity.py -d <documents> -t <topics> -q <queries>
+-s <documents of the scipy sample>
+"""
+import getopt
+import os
+import sys
+
+sys.path.append(os.path.abspath('.'))
+
+from time import time
+
+import numpy as np
+from scipy.spatial import distance
+
+from model import similarity
+from model.similarity_index import DocumentTopicIndex
+
+scipy_similarities = {
+    'cosine': lambda p, q: 1 - distance.cosine(p, q),
+    'hellinger': lambda p, q: 1 - distance.euclidean(np.sqrt(p), np.sqrt(q)) / np.sqrt(2),
+    'jensen_shannon': lambda p, q: 1 - distance.jensenshannon(p, q, base=2) ** 2
+}
+
+
+def generate_distributions(n_documents, n_topics, seed=0):
+    random_state = np.random.RandomState(seed)
+    distributions = random_state.dirichlet([0.05] * n_topics, size=n_documents).astype(np.float32)
+    distributions[distributions < 0.01] = 0
+
+    return distributions / distributions.sum(axis=1)[:, np.newaxis]
+
+
+def run_benchmark(n_documents, n_topics, n_queries, n_sample):
+    distributions = generate_distributions(n_documents, n_topics)
+
+    start = time()
+    index = DocumentTopicIndex(np.array(['d{0}'.format(i) for i in range(n_documents)]), distributions)
+    index.get_sqrt_distributions()
+    print('{0} documents, {1} topics, {2} queries'.format(n_documents, n_topics, n_queries))
+    print('index setup (norms, entropies, square roots): {0:.3f}s, {1:.1f}MB'.format(time() - start,
+                                                                                      index.nbytes / 1024 ** 2))
+
+    queries = distributions[np.random.RandomState(1).randint(0, n_documents, size=n_queries)]
+    sample = distributions[:n_sample].astype(np.float64)
+
+    print('metric\t\t\tvectorized (ms/query)\tscipy, extrapolated (ms/query)\tmax abs difference')
+    for metric in similarity.metrics:
+        start = time()
+        scores = [index.similarities(q, metric) for q in queries]
+        vectorized_latency = (time() - start) / n_queries * 1000
+
+        start = time()
+        reference = np.array([scipy_similarities[metric](d, queries[0].astype(np.float64)) for d in sample])
+        scipy_latency = (time() - start) * 1000 * n_documents / n_sample
+
+        difference = np.max(np.abs(scores[0][:n_sample] - reference))
+
+        print('{0:<16}\t{1:.1f}\t\t\t{2:.0f}\t\t\t\t{3:.2e}'.format(metric, vectorized_latency, scipy_latency,
+                                                                     difference))
+
+
+if __name__ == '__main__':
+
+    argv = sys.argv[1:]
+
+    n_documents = 1000000
+    n_topics = 200
+    n_queries = 20
+    n_sample = 10000
+
+    help_string = 'benchmark_similarity.py -d <number of documents> -t <number of topics> -q <number of queries> ' \
+                  '-s <documents of the scipy sample>'
+
+    try:
+        opts, args = getopt.getopt(argv, "hd:t:q:s:", [])
+    except getopt.GetoptError:
+        print(help_string)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_string)
+            sys.exit()
+        elif opt == '-d':
+            n_documents = int(arg)
+        elif opt == '-t':
+            n_topics = int(arg)
+        elif opt == '-q':
+            n_queries = int(arg)
+        elif opt == '-s':
+            n_sample = int(arg)
+
+    run_benchmark(n_documents, n_topics, n_queries, min(n_sample, n_documents))
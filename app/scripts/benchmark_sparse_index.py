@@ -0,0 +1,121 @@
+"""
+Benchmark of the doc-topic matrix formats of the similarity index: csr matrix vs. dense numpy array
+(model.similarity_index.DocumentTopicIndex built with index_format 'sparse' and 'dense'), and the python lists of
+model.lda_utils.transform_topics_assignment_from_db_to_vector as a memory reference.
+
+Assignments are drawn from a sparse Dirichlet distribution and stored as the db does, with the topics over the minimum
+probability of gensim (0.01). The script reports the build time, the memory of each index (the python lists are
+measured on a sample and extrapolated) and the mean query latency of every metric for both formats.
+
+Usage (from the app folder): python scripts/benchmark_sparse_index.py -d <documents> -t <topics> -q <queries>
+-p <prune threshold>
+"""
+import getopt
+import os
+import sys
+
+sys.path.append(os.path.abspath('.'))
+
+from time import time
+
+import numpy as np
+
+import config
+from model import lda_utils
+from model import similarity
+from model.similarity_index import DocumentTopicIndex
+
+minimum_probability = 0.01
+list_sample_size = 10000
+
+
+def generate_assignments(n_documents, n_topics, seed=0):
+    random_state = np.random.RandomState(seed)
+    assignments = []
+    for start in range(0, n_documents, 100000):
+        distributions = random_state.dirichlet([0.05] * n_topics, size=min(100000, n_documents - start))
+        for i, d in enumerate(distributions):
+            topics = np.flatnonzero(d >= minimum_probability)
+            assignments.append({'document_id': 'd{0}'.format(start + i),
+                                'assigned_topics': [{'topic_id': int(t), 'topic_weight': float(d[t])}
+                                                    for t in topics]})
+
+    return assignments
+
+
+def lists_nbytes(assignments, n_topics):
+    sample = assignments[:list_sample_size]
+    vectors = [lda_utils.transform_topics_assignment_from_db_to_vector(n_topics, a['assigned_topics'])
+               for a in sample]
+    # the zeros share the same float object, the weights do not
+    nbytes = sum(sys.getsizeof(v) + sum(sys.getsizeof(x) for x in v if x != 0.0) for v in vectors)
+
+    return nbytes * len(assignments) / len(sample)
+
+
+def run_benchmark(n_documents, n_topics, n_queries, prune_threshold):
+    assignments = generate_assignments(n_documents, n_topics)
+    stored_weights = sum(len(a['assigned_topics']) for a in assignments)
+
+    print('{0} documents, {1} topics, {2:.1f} stored topics per document, prune threshold {3}, {4} queries'.format(
+        n_documents, n_topics, stored_weights / n_documents, prune_threshold, n_queries))
+    print('python lists (extrapolated): {0:.1f}MB'.format(lists_nbytes(assignments, n_topics) / 1024 ** 2))
+
+    indexes = {}
+    for index_format in ('dense', 'sparse'):
+        start = time()
+        index = DocumentTopicIndex.from_assignments(assignments, n_topics, prune_threshold=prune_threshold,
+                                                    index_format=index_format)
+        index.get_sqrt_distributions()
+        print('{0} index: build {1:.3f}s, {2:.1f}MB'.format(index_format, time() - start, index.nbytes / 1024 ** 2))
+        indexes[index_format] = index
+
+    dense = indexes['dense'].distributions
+    queries = dense[np.random.RandomState(1).randint(0, n_documents, size=n_queries)]
+
+    print('metric\t\t\tdense (ms/query)\tsparse (ms/query)\tmax abs difference')
+    for metric in similarity.metrics:
+        latencies = {}
+        scores = {}
+        for index_format, index in indexes.items():
+            start = time()
+            scores[index_format] = [index.similarities(q, metric) for q in queries]
+            latencies[index_format] = (time() - start) / n_queries * 1000
+
+        difference = max(np.max(np.abs(d - s)) for d, s in zip(scores['dense'], scores['sparse']))
+
+        print('{0:<16}\t{1:.1f}\t\t\t{2:.1f}\t\t\t{3:.2e}'.format(metric, latencies['dense'], latencies['sparse'],
+                                                                   difference))
+
+
+if __name__ == '__main__':
+
+    argv = sys.argv[1:]
+
+    n_documents = 1000000
+    n_topics = 500
+    n_queries = 20
+    prune_threshold = config.similarity_prune_threshold
+
+    help_string = 'benchmark_sparse_index.py -d <number of documents> -t <number of topics> -q <number of queries> ' \
+                  '-p <prune threshold>'
+
+    try:
+        opts, args = getopt.getopt(argv, "hd:t:q:p:", [])
+    except getopt.GetoptError:
+        print(help_string)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_string)
+            sys.exit()
+        elif opt == '-d':
+            n_documents = int(arg)
+        elif opt == '-t':
+            n_topics = int(arg)
+        elif opt == '-q':
+            n_queries = int(arg)
+        elif opt == '-p':
+            prune_threshold = float(arg)
+
+    run_benchmark(n_documents, n_topics, n_queries, prune_threshold)
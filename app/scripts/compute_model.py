@@ -7,6 +7,7 @@ from multiprocessing import Process
 from time import time, sleep
 
 import config
+from db import db_schema
 from model import lda_utils
 from model.lda_model import LdaModelHelper
 import sys
@@ -32,6 +33,7 @@ class ComputeModelProcess(Process):
         # signal.signal(signal.SIGUSR1, terminate)
 
     def run(self):
+        db_schema.bootstrap()
         sleep(self.seconds_to_wait)
         lda_utils.update_model_status(self.model_identifier, LdaModelHelper.status_computing, {'process_id': self.pid})
         try:
@@ -113,7 +115,14 @@ def compute_and_save_model(model_id, n_topics, language, use_lemmer, min_df, max
         lda_m.set_analysis_parameters(lda_m.training_use_lemmer, lda_m.training_min_df, lda_m.training_max_df)
         topic_assignment = lda_m.compute_topic_assignment(documents_texts)
         # save on db
-        lda_utils.save_topic_assignment(documents, topic_assignment, model_id)
+        lda_utils.save_topic_assignment(documents, topic_assignment, model_id, update_index=False)
+        # build the similarity index of the assigned documents
+        lda_utils.build_similarity_index(model_id)
+
+        if config.precompute_neighbors:
+            logging.info('Neighbors computation started.')
+            lda_utils.compute_precomputed_neighbors(model_id)
+            logging.info('Neighbors computation completed.')
 
         logging.info('Topics assignment completed.')
 
@@ -133,6 +142,7 @@ if __name__ == '__main__':
     argv = sys.argv[1:]
 
     setup_logging()
+    db_schema.bootstrap()
 
     # read parameters from command line
     n_topics = 50
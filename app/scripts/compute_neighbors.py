@@ -0,0 +1,56 @@
+"""
+Maintenance job: compute (or recompute) the precomputed top-k neighbors lists of all the documents of a model.
+
+Usage (from the app folder): python scripts/compute_neighbors.py -v <model identifier> -k <neighbors per document>
+"""
+import getopt
+import logging
+import os
+import sys
+
+sys.path.append(os.path.abspath('.'))
+
+import config
+from model import lda_utils
+from scripts.compute_model import setup_logging
+
+
+if __name__ == '__main__':
+
+    argv = sys.argv[1:]
+
+    setup_logging()
+
+    model_id = None
+
+    help_string = 'compute_neighbors.py -v <model identifier> -k <neighbors per document, default {0}>'.format(
+        config.precomputed_neighbors_k)
+
+    try:
+        opts, args = getopt.getopt(argv, "hv:k:", [])
+    except getopt.GetoptError:
+        print(help_string)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_string)
+            sys.exit()
+        elif opt == '-v':
+            model_id = arg
+        elif opt == '-k':
+            config.precomputed_neighbors_k = int(arg)
+
+    if model_id is None:
+        print(help_string)
+        sys.exit(2)
+
+    logging.info('Neighbors computation of model {0} started.'.format(model_id))
+    n_documents = lda_utils.compute_precomputed_neighbors(model_id)
+
+    if n_documents is None:
+        logging.error('[ERROR] Model {0} not found.'.format(model_id))
+        print('Model {0} not found.'.format(model_id))
+        sys.exit(1)
+
+    logging.info('Neighbors computation of model {0} completed: {1} documents.'.format(model_id, n_documents))
+    print('Neighbors of {0} documents computed.'.format(n_documents))
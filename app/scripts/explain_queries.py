@@ -0,0 +1,147 @@
+"""
+Diagnostics: check the query plans of the hot queries of db_utils (db.db_schema.hot_queries) and flag the collection
+scans.
+
+Against a mongod (config.db_host, config.db_port) every query is run with explain() and the winning plan is searched
+for COLLSCAN stages. With -i the queries are checked against an in-process stand-in (mongomock, not needed by the
+application) with the indexes of db.db_schema: mongomock has no query planner, a query is reported as a collection
+scan when no index starts with one of its filter fields or with its sort field.
+
+The exit code is 1 when a collection scan is found.
+
+Usage (from the app folder): python scripts/explain_queries.py -v <model id> -d <document id> -t <topic id> [-i]
+"""
+import getopt
+import os
+import sys
+
+sys.path.append(os.path.abspath('.'))
+
+import config
+from db import db_schema, db_utils
+
+
+def iter_stages(plan):
+    yield plan
+    for key in ('inputStage', 'queryPlan'):
+        if key in plan:
+            yield from iter_stages(plan[key])
+    for stage in plan.get('inputStages', []):
+        yield from iter_stages(stage)
+
+
+def explain_query(collection, query_filter, sort):
+    """
+    Run explain() on a query.
+
+    :return: a pair (collection scan, description of the winning plan)
+    """
+    cursor = collection.find(query_filter)
+    if sort is not None:
+        cursor = cursor.sort(sort)
+
+    explanation = cursor.explain()
+    stages = list(iter_stages(explanation['queryPlanner']['winningPlan']))
+    indexes = [s['indexName'] for s in stages if 'indexName' in s]
+    collection_scan = any(s.get('stage') == 'COLLSCAN' for s in stages)
+
+    description = ' > '.join(s['stage'] for s in stages if 'stage' in s)
+    if len(indexes) > 0:
+        description += ' ({0})'.format(', '.join(indexes))
+    if 'executionStats' in explanation:
+        description += ', {0} documents examined'.format(explanation['executionStats']['totalDocsExamined'])
+
+    return collection_scan, description
+
+
+def filter_fields(query_filter):
+    fields = []
+    for key, value in query_filter.items():
+        if isinstance(value, dict) and '$elemMatch' in value:
+            fields += ['{0}.{1}'.format(key, k) for k in value['$elemMatch'].keys()]
+        else:
+            fields.append(key)
+
+    return fields
+
+
+def match_index(collection, query_filter, sort):
+    """
+    Find the index that a query would use: the index with the longest prefix of filter fields and sort fields. A query
+    without such an index is a collection scan.
+
+    :return: a pair (collection scan, description of the matched index)
+    """
+    fields = filter_fields(query_filter) + [f for f, _ in (sort or [])]
+
+    best_name, best_prefix = None, 0
+    for name, index in collection.index_information().items():
+        prefix = 0
+        while prefix < len(index['key']) and index['key'][prefix][0] in fields:
+            prefix += 1
+        if prefix > best_prefix:
+            best_name, best_prefix = name, prefix
+
+    if best_name is None:
+        return True, 'no index'
+
+    return False, 'index {0}, {1} matched fields'.format(best_name, best_prefix)
+
+
+def run_diagnostics(model_id, document_id, topic_id, in_process):
+    if in_process:
+        try:
+            import mongomock
+        except ImportError:
+            print('The in-process stand-in requires mongomock (pip install mongomock).')
+            sys.exit(2)
+
+        db_utils.set_mongo_client(mongomock.MongoClient())
+        db_schema.ensure_schema()
+        check_query = match_index
+    else:
+        check_query = explain_query
+
+    print('schema version: {0} (latest {1})'.format(db_schema.get_schema_version(), db_schema.schema_version))
+
+    collection_scans = 0
+    for name, collection_name, query_filter, sort in db_schema.hot_queries(model_id, document_id, topic_id):
+        collection_scan, description = check_query(db_utils.get_collection(collection_name), query_filter, sort)
+        collection_scans += collection_scan
+        print('{0:<8}{1:<30}{2}'.format('COLLSCAN' if collection_scan else 'ok', name, description))
+
+    return collection_scans
+
+
+if __name__ == '__main__':
+
+    argv = sys.argv[1:]
+
+    model_id = 'model'
+    document_id = 'document'
+    topic_id = 0
+    in_process = False
+
+    help_string = 'explain_queries.py -v <model id> -d <document id> -t <topic id> -i (in-process stand-in)'
+
+    try:
+        opts, args = getopt.getopt(argv, "hv:d:t:i", [])
+    except getopt.GetoptError:
+        print(help_string)
+        sys.exit(2)
+    for opt, arg in opts:
+        if opt == '-h':
+            print(help_string)
+            sys.exit()
+        elif opt == '-v':
+            model_id = arg
+        elif opt == '-d':
+            document_id = arg
+        elif opt == '-t':
+            topic_id = int(arg)
+        elif opt == '-i':
+            in_process = True
+
+    print('db: {0}'.format('in-process stand-in' if in_process else '{0}:{1}/{2}'.format(config.db_host, config.db_port,
+                                                                                        config.db_name)))
+    sys.exit(1 if run_diagnostics(model_id, document_id, topic_id, in_process) > 0 else 0)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the app are imported from the app directory, as when running api.py or the scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
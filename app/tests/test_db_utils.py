@@ -0,0 +1,111 @@
+from types import SimpleNamespace
+
+import pytest
+from pymongo import ReplaceOne, UpdateOne
+
+import config
+from db import db_schema
+from db import db_utils
+
+mongomock = pytest.importorskip('mongomock')
+
+
+def _bulk_write(collection, requests, ordered=True):
+    """
+    Apply the bulk requests one at a time: the bulk_write of mongomock does not accept the operations of recent
+    pymongo versions
+    """
+    result = SimpleNamespace(matched_count=0, modified_count=0, upserted_count=0)
+    for request in requests:
+        assert isinstance(request, (UpdateOne, ReplaceOne))
+        write = collection.update_one if isinstance(request, UpdateOne) else collection.replace_one
+        r = write(request._filter, request._doc, upsert=request._upsert)
+        result.matched_count += r.matched_count
+        result.modified_count += r.modified_count
+        result.upserted_count += r.upserted_id is not None
+
+    return result
+
+
+@pytest.fixture
+def mongo_client(monkeypatch):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(mongomock.collection.Collection, 'bulk_write', _bulk_write)
+    monkeypatch.setattr(db_utils, 'mongo_client', None)
+    db_utils.set_mongo_client(client)
+
+    return client
+
+
+def _documents(mongo_client):
+    return {d['document_id']: d['text'] for d in mongo_client[config.db_name][config.documents_collection_name].find()}
+
+
+def test_upsert_documents_counts(mongo_client):
+    counts = db_utils.upsert_documents([{'document_id': 'a', 'text': 'one'}, {'document_id': 1, 'text': 'two'}])
+    assert counts == {'inserted': 2, 'updated': 0, 'skipped': 0}
+
+    # the last text wins for a repeated id, chunks smaller than the batch
+    counts = db_utils.upsert_documents([{'document_id': 'a', 'text': 'one'}, {'document_id': '1', 'text': 'old'},
+                                        {'document_id': '1', 'text': 'new'}, {'document_id': 'b', 'text': 'three'}],
+                                       chunk_size=2)
+    assert counts == {'inserted': 1, 'updated': 1, 'skipped': 1}
+    assert _documents(mongo_client) == {'a': 'one', '1': 'new', 'b': 'three'}
+
+    assert db_utils.upsert_documents([]) == {'inserted': 0, 'updated': 0, 'skipped': 0}
+
+
+def test_upsert_assignments_counts(mongo_client):
+    assignments = [{'model_id': 'm', 'document_id': 'a', 'assigned_topics': [{'topic_id': 0, 'topic_weight': 1.0}]},
+                   {'model_id': 'm', 'document_id': 'b', 'assigned_topics': [{'topic_id': 1, 'topic_weight': 1.0}]}]
+    assert db_utils.upsert_assignments(assignments) == {'inserted': 2, 'updated': 0, 'skipped': 0}
+
+    assignments[1] = dict(assignments[1], assigned_topics=[{'topic_id': 2, 'topic_weight': 1.0}])
+    assert db_utils.upsert_assignments(assignments, chunk_size=1) == {'inserted': 0, 'updated': 1, 'skipped': 1}
+    assert db_utils.get_assigned_topics('m', 'b') == [{'topic_id': 2, 'topic_weight': 1.0}]
+
+
+def test_unique_documents_migration(mongo_client):
+    database = mongo_client[config.db_name]
+    documents_collection = database[config.documents_collection_name]
+    documents_collection.insert_many([{'document_id': 'a', 'text': 'first'}, {'document_id': 'b', 'text': 'b'},
+                                      {'document_id': 'a', 'text': 'last'}])
+    db_schema._create_query_indexes(database)
+
+    db_schema._unique_documents(database)
+
+    assert _documents(mongo_client) == {'a': 'last', 'b': 'b'}
+    assert documents_collection.index_information()['document_id'].get('unique')
+
+
+@pytest.mark.parametrize('migrated', [True, False])
+def test_get_topics(mongo_client, migrated):
+    distribution = {'b': 0.2, 'a': 0.5, 'c': 0.3}
+    topics = [{'topic_id': 0, 'topic_label': 'zero', 'words_distribution': distribution},
+              {'topic_id': 1, 'words_distribution': {'d': 1.0}}]
+    if migrated:
+        for topic in topics:
+            topic['words'], topic['weights'] = db_utils.ranked_words(topic.pop('words_distribution'))
+    mongo_client[config.db_name][config.models_collection_name].insert_one({'model_id': 'm', 'topics': topics})
+
+    topic = db_utils.get_topic('m', 0)
+    assert topic['topic_label'] == 'zero'
+    assert topic['words_distribution'] == [{'w': 'a', 'w_weight': 0.5}, {'w': 'c', 'w_weight': 0.3},
+                                           {'w': 'b', 'w_weight': 0.2}]
+    assert db_utils.get_topic('m', 0, 2)['words_distribution'] == topic['words_distribution'][:2]
+    assert db_utils.get_topic('m', 2) is None
+
+    all_topics = db_utils.get_all_topics('m', 1)
+    assert [t['words_distribution'] for t in all_topics] == [[{'w': 'a', 'w_weight': 0.5}],
+                                                             [{'w': 'd', 'w_weight': 1.0}]]
+
+
+def test_query_indexes_with_duplicate_model_ids(mongo_client, caplog):
+    database = mongo_client[config.db_name]
+    database[config.models_collection_name].insert_many([{'model_id': 'm'}, {'model_id': 'm'}, {'model_id': 'n'}])
+
+    assert db_schema.ensure_schema(mongo_client) == db_schema.schema_version
+
+    assert 'Duplicate model ids' in caplog.text
+    assert not database[config.models_collection_name].index_information()['model_id'].get('unique')
+    assert database[config.topics_collection_name].index_information()['model_id_document_id'].get('unique')
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from gensim.corpora import Dictionary
+from gensim.matutils import corpus2csc
+from gensim.models import LdaModel
+
+from model import inference
+
+
+@pytest.fixture(scope='module')
+def lda():
+    random_state = np.random.RandomState(0)
+    words = ['w{0}'.format(i) for i in range(60)]
+    texts = [list(random_state.choice(words, random_state.randint(5, 40))) for _ in range(80)]
+    dictionary = Dictionary(texts)
+    corpus = [dictionary.doc2bow(text) for text in texts]
+
+    return LdaModel(corpus, num_topics=6, id2word=dictionary, passes=2, random_state=0), corpus
+
+
+def _gensim_gamma(lda_model, corpus, seed):
+    lda_model.random_state = np.random.RandomState(seed)
+    gamma, _ = lda_model.inference(corpus)
+
+    return gamma
+
+
+def _infer(lda_model, corpus, seed, **kwargs):
+    tf_matrix = corpus2csc(corpus, num_terms=lda_model.num_terms).T.tocsr()
+
+    return inference.infer_topics(tf_matrix, lda_model.expElogbeta, lda_model.alpha, lda_model.iterations,
+                                  lda_model.gamma_threshold, np.random.RandomState(seed), **kwargs)
+
+
+@pytest.mark.parametrize('n_documents', [3, 80])
+def test_infer_topics_matches_gensim(lda, n_documents):
+    lda_model, corpus = lda
+    corpus = corpus[:n_documents]
+
+    assert np.allclose(_infer(lda_model, corpus, 1), _gensim_gamma(lda_model, corpus, 1), rtol=1e-4, atol=1e-4)
+
+
+def test_infer_topics_chunks(lda):
+    lda_model, corpus = lda
+
+    assert np.allclose(_infer(lda_model, corpus, 1, max_chunk_elements=50), _gensim_gamma(lda_model, corpus, 1),
+                       rtol=1e-4, atol=1e-4)
+
+
+def test_infer_topics_empty_documents(lda):
+    lda_model, corpus = lda
+    corpus = [corpus[0], [], corpus[1]]
+
+    gamma = _infer(lda_model, corpus, 1)
+
+    assert np.allclose(gamma[1], lda_model.alpha)
+    assert np.allclose(gamma, _gensim_gamma(lda_model, corpus, 1), rtol=1e-4, atol=1e-4)
+
+
+def test_gamma_to_topic_assignment():
+    gamma = np.array([[1.0, 3.0, 0.0], [0.5, 0.5, 99.0]])
+
+    assert inference.gamma_to_topic_assignment(gamma, 0.1) == [[(0, 0.25), (1, 0.75)], [(2, 0.99)]]
@@ -0,0 +1,159 @@
+import pytest
+
+from db import model_info_cache
+from db.model_info_cache import ModelInfoCache
+
+
+class Models:
+    """
+    Stand-in for the models collection: the model information and metadata version of each model, and the reads
+    """
+
+    def __init__(self):
+        self.models = {}
+        self.version_reads = 0
+        self.model_reads = 0
+
+    def write(self, model_id, **values):
+        model = self.models.setdefault(model_id, {'model_id': model_id})
+        model.update(values)
+        # as the $inc of db_utils._update_model_document
+        model['metadata_version'] = model.get('metadata_version', 0) + 1
+
+    def read_version(self, model_id):
+        self.version_reads += 1
+        return self.models[model_id].get('metadata_version')
+
+    def read_model_info(self, model_id):
+        self.model_reads += 1
+        model = self.models.get(model_id)
+        return None if model is None else {k: (list(v) if isinstance(v, list) else v) for k, v in model.items()}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(model_info_cache, 'time', lambda: now[0])
+
+    return now
+
+
+@pytest.fixture
+def models():
+    models = Models()
+    models.write('m', status='completed', tags=['a'])
+    models.write('n', status='completed')
+
+    return models
+
+
+def _get(cache, models, model_id='m'):
+    return cache.get(model_id, models.read_version, models.read_model_info)
+
+
+def test_hit_within_ttl(clock, models):
+    cache = ModelInfoCache(10, 8)
+
+    assert _get(cache, models)['status'] == 'completed'
+    clock[0] += 5
+    models.models['m']['status'] = 'written by another process'
+
+    assert _get(cache, models)['status'] == 'completed'
+    assert (models.model_reads, models.version_reads) == (1, 0)
+    assert cache.get_stats()['hits'] == 1 and cache.get_stats()['misses'] == 1
+
+
+def test_revalidation_with_the_same_version(clock, models):
+    cache = ModelInfoCache(10, 8)
+    _get(cache, models)
+
+    clock[0] += 11
+    assert _get(cache, models)['status'] == 'completed'
+    assert (models.model_reads, models.version_reads) == (1, 1)
+    assert cache.get_stats()['revalidations'] == 1
+
+    # the revalidation restarts the ttl
+    clock[0] += 5
+    _get(cache, models)
+    assert models.version_reads == 1
+
+
+def test_reload_after_a_version_bump(clock, models):
+    cache = ModelInfoCache(10, 8)
+    _get(cache, models)
+
+    models.write('m', status='updating')
+    clock[0] += 11
+
+    assert _get(cache, models)['status'] == 'updating'
+    assert (models.model_reads, models.version_reads) == (2, 1)
+
+
+def test_model_without_version_is_reloaded_after_its_first_write(clock):
+    models = Models()
+    models.models['old'] = {'model_id': 'old', 'status': 'completed'}
+    cache = ModelInfoCache(10, 8)
+    _get(cache, models, 'old')
+
+    clock[0] += 11
+    assert _get(cache, models, 'old')['status'] == 'completed'
+    assert models.model_reads == 1
+
+    models.write('old', status='updating')
+    clock[0] += 11
+    assert _get(cache, models, 'old')['status'] == 'updating'
+
+
+def test_deleted_model(clock, models):
+    cache = ModelInfoCache(10, 8)
+    _get(cache, models)
+
+    del models.models['m']
+    clock[0] += 11
+
+    assert _get(cache, models) is None
+    assert cache.get_stats()['entries'] == 0
+
+
+def test_lru_eviction(clock, models):
+    models.write('o', status='completed')
+    cache = ModelInfoCache(10, 2)
+    _get(cache, models, 'm')
+    _get(cache, models, 'n')
+    # 'm' becomes the most recently used, 'n' is dropped for 'o'
+    _get(cache, models, 'm')
+    _get(cache, models, 'o')
+    assert cache.get_stats()['entries'] == 2
+
+    reads = models.model_reads
+    _get(cache, models, 'm')
+    assert models.model_reads == reads
+    _get(cache, models, 'n')
+    assert models.model_reads == reads + 1
+
+
+def test_callers_get_a_copy(clock, models):
+    cache = ModelInfoCache(10, 8)
+
+    first = _get(cache, models)
+    first['status'] = 'changed by the caller'
+    first['tags'].append('b')
+
+    second = _get(cache, models)
+    assert second['status'] == 'completed'
+    assert second['tags'] == ['a']
+    assert second is not first
+
+
+def test_invalidate_and_disabled_cache(clock, models):
+    cache = ModelInfoCache(10, 8)
+    _get(cache, models)
+    cache.invalidate('m')
+    _get(cache, models)
+    assert models.model_reads == 2
+
+    disabled = ModelInfoCache(0, 8)
+    _get(disabled, models)
+    _get(disabled, models)
+    assert models.model_reads == 4
+    assert disabled.get_stats()['entries'] == 0
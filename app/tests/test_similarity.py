@@ -0,0 +1,143 @@
+import numpy as np
+import pytest
+from scipy.spatial import distance
+
+from model.similarity_index import DocumentTopicIndex, top_k
+
+n_topics = 12
+
+
+def _assignments(n_documents, seed=0):
+    random_state = np.random.RandomState(seed)
+    assignments = []
+    for i in range(n_documents):
+        weights = random_state.dirichlet([0.2] * n_topics)
+        assignments.append({'document_id': 'd{0:03d}'.format(i),
+                            'assigned_topics': [{'topic_id': int(t), 'topic_weight': float(weights[t])}
+                                                for t in np.flatnonzero(weights >= 0.01)]})
+    # a document without topics
+    assignments.append({'document_id': 'empty', 'assigned_topics': []})
+
+    return assignments
+
+
+@pytest.fixture(scope='module')
+def assignments():
+    return _assignments(200)
+
+
+@pytest.fixture(scope='module')
+def query():
+    return np.random.RandomState(1).dirichlet([0.2] * n_topics)
+
+
+def _dense_rows(index):
+    rows = index.distributions
+    return rows.toarray() if index.index_format == 'sparse' else rows
+
+
+def _reference(rows, query, metric):
+    scores = []
+    for row in rows.astype(np.float64):
+        if not row.any():
+            scores.append(0.0)
+        elif metric == 'cosine':
+            scores.append(1 - distance.cosine(row, query))
+        elif metric == 'hellinger':
+            scores.append(1 - np.sqrt(max(1 - np.sum(np.sqrt(row * query)), 0)))
+        else:
+            scores.append(1 - distance.jensenshannon(row, query, base=2) ** 2)
+
+    return np.array(scores)
+
+
+@pytest.mark.parametrize('index_format', ['dense', 'sparse'])
+def test_cosine_similarities(assignments, query, index_format):
+    index = DocumentTopicIndex.from_assignments(assignments, n_topics, index_format=index_format)
+
+    scores = index.similarities(query, 'cosine')
+
+    assert scores.shape == (len(assignments),)
+    assert np.allclose(scores, _reference(_dense_rows(index), query, 'cosine'), atol=1e-5)
+
+
+@pytest.mark.parametrize('index_format', ['dense', 'sparse'])
+def test_cosine_positions(assignments, query, index_format):
+    index = DocumentTopicIndex.from_assignments(assignments, n_topics, index_format=index_format)
+    positions = np.array([5, 0, 42])
+
+    assert np.allclose(index.similarities(query, 'cosine', positions), index.similarities(query, 'cosine')[positions])
+
+
+def test_search_returns_the_top_documents(assignments, query):
+    index = DocumentTopicIndex.from_assignments(assignments, n_topics)
+    scores = _reference(_dense_rows(index), query, 'cosine')
+
+    positions, similarities, similarity_method = index.search(query, 10)
+
+    assert list(positions) == list(np.argsort(-scores, kind='stable')[:10])
+    assert np.allclose(similarities, np.sort(scores)[::-1][:10], atol=1e-5)
+    assert similarity_method == 'cosine_exact'
+
+
+def test_search_many_matches_search(assignments):
+    index = DocumentTopicIndex.from_assignments(assignments, n_topics)
+    queries = np.random.RandomState(2).dirichlet([0.2] * n_topics, 5)
+
+    results = index.search_many(queries, 10, max_block_elements=2 * len(index))
+
+    for query, (positions, similarities, _) in zip(queries, results):
+        expected_positions, expected_similarities, _ = index.search(query, 10)
+        assert list(positions) == list(expected_positions)
+        assert np.allclose(similarities, expected_similarities)
+
+
+def test_top_k():
+    scores = np.array([0.2, 0.9, 0.5, 0.9, 0.1])
+
+    assert list(top_k(scores, 3)) == [1, 3, 2]
+    assert list(top_k(scores)) == [1, 3, 2, 0, 4]
+
+
+def test_zero_query(assignments):
+    index = DocumentTopicIndex.from_assignments(assignments, n_topics)
+
+    assert not index.similarities(np.zeros(n_topics), 'cosine').any()
+
+
+def test_unknown_metric(assignments, query):
+    index = DocumentTopicIndex.from_assignments(assignments, n_topics)
+
+    with pytest.raises(ValueError):
+        index.similarities(query, 'euclidean')
+
+
+@pytest.mark.parametrize('index_format', ['dense', 'sparse'])
+@pytest.mark.parametrize('metric', ['hellinger', 'jensen_shannon'])
+def test_distribution_similarities(assignments, query, index_format, metric):
+    index = DocumentTopicIndex.from_assignments(assignments, n_topics, index_format=index_format)
+
+    scores = index.similarities(query, metric)
+
+    assert scores.min() >= 0 and scores.max() <= 1
+    assert np.allclose(scores, _reference(_dense_rows(index), query, metric), atol=1e-4)
+
+
+@pytest.mark.parametrize('metric', ['hellinger', 'jensen_shannon'])
+def test_distribution_similarities_formats_agree(assignments, metric):
+    dense = DocumentTopicIndex.from_assignments(assignments, n_topics, index_format='dense')
+    csr = DocumentTopicIndex.from_assignments(assignments, n_topics, index_format='sparse')
+    # a query sharing only some topics with the documents
+    query = np.zeros(n_topics)
+    query[[0, 3]] = [0.7, 0.3]
+    positions = np.array([7, 3, 200])
+
+    assert np.allclose(dense.similarities(query, metric), csr.similarities(query, metric), atol=1e-5)
+    assert np.allclose(csr.similarities(query, metric, positions), csr.similarities(query, metric)[positions])
+
+
+@pytest.mark.parametrize('metric', ['hellinger', 'jensen_shannon'])
+def test_identical_distribution(assignments, metric):
+    index = DocumentTopicIndex.from_assignments(assignments, n_topics)
+
+    assert np.isclose(index.similarities(index.get_vector('d010'), metric)[10], 1.0, atol=1e-3)
@@ -0,0 +1,266 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import config
+from model import similarity_index
+from model.similarity_index import DocumentTopicIndex, SegmentedIndex
+
+files_prefix = 'model'
+n_topics = 4
+
+
+def _assignment(document_id, topic_id):
+    return {'document_id': document_id, 'assigned_topics': [{'topic_id': topic_id, 'topic_weight': 1.0}]}
+
+
+def _topic(index, document_id):
+    vector = index.get_vector(document_id)
+    return None if vector is None else int(np.argmax(vector))
+
+
+@pytest.fixture
+def index_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, 'data_path', str(tmp_path))
+    # the compactions are run by the tests, not in background
+    monkeypatch.setattr(config, 'similarity_compaction_interval', 10 ** 9)
+    monkeypatch.setattr(config, 'similarity_delta_max_documents', 10 ** 9)
+
+    file_path = similarity_index.get_index_file_path(files_prefix)
+    wal_file_path = similarity_index.get_log_file_path(files_prefix)
+
+    # as build_index, without the db
+    with similarity_index._locked_log(wal_file_path, 'a+b') as log:
+        log.write(similarity_index.new_log_header())
+        log.flush()
+        wal_generation, _ = similarity_index.read_log_header(log)
+        wal_offset = os.fstat(log.fileno()).st_size
+
+    main = DocumentTopicIndex.from_assignments([_assignment('d{0}'.format(i), i % n_topics) for i in range(10)],
+                                               n_topics, wal_offset, 0.0, 'sparse', wal_generation)
+    main.save(file_path)
+
+    return file_path, wal_file_path
+
+
+def _open(index_files):
+    file_path, wal_file_path = index_files
+    return SegmentedIndex(DocumentTopicIndex.load(file_path), file_path, wal_file_path)
+
+
+def test_refresh_reads_the_appended_assignments(index_files):
+    index = _open(index_files)
+
+    similarity_index.append_assignments(files_prefix, [_assignment('n1', 1), _assignment('d0', 3)])
+    index.refresh()
+
+    assert len(index) == 11
+    assert len(index.delta) == 2
+    assert _topic(index, 'n1') == 1
+    # the delta row supersedes the main row
+    assert _topic(index, 'd0') == 3
+    assert index.superseded.sum() == 1
+
+
+def test_search_skips_superseded_rows(index_files):
+    index = _open(index_files)
+
+    similarity_index.append_assignments(files_prefix, [_assignment('d0', 3)])
+    index.refresh()
+
+    document_ids, scores, _ = index.search([1, 0, 0, 0], 5)
+    assert list(document_ids[scores > 0]) == ['d4', 'd8']
+    document_ids, scores, _ = index.search([0, 0, 0, 1], 5)
+    assert sorted(document_ids[scores > 0]) == ['d0', 'd3', 'd7']
+    assert len(index.search([0, 0, 0, 1])[0]) == len(index) == 10
+
+    document_ids, _ = index.topic_documents([0], 0.5)
+    assert sorted(document_ids) == ['d4', 'd8']
+
+
+def test_partial_line_is_read_on_the_next_refresh(index_files):
+    index = _open(index_files)
+    _, wal_file_path = index_files
+
+    with open(wal_file_path, 'ab') as f:
+        f.write(b'{"document_id": "n1", "assigned_topics": [{"topic_id": 2, ')
+    index.refresh()
+    assert index.get_vector('n1') is None
+
+    with open(wal_file_path, 'ab') as f:
+        f.write(b'"topic_weight": 1.0}]}\n')
+    index.refresh()
+    assert _topic(index, 'n1') == 2
+
+
+def test_compact_rotates_the_log(index_files):
+    file_path, wal_file_path = index_files
+    index = _open(index_files)
+    generation = index.wal_generation
+
+    similarity_index.append_assignments(files_prefix, [_assignment('n1', 1), _assignment('d0', 3)])
+    index.refresh()
+    main = index.compact()
+
+    assert index.delta is None
+    assert len(main) == 11
+    assert index.wal_generation != generation
+    assert similarity_index.read_log_header(open(wal_file_path, 'rb'))[0] == index.wal_generation
+    assert os.path.getsize(wal_file_path) == index.wal_offset
+
+    saved = DocumentTopicIndex.load(file_path)
+    assert saved.wal_generation == index.wal_generation
+    assert _topic(saved, 'd0') == 3
+
+    similarity_index.append_assignments(files_prefix, [_assignment('n2', 2)])
+    index.refresh()
+    assert _topic(index, 'n2') == 2
+    assert len(index) == 12
+
+
+def test_other_index_follows_the_rotation(index_files):
+    index = _open(index_files)
+    other = _open(index_files)
+
+    similarity_index.append_assignments(files_prefix, [_assignment('n1', 1), _assignment('d0', 3)])
+    index.refresh()
+    other.refresh()
+    index.compact()
+    similarity_index.append_assignments(files_prefix, [_assignment('n2', 2)])
+    other.refresh()
+
+    assert other.wal_generation == index.wal_generation
+    assert len(other) == 12
+    assert _topic(other, 'd0') == 3
+    assert _topic(other, 'n2') == 2
+    assert len(other.delta) == 1
+
+
+def test_stale_compaction_is_dropped(index_files):
+    index = _open(index_files)
+    other = _open(index_files)
+
+    similarity_index.append_assignments(files_prefix, [_assignment('n1', 1)])
+    index.refresh()
+    other.refresh()
+    other.compact()
+
+    main = index.main
+    assert index.compact() is main
+    assert index.wal_generation != other.wal_generation
+
+    index.refresh()
+    assert index.wal_generation == other.wal_generation
+    assert _topic(index, 'n1') == 1
+
+
+def test_concurrent_compactions(index_files):
+    index = _open(index_files)
+
+    for i in range(50):
+        similarity_index.append_assignments(files_prefix, [_assignment('c{0}'.format(i), i % n_topics)])
+    index.refresh()
+
+    threads = [threading.Thread(target=index.compact) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reopened = _open(index_files)
+    reopened.refresh()
+
+    assert len(index) == len(reopened) == 60
+    assert all(_topic(reopened, 'c{0}'.format(i)) == i % n_topics for i in range(50))
+
+
+def test_append_during_compaction_is_kept(index_files, monkeypatch):
+    index = _open(index_files)
+    similarity_index.append_assignments(files_prefix, [_assignment('n1', 1)])
+    index.refresh()
+
+    saving = threading.Event()
+    appended = threading.Event()
+    appended_while_saving = []
+    save = DocumentTopicIndex.save
+
+    def slow_save(self, file_path):
+        saving.set()
+        appended_while_saving.append(appended.wait(5))
+        save(self, file_path)
+
+    monkeypatch.setattr(DocumentTopicIndex, 'save', slow_save)
+    compaction = threading.Thread(target=index.compact)
+    compaction.start()
+    saving.wait()
+    # the writers are not blocked by the save of the compacted index
+    similarity_index.append_assignments(files_prefix, [_assignment('n2', 2)])
+    appended.set()
+    compaction.join()
+
+    assert appended_while_saving == [True]
+    index.refresh()
+    assert _topic(index, 'n1') == 1
+    assert _topic(index, 'n2') == 2
+    assert index.delta is not None and len(index.delta) == 1
+    assert not [f for f in os.listdir(config.data_path) if f.endswith(('.tmp', '.compacted'))]
+
+
+@pytest.fixture
+def index_cache(monkeypatch):
+    monkeypatch.setattr(similarity_index, '_indexes', {})
+    monkeypatch.setattr(similarity_index, '_index_locks', {})
+    monkeypatch.setattr(similarity_index, '_deleted_indexes', set())
+
+
+def test_invalidate_during_build(index_files, index_cache, monkeypatch):
+    file_path, wal_file_path = index_files
+    os.remove(file_path)
+    model_info = {'model_id': 'm', 'files_prefix': files_prefix, 'number_of_topics': n_topics}
+
+    building = threading.Event()
+    invalidating = threading.Event()
+
+    def slow_build_index(info):
+        building.set()
+        invalidating.wait(5)
+        index = DocumentTopicIndex.from_assignments([_assignment('d0', 0)], n_topics, 0, 0.0, 'sparse')
+        index.save(file_path)
+        return index
+
+    monkeypatch.setattr(similarity_index, 'build_index', slow_build_index)
+    builder = threading.Thread(target=similarity_index.get_index, args=(model_info,))
+    builder.start()
+    building.wait()
+
+    # the model is deleted while its index is being built
+    invalidator = threading.Thread(target=similarity_index.invalidate_index, args=('m', files_prefix))
+    invalidator.start()
+    # leaves the invalidation the time to wait for the build
+    time.sleep(0.1)
+    invalidating.set()
+    builder.join()
+    invalidator.join()
+
+    assert not os.path.exists(file_path)
+    assert not os.path.exists(wal_file_path)
+    assert similarity_index.get_stats()['entries'] == 0
+    with pytest.raises(KeyError):
+        similarity_index.get_index(model_info)
+    assert not os.path.exists(file_path)
+
+
+def test_invalidate_keeps_the_files_without_prefix(index_files, index_cache):
+    file_path, _ = index_files
+    model_info = {'model_id': 'm', 'files_prefix': files_prefix, 'number_of_topics': n_topics}
+
+    first = similarity_index.get_index(model_info)
+    similarity_index.invalidate_index('m')
+    second = similarity_index.get_index(model_info)
+
+    assert second is not first
+    assert len(second) == 10
+    assert os.path.exists(file_path)
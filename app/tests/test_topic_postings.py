@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from model.similarity_index import DocumentTopicIndex
+
+n_topics = 8
+
+
+@pytest.fixture(scope='module')
+def assignments():
+    random_state = np.random.RandomState(0)
+    assignments = []
+    for i in range(300):
+        weights = random_state.dirichlet([0.1] * n_topics) * 0.98
+        assignments.append({'document_id': 'd{0:03d}'.format(i),
+                            'assigned_topics': [{'topic_id': int(t), 'topic_weight': float(weights[t])}
+                                                for t in np.flatnonzero(weights >= 0.001)]})
+
+    return assignments
+
+
+@pytest.fixture(scope='module', params=['sparse', 'dense'])
+def index(request, assignments):
+    # the weights under the prune threshold are not in the rows of the index, the posting lists have them anyway
+    return DocumentTopicIndex.from_assignments(assignments, n_topics, prune_threshold=0.01, index_format=request.param)
+
+
+def _weights(assignments):
+    return {a['document_id']: {t['topic_id']: t['topic_weight'] for t in a['assigned_topics']} for a in assignments}
+
+
+def _reference(assignments, topic_ids, threshold, operator):
+    # as the $elemMatch queries on the db assignments: the document must have the topic, with a weight >= threshold
+    match = all if operator == 'and' else any
+    scores = {}
+    for document_id, weights in _weights(assignments).items():
+        selected = [t for t in dict.fromkeys(topic_ids) if t in weights and weights[t] >= threshold]
+        if match(t in selected for t in topic_ids):
+            scores[document_id] = sum(weights[t] for t in selected)
+
+    return scores
+
+
+def _search(index, topic_ids, threshold=0.0, limit=None, operator='and'):
+    positions, scores = index.get_topic_postings().search(topic_ids, threshold, limit, operator)
+    return [str(d) for d in index.document_ids[positions]], scores
+
+
+@pytest.mark.parametrize('threshold', [0.0, 0.005, 0.01, 0.2])
+def test_documents_threshold_cut(index, assignments, threshold):
+    expected = _reference(assignments, [3], threshold, 'and')
+
+    document_ids, weights = _search(index, [3], threshold)
+
+    assert set(document_ids) == set(expected)
+    assert np.allclose(weights, [expected[d] for d in document_ids], atol=1e-6)
+    assert np.all(np.diff(weights) <= 0)
+    assert np.all(weights >= threshold)
+
+
+def test_documents_limit(index, assignments):
+    document_ids, weights = _search(index, [3], 0.05)
+    top_ids, top_weights = _search(index, [3], 0.05, 5)
+
+    assert top_ids == document_ids[:5]
+    assert np.array_equal(top_weights, weights[:5])
+
+
+@pytest.mark.parametrize('operator', ['and', 'or'])
+@pytest.mark.parametrize('threshold', [0.0, 0.1])
+def test_search_operators(index, assignments, operator, threshold):
+    expected = _reference(assignments, [1, 2, 5], threshold, operator)
+
+    document_ids, scores = _search(index, [1, 2, 5, 1], threshold, None, operator)
+
+    assert len(document_ids) == len(expected)
+    assert set(document_ids) == set(expected)
+    assert np.allclose(scores, [expected[d] for d in document_ids], atol=1e-5)
+    assert np.all(np.diff(scores) <= 0)
+
+
+@pytest.mark.parametrize('operator', ['and', 'or'])
+def test_search_limit(index, operator):
+    document_ids, scores = _search(index, [1, 2], 0.01, None, operator)
+    top_ids, top_scores = _search(index, [1, 2], 0.01, 3, operator)
+
+    assert top_ids == document_ids[:3]
+    assert np.array_equal(top_scores, scores[:3])
+
+
+def test_unknown_topic_and_operator(index):
+    assert _search(index, [n_topics + 1])[0] == []
+
+    with pytest.raises(ValueError):
+        _search(index, [1, 2], operator='xor')
+
+
+def test_pruned_weights_survive_save_and_merge(tmp_path, assignments):
+    index = DocumentTopicIndex.from_assignments(assignments[:200], n_topics, prune_threshold=0.01)
+    delta = DocumentTopicIndex.from_assignments(assignments[150:], n_topics, prune_threshold=0.01)
+    file_path = str(tmp_path / 'index.npz')
+    index.merge(delta).save(file_path)
+
+    merged = DocumentTopicIndex.load(file_path)
+    expected = _reference(assignments, [4], 0.0, 'and')
+    document_ids, weights = _search(merged, [4])
+
+    assert set(document_ids) == set(expected)
+    assert np.allclose(weights, [expected[d] for d in document_ids], atol=1e-6)